@@ -0,0 +1,296 @@
+import asyncio
+import contextvars
+import email.utils
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+from telemetry import API_REQUESTS, API_WAIT_SECONDS, SCHEDULER_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Per-process request budgets; 0 disables the limit
+CHAT_REQUESTS_PER_MINUTE = float(os.environ.get("STORYGEN_CHAT_RPM", "500"))
+IMAGES_PER_MINUTE = float(os.environ.get("STORYGEN_IMAGES_PER_MINUTE", "50"))
+# Bucket capacity, in seconds worth of budget, that may be spent in one burst
+API_BURST_SECONDS = float(os.environ.get("STORYGEN_API_BURST_SECONDS", "10"))
+API_MAX_RETRIES = int(os.environ.get("STORYGEN_API_MAX_RETRIES", "5"))
+API_BACKOFF_BASE_SECONDS = float(os.environ.get("STORYGEN_API_BACKOFF_BASE_SECONDS", "1"))
+API_BACKOFF_MAX_SECONDS = float(os.environ.get("STORYGEN_API_BACKOFF_MAX_SECONDS", "60"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("STORYGEN_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("STORYGEN_HTTP_TIMEOUT_SECONDS", "120"))
+# How often an async call that is not first in line checks the queue again
+ASYNC_POLL_SECONDS = 0.01
+
+# Lower value goes first when requests are waiting for the same budget
+INTERACTIVE = 0
+BATCH = 1
+
+# Priority of the calls made in the current context; the batch CLI switches it to BATCH
+request_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst_seconds=API_BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self, now):
+        # Takes a token and returns 0, or returns the seconds until one is available
+        if self.rate <= 0:
+            return 0.0
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, until):
+        # The server asked everyone to back off (Retry-After)
+        self.paused_until = max(self.paused_until, until)
+
+
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time()) if retry_at else None
+
+
+def is_retryable(error):
+    # The SDK is only imported by code that already hit an API error or built a client
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+class RequestScheduler:
+    """Every chat and image call of the process goes through call() or call_async().
+
+    Each kind of call has a token bucket; waiting calls take tokens in priority order,
+    and retryable failures (429, 5xx, connection errors) are retried with jittered
+    exponential backoff that honours Retry-After. Threads and coroutines share the
+    same buckets and queue, so the budgets hold for the whole process.
+    """
+
+    def __init__(self, limits=None, max_retries=API_MAX_RETRIES, backoff_base=API_BACKOFF_BASE_SECONDS,
+                 backoff_max=API_BACKOFF_MAX_SECONDS, burst_seconds=API_BURST_SECONDS, max_in_flight=0):
+        limits = limits if limits is not None else {"chat": CHAT_REQUESTS_PER_MINUTE, "image": IMAGES_PER_MINUTE}
+        self.limit_in_flight(max_in_flight)
+        self.buckets = {kind: TokenBucket(per_minute, burst_seconds) for kind, per_minute in limits.items()}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cond = threading.Condition()
+        self._waiting = {kind: [] for kind in self.buckets}
+        self._sequence = itertools.count()
+        self._stats = {kind: {"calls": 0, "retries": 0, "throttled": 0, "failures": 0, "wait_total_s": 0.0,
+                              "wait_max_s": 0.0} for kind in self.buckets}
+
+    def limit_in_flight(self, max_in_flight):
+        # At most this many call() attempts of any kind run at once (0 = no limit). A streamed completion
+        # holds its slot until the response starts. call_async() is bounded by its callers instead.
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+
+    def _run(self, fn, args, kwargs):
+        in_flight = self._in_flight
+        if in_flight is None:
+            return fn(*args, **kwargs)
+        with in_flight:
+            return fn(*args, **kwargs)
+
+    def acquire(self, kind, priority=None):
+        # Blocks until the bucket for kind has a token and no higher priority call is waiting
+        priority = request_priority.get() if priority is None else priority
+        bucket = self.buckets[kind]
+        start = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting[kind], ticket)
+            self._queue_changed(kind)
+            while True:
+                if self._waiting[kind][0] == ticket:
+                    wait = bucket.reserve(time.monotonic())
+                    if wait <= 0:
+                        heapq.heappop(self._waiting[kind])
+                        self._queue_changed(kind)
+                        self._cond.notify_all()
+                        break
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+            waited = time.monotonic() - start
+            self._record_wait(kind, waited)
+        return waited
+
+    async def acquire_async(self, kind, priority=None):
+        # acquire() for coroutines: sleeps on the event loop instead of blocking a thread
+        priority = request_priority.get() if priority is None else priority
+        bucket = self.buckets[kind]
+        start = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting[kind], ticket)
+            self._queue_changed(kind)
+        try:
+            while True:
+                with self._cond:
+                    if self._waiting[kind][0] == ticket:
+                        wait = bucket.reserve(time.monotonic())
+                        if wait <= 0:
+                            heapq.heappop(self._waiting[kind])
+                            self._queue_changed(kind)
+                            self._cond.notify_all()
+                            break
+                    else:
+                        wait = ASYNC_POLL_SECONDS
+                await asyncio.sleep(wait)
+        except BaseException:
+            # A cancelled request must not block the queue behind it
+            with self._cond:
+                if ticket in self._waiting[kind]:
+                    self._waiting[kind].remove(ticket)
+                    heapq.heapify(self._waiting[kind])
+                    self._queue_changed(kind)
+                    self._cond.notify_all()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._record_wait(kind, waited)
+        return waited
+
+    def _queue_changed(self, kind):
+        # Called with _cond held, after a call joins or leaves the queue
+        SCHEDULER_QUEUE_DEPTH.set(len(self._waiting[kind]), kind=kind)
+
+    def _record_wait(self, kind, waited):
+        stats = self._stats[kind]
+        stats["wait_total_s"] += waited
+        stats["wait_max_s"] = max(stats["wait_max_s"], waited)
+
+    def backoff(self, attempt, error):
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # Full jitter keeps retrying workers from hitting the API in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _start_attempt(self, kind, waited):
+        API_WAIT_SECONDS.observe(waited, kind=kind)
+        with self._cond:
+            self._stats[kind]["calls"] += 1
+
+    def _failed_attempt(self, kind, attempt, error):
+        # Returns the delay before the next attempt, or False when the error must be raised
+        stats = self._stats[kind]
+        status_code = getattr(error, "status_code", None)
+        API_REQUESTS.inc(kind=kind, outcome=str(status_code) if status_code else type(error).__name__)
+        if not is_retryable(error) or attempt == self.max_retries:
+            with self._cond:
+                stats["failures"] += 1
+            return False
+        delay = self.backoff(attempt, error)
+        with self._cond:
+            stats["retries"] += 1
+            if status_code == 429:
+                stats["throttled"] += 1
+                self.buckets[kind].pause(time.monotonic() + delay)
+                self._cond.notify_all()
+        logger.warning("%s request failed (%s), retry %d in %.1fs", kind, str(error), attempt + 1, delay)
+        return delay
+
+    def call(self, kind, fn, *args, priority=None, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self._start_attempt(kind, self.acquire(kind, priority))
+            try:
+                result = self._run(fn, args, kwargs)
+            except Exception as e:
+                delay = self._failed_attempt(kind, attempt, e)
+                if delay is False:
+                    raise
+                time.sleep(delay)
+                continue
+            API_REQUESTS.inc(kind=kind, outcome="ok")
+            return result
+
+    async def call_async(self, kind, fn, *args, priority=None, **kwargs):
+        # call() for coroutine functions, e.g. the AsyncOpenAI client methods
+        for attempt in range(self.max_retries + 1):
+            self._start_attempt(kind, await self.acquire_async(kind, priority))
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._failed_attempt(kind, attempt, e)
+                if delay is False:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            API_REQUESTS.inc(kind=kind, outcome="ok")
+            return result
+
+    def stats(self):
+        with self._cond:
+            result = {}
+            for kind, stats in self._stats.items():
+                result[kind] = dict(stats, queue_depth=len(self._waiting[kind]))
+                result[kind]["wait_avg_s"] = stats["wait_total_s"] / stats["calls"] if stats["calls"] else 0.0
+            return result
+
+
+def create_openai_client(**kwargs):
+    # One pooled HTTP client per process; retries are the scheduler's job, not the SDK's.
+    # openai and httpx take a few hundred ms to import, so they load with the first client.
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+        timeout=HTTP_TIMEOUT_SECONDS
+    )
+    kwargs.setdefault("api_key", os.environ.get("OPENAI_API_KEY", "key"))
+    return OpenAI(max_retries=0, timeout=HTTP_TIMEOUT_SECONDS, http_client=http_client, **kwargs)
+
+
+def create_async_openai_client(**kwargs):
+    # The AsyncOpenAI counterpart; its pool belongs to the event loop that first uses it
+    import httpx
+    from openai import AsyncOpenAI
+
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+        timeout=HTTP_TIMEOUT_SECONDS
+    )
+    kwargs.setdefault("api_key", os.environ.get("OPENAI_API_KEY", "key"))
+    return AsyncOpenAI(max_retries=0, timeout=HTTP_TIMEOUT_SECONDS, http_client=http_client, **kwargs)
+
+
+scheduler = RequestScheduler()
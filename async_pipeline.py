@@ -0,0 +1,288 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from api_scheduler import scheduler
+from image_generation import (current_backend, lookup_prompts, keep_prompts, lookup_image, keep_image, write_frame,
+                              fail_frame, frame_event, frame_result, finish_job, needs_final, JobCheckpoint,
+                              IMAGE_CONCURRENCY, STREAM_PROMPTS, RENDER_TIERS, RENDER_TIER)
+from long_story import is_long_story, key_event_requests, merge_key_events, LONG_STORY_WORKERS
+from prompt_parser import PromptStreamParser, parse_prompts
+from prompt_template import PROMPT_GENERATION_TEMPLATE
+from telemetry import span, current_job_id, new_job_id, FRAMES
+
+# The pipeline of image_generation on the AsyncOpenAI client: one event loop serves many comics,
+# with threads only for file, SQLite and PDF work.
+logger = logging.getLogger(__name__)
+
+# Image calls in flight across all jobs of the event loop; each holds a decoded PNG in memory
+ASYNC_IMAGE_CONCURRENCY = int(os.environ.get("STORYGEN_ASYNC_IMAGE_CONCURRENCY", "32"))
+# Threads rendering PDFs; create_pdf is CPU-bound, so more than the core count only adds memory
+PDF_WORKERS = int(os.environ.get("STORYGEN_PDF_WORKERS", "2"))
+
+# asyncio semaphores belong to one event loop
+_image_slots = weakref.WeakKeyDictionary()
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+
+def image_slots():
+    loop = asyncio.get_running_loop()
+    slots = _image_slots.get(loop)
+    if slots is None:
+        slots = _image_slots[loop] = asyncio.Semaphore(max(1, ASYNC_IMAGE_CONCURRENCY))
+    return slots
+
+
+def pdf_executor():
+    global _pdf_executor
+    if _pdf_executor is None:
+        with _pdf_executor_lock:
+            if _pdf_executor is None:
+                _pdf_executor = ThreadPoolExecutor(max_workers=max(1, PDF_WORKERS), thread_name_prefix="pdf")
+    return _pdf_executor
+
+
+async def chat_completion_async(prompt):
+    with span("chat", prompt_chars=len(prompt)):
+        return await scheduler.call_async("chat", current_backend().complete_async, prompt)
+
+
+async def prompt_request_async(story_content, num_frames, art_style):
+    if is_long_story(story_content):
+        requests = key_event_requests(story_content, num_frames)
+        limit = asyncio.Semaphore(max(1, LONG_STORY_WORKERS))
+
+        async def complete(request):
+            async with limit:
+                return await chat_completion_async(request)
+
+        story_content = merge_key_events(await asyncio.gather(*(complete(request) for request in requests)))
+    return PROMPT_GENERATION_TEMPLATE.format(story=story_content, number=num_frames, style=art_style)
+
+
+async def generate_prompts_async(story_content, num_frames, art_style):
+    cache, key, cached_prompts = await asyncio.to_thread(lookup_prompts, story_content, num_frames, art_style)
+    if cached_prompts is not None:
+        return cached_prompts
+
+    with span("prompts", frames=num_frames):
+        prompt = await prompt_request_async(story_content, num_frames, art_style)
+        prompts = parse_prompts(await chat_completion_async(prompt))[:num_frames]
+    await asyncio.to_thread(keep_prompts, cache, key, prompts)
+    return prompts
+
+
+async def stream_prompts_async(story_content, num_frames, art_style):
+    cache, key, cached_prompts = await asyncio.to_thread(lookup_prompts, story_content, num_frames, art_style)
+    if cached_prompts is not None:
+        for prompt in cached_prompts:
+            yield prompt
+        return
+
+    with span("prompts", frames=num_frames, streamed=True):
+        prompt = await prompt_request_async(story_content, num_frames, art_style)
+        stream = await scheduler.call_async("chat", current_backend().stream_async, prompt)
+
+        parser = PromptStreamParser()
+        prompts = []
+        async for text in stream:
+            for finished_prompt in parser.feed(text)[:num_frames - len(prompts)]:
+                prompts.append(finished_prompt)
+                yield finished_prompt
+            if len(prompts) >= num_frames:
+                await stream.aclose()
+                break
+        else:
+            for finished_prompt in parser.close()[:num_frames - len(prompts)]:
+                prompts.append(finished_prompt)
+                yield finished_prompt
+
+    await asyncio.to_thread(keep_prompts, cache, key, prompts)
+
+
+async def create_image_async(prompt, model="dall-e-3", size="1024x1024", quality="standard"):
+    logger.debug("Creating image with prompt: %s", prompt)
+    if not prompt:
+        raise ValueError("Empty prompt provided to create_image function")
+
+    async with image_slots():
+        with span("image", model=model, size=size):
+            return await scheduler.call_async("image", current_backend().create_image_async, prompt, model=model,
+                                              size=size, quality=quality)
+
+
+async def fetch_image_async(prompt, model="dall-e-3", size="1024x1024", quality="standard"):
+    cache, image_data = await asyncio.to_thread(lookup_image, prompt, model, size, quality)
+    if image_data is not None:
+        return image_data, True
+
+    image_data = await create_image_async(prompt, model=model, size=size, quality=quality)
+    await asyncio.to_thread(keep_image, cache, prompt, image_data, model, size, quality)
+    return image_data, False
+
+
+async def generate_frame_async(i, prompt, output_dir="images", save=None, tier="final"):
+    frame = {"index": i, "prompt": prompt, "tier": tier}
+    try:
+        image_data, from_cache = await fetch_image_async(prompt, **RENDER_TIERS[tier])
+        # Writing and hashing a 2 MB PNG would stall every other job on the loop
+        await asyncio.to_thread(write_frame, frame, image_data, from_cache, output_dir, save)
+    except Exception as e:
+        fail_frame(frame, e)
+    FRAMES.inc(status=frame["status"], tier=tier)
+    return frame
+
+
+async def _saved_prompts(prompts):
+    for prompt in prompts:
+        yield prompt
+
+
+async def _resume_prompts(saved_prompts, prompts):
+    # image_generation.resume_prompts for an async prompt stream
+    i = 0
+    try:
+        async for prompt in prompts:
+            yield saved_prompts[i] if i < len(saved_prompts) else prompt
+            i += 1
+    finally:
+        # Closes the chat stream when the job stops early
+        await prompts.aclose()
+
+
+async def _run_job(story_content, num_frames, art_style, max_workers, stream, output_dir, tier, events):
+    # Puts the frame events of iter_story_frames on events, then None
+    try:
+        logger.info("Job started: %d frames, %s style, %s tier, %d characters", num_frames, art_style, tier,
+                    len(story_content))
+        statuses = []
+        with span("job", frames=num_frames, mode="async", tier=tier) as job_span:
+            checkpoint = await asyncio.to_thread(JobCheckpoint, story_content, num_frames, art_style, tier)
+            if checkpoint.complete:
+                prompts = _saved_prompts(checkpoint.saved_prompts)
+            else:
+                if stream:
+                    prompts = stream_prompts_async(story_content, num_frames, art_style)
+                else:
+                    prompts = _saved_prompts(await generate_prompts_async(story_content, num_frames, art_style))
+                if checkpoint.saved_prompts:
+                    prompts = _resume_prompts(checkpoint.saved_prompts, prompts)
+
+            limit = asyncio.Semaphore(max(1, max_workers))
+
+            async def run_frame(i, prompt):
+                async with limit:
+                    await events.put(frame_event(i, prompt, tier, "generating"))
+                    frame = await generate_frame_async(i, prompt, output_dir, tier=tier)
+                await asyncio.to_thread(checkpoint.save_frame, frame)
+                statuses.append(frame["status"])
+                await events.put(frame)
+
+            tasks = []
+            try:
+                all_prompts = []
+                i = 0
+                async for prompt in prompts:
+                    all_prompts.append(prompt)
+                    await asyncio.to_thread(checkpoint.prompt_added, all_prompts)
+                    restored = await asyncio.to_thread(checkpoint.restore, i, prompt, output_dir)
+                    if restored is not None:
+                        statuses.append(restored["status"])
+                        await events.put(restored)
+                    else:
+                        await events.put(frame_event(i, prompt, tier, "queued"))
+                        tasks.append(asyncio.create_task(run_frame(i, prompt)))
+                    i += 1
+
+                await asyncio.to_thread(checkpoint.prompts_done, all_prompts)
+                await asyncio.gather(*tasks)
+            finally:
+                # Only left running when the job is cancelled or the prompts failed
+                for task in tasks:
+                    task.cancel()
+                await prompts.aclose()
+
+            finish_job(job_span, statuses)
+    finally:
+        events.put_nowait(None)
+
+
+async def iter_story_frames_async(story_content, num_frames, art_style, max_workers=None, stream=None,
+                                  output_dir="images", job_id=None, tier=None):
+    # The async counterpart of image_generation.iter_story_frames: the same frame events, from a task
+    # that runs with current_job_id set. Closing the generator cancels the job.
+    if stream is None:
+        stream = STREAM_PROMPTS
+    if max_workers is None:
+        max_workers = IMAGE_CONCURRENCY
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    events = asyncio.Queue()
+    context = contextvars.copy_context()
+    context.run(current_job_id.set, job_id or new_job_id())
+    job = asyncio.create_task(
+        _run_job(story_content, num_frames, art_style, max_workers, stream, output_dir, tier or RENDER_TIER, events),
+        context=context)
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        # Raises what failed the job, e.g. the prompt request
+        await job
+    finally:
+        if not job.done():
+            job.cancel()
+
+
+async def process_story_async(story_content, num_frames, art_style, max_workers=None, stream=None,
+                              output_dir="images", job_id=None, tier=None):
+    frames = {}
+    async for frame in iter_story_frames_async(story_content, num_frames, art_style, max_workers, stream, output_dir,
+                                               job_id, tier):
+        frames[frame["index"]] = frame
+    return [frame_result(frames[i]) for i in sorted(frames)]
+
+
+async def iter_finalized_frames_async(frames, max_workers=None, output_dir="images", job_id=None):
+    # Yields each draft or failed frame again, rendered at full quality from its prompt, as soon as it lands.
+    # Frames that are already final are skipped.
+    if max_workers is None:
+        max_workers = IMAGE_CONCURRENCY
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    limit = asyncio.Semaphore(max(1, max_workers))
+
+    async def run_frame(frame):
+        async with limit:
+            return await generate_frame_async(frame["index"], frame["prompt"], output_dir, tier="final")
+
+    context = contextvars.copy_context()
+    context.run(current_job_id.set, job_id or new_job_id())
+    tasks = [asyncio.create_task(run_frame(frame), context=context) for frame in frames if needs_final(frame)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def render_pdf_async(*args, job_id=None, **kwargs):
+    # create_pdf in the PDF thread pool, so layout and image encoding never block the event loop
+    from comic_pdf import create_pdf
+
+    context = contextvars.copy_context()
+    if job_id is not None:
+        context.run(current_job_id.set, job_id)
+    call = functools.partial(context.run, create_pdf, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(pdf_executor(), call)
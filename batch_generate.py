@@ -0,0 +1,225 @@
+# Headless batch rendering: python batch_generate.py stories/ --output-dir batch_output
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import api_scheduler
+from api_scheduler import request_priority, BATCH
+from comic_pdf import create_pdf
+from image_generation import read_story_from_file, iter_story_frames, SUCCESS_FRAME_STATUSES, IMAGE_CONCURRENCY
+from telemetry import configure_logging, current_job_id, run_in_job
+
+logger = logging.getLogger(__name__)
+
+STORY_DEFAULTS = {
+    "title": None,
+    "num_frames": 2,
+    "art_style": "comic",
+    "font_size": 12,
+    "custom_layout": None,
+    "border_thickness": 3,
+    "dialogue_position": "Inside Bottom",
+    "frame_color": "#4A4A4A",
+    "full_fill": False,
+    "layout_style": "default"
+}
+
+
+def load_stories(input_path, defaults):
+    # A directory of .txt files, or a JSONL manifest with "path" or "story" plus optional per-story settings
+    entries = []
+    if os.path.isdir(input_path):
+        for name in sorted(os.listdir(input_path)):
+            if name.endswith(".txt"):
+                entries.append({"id": os.path.splitext(name)[0], "path": os.path.join(input_path, name)})
+    else:
+        with open(input_path, 'r', encoding='utf-8') as file:
+            for line_number, line in enumerate(file, 1):
+                if line.strip():
+                    entry = json.loads(line)
+                    entry.setdefault("id", os.path.splitext(os.path.basename(entry.get("path", "")))[0]
+                                     or f"story_{line_number}")
+                    entries.append(entry)
+
+    stories, seen = [], set()
+    for entry in entries:
+        story = dict(defaults)
+        story.update(entry)
+        # Story ids name the output directories, keep them unique
+        story_id, suffix = story["id"], 2
+        while story["id"] in seen:
+            story["id"] = f"{story_id}_{suffix}"
+            suffix += 1
+        seen.add(story["id"])
+        if story["title"] is None:
+            story["title"] = story_id.replace("_", " ").title()
+        stories.append(story)
+    return stories
+
+
+def generate_story_frames(story, output_dir, image_executor):
+    # API stage: prompts and images, with image calls drawn from the shared executor
+    start = time.perf_counter()
+    story_content = story["story"] if "story" in story else read_story_from_file(story["path"])
+    workspace = os.path.join(output_dir, story["id"])
+    os.makedirs(workspace, exist_ok=True)
+
+    frames = {}
+    for frame in iter_story_frames(story_content, int(story["num_frames"]), story["art_style"],
+                                   output_dir=workspace, executor=image_executor, job_id=story["id"]):
+        frames[frame["index"]] = frame
+    return story_content, workspace, [frames[i] for i in sorted(frames)], time.perf_counter() - start
+
+
+def compose_pdf(images, story_content, story, pdf_path):
+    # Runs in the PDF process pool, so it only takes picklable arguments
+    current_job_id.set(story["id"])
+    start = time.perf_counter()
+    create_pdf(images, story_content, story["title"], story["font_size"], story["custom_layout"],
+               story["border_thickness"], story["dialogue_position"], story["frame_color"],
+               story["full_fill"], story["layout_style"], pdf_path=pdf_path)
+    return time.perf_counter() - start
+
+
+def compose_share_images(images, story, workspace, width):
+    # PNGs of the panel pages for social sharing, drawn by page_preview without reportlab; also runs in the
+    # PDF process pool. Returns (paths, seconds).
+    from page_preview import render_pages  # Only runs that write share images need NumPy
+
+    current_job_id.set(story["id"])
+    start = time.perf_counter()
+    pages = render_pages(images, story["title"], story["font_size"], story["custom_layout"],
+                         story["border_thickness"], story["dialogue_position"], story["frame_color"],
+                         story["full_fill"], story["layout_style"], width=width)
+    paths = []
+    for page_number, page in enumerate(pages, 1):
+        path = os.path.join(workspace, f"share_{page_number}.png")
+        page.save(path)
+        paths.append(path)
+    return paths, time.perf_counter() - start
+
+
+def run_batch(stories, output_dir, story_workers, api_workers, pdf_workers, manifest_path, share_width=0):
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    results = {}
+
+    # Chat calls run on the story threads and image calls on the image pool; both share this budget
+    api_scheduler.scheduler.limit_in_flight(api_workers)
+    # Spawned, not forked: a child forked while the API threads run could inherit a lock one of them held
+    # (logging, sqlite, httpx) and hang on it
+    with ThreadPoolExecutor(max_workers=api_workers, thread_name_prefix="images") as image_executor, \
+            ThreadPoolExecutor(max_workers=story_workers, thread_name_prefix="stories") as story_executor, \
+            ProcessPoolExecutor(max_workers=pdf_workers, mp_context=multiprocessing.get_context("spawn"),
+                                initializer=configure_logging) as pdf_executor:
+        # Batch calls yield to interactive ones waiting on the same API budget
+        request_priority.set(BATCH)
+        # Each story runs in a copy of this context, so it keeps the batch priority and logs under its own id
+        story_futures = {story_executor.submit(run_in_job, story["id"], generate_story_frames, story, output_dir,
+                                               image_executor): story
+                         for story in stories}
+        pdf_futures = {}
+        share_futures = {}
+
+        for future in as_completed(story_futures):
+            story = story_futures[future]
+            result = {"id": story["id"], "status": "failed", "pdf": None, "share_images": [], "frames_ok": 0,
+                      "frames_failed": 0, "errors": [], "timings": {}}
+            results[story["id"]] = result
+            try:
+                story_content, workspace, frames, api_seconds = future.result()
+            except Exception as e:
+                result["errors"].append(str(e))
+                logger.warning("Story %s failed: %s", story["id"], str(e))
+                continue
+
+            result["timings"]["api_s"] = round(api_seconds, 3)
+            ok_frames = [frame for frame in frames if frame["status"] in SUCCESS_FRAME_STATUSES]
+            result["frames_ok"] = len(ok_frames)
+            result["frames_failed"] = len(frames) - len(ok_frames)
+            result["errors"].extend(f"Frame {frame['index'] + 1}: {frame['error']}"
+                                    for frame in frames if frame["status"] == "failed")
+            if not ok_frames:
+                result["errors"].append("No valid images generated")
+                continue
+
+            # Saved frames travel to the PDF workers as paths, in-memory ones as bytes
+            images = [frame["path"] or frame["image"] for frame in ok_frames]
+            pdf_path = os.path.join(workspace, "story_output.pdf")
+            pdf_futures[pdf_executor.submit(compose_pdf, images, story_content, story, pdf_path)] = (result, pdf_path)
+            if share_width > 0:
+                share_futures[pdf_executor.submit(compose_share_images, images, story, workspace, share_width)] = result
+
+        for future in as_completed(pdf_futures):
+            result, pdf_path = pdf_futures[future]
+            try:
+                result["timings"]["pdf_s"] = round(future.result(), 3)
+                result["pdf"] = pdf_path
+                result["status"] = "ok" if not result["frames_failed"] else "partial"
+            except Exception as e:
+                result["errors"].append(f"PDF: {str(e)}")
+            logger.info("Story %s: %s", result["id"], result["status"])
+
+        for future in as_completed(share_futures):
+            result = share_futures[future]
+            try:
+                result["share_images"], seconds = future.result()
+                result["timings"]["share_s"] = round(seconds, 3)
+            except Exception as e:
+                result["errors"].append(f"Share images: {str(e)}")
+
+    elapsed = time.perf_counter() - start
+    with open(manifest_path, 'w', encoding='utf-8') as file:
+        for story in stories:
+            file.write(json.dumps(results[story["id"]], ensure_ascii=False) + "\n")
+
+    succeeded = sum(1 for result in results.values() if result["status"] != "failed")
+    return {
+        "stories": len(stories),
+        "succeeded": succeeded,
+        "failed": len(stories) - succeeded,
+        "seconds": round(elapsed, 2),
+        "stories_per_minute": round(len(stories) / elapsed * 60, 2) if elapsed else 0.0,
+        "api": api_scheduler.scheduler.stats()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a directory or JSONL manifest of stories into comic PDFs")
+    parser.add_argument("input", help="Directory of .txt stories or a JSONL manifest")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--manifest", help="Results JSONL (default: <output-dir>/results.jsonl)")
+    parser.add_argument("--num-frames", type=int, default=STORY_DEFAULTS["num_frames"])
+    parser.add_argument("--art-style", default=STORY_DEFAULTS["art_style"])
+    parser.add_argument("--layout-style", default=STORY_DEFAULTS["layout_style"])
+    parser.add_argument("--story-workers", type=int, default=4, help="Stories in the prompt/image stage at once")
+    parser.add_argument("--api-workers", type=int, default=IMAGE_CONCURRENCY,
+                        help="Chat and image requests in flight across all stories")
+    parser.add_argument("--pdf-workers", type=int, default=os.cpu_count() or 1, help="Processes composing PDFs")
+    parser.add_argument("--share-width", type=int, default=0,
+                        help="Also write each panel page as share_<n>.png, this many pixels wide (0 = off)")
+    args = parser.parse_args()
+    configure_logging()
+
+    defaults = dict(STORY_DEFAULTS, num_frames=args.num_frames, art_style=args.art_style,
+                    layout_style=args.layout_style)
+    stories = load_stories(args.input, defaults)
+    if not stories:
+        parser.error(f"No stories found in {args.input}")
+
+    manifest_path = args.manifest or os.path.join(args.output_dir, "results.jsonl")
+    summary = run_batch(stories, args.output_dir, args.story_workers, args.api_workers, args.pdf_workers,
+                        manifest_path, args.share_width)
+    logger.info("%d/%d stories in %ss (%s stories/min), results in %s", summary["succeeded"], summary["stories"],
+                summary["seconds"], summary["stories_per_minute"], manifest_path)
+    for kind, stats in summary["api"].items():
+        logger.info("%s API: %d calls, %d retries (%d throttled), wait avg %.2fs max %.2fs", kind, stats["calls"],
+                    stats["retries"], stats["throttled"], stats["wait_avg_s"], stats["wait_max_s"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# Many concurrent comics in one process: the async pipeline on one event loop against one thread per comic.
+# Each comic streams its prompts, generates its frames and renders its PDF, all against the local fake server.
+# Run from the repository root: python -m benchmarks.bench_async_load
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import api_scheduler
+import async_pipeline
+import checkpoints
+import image_cache
+import image_generation
+import prompt_cache
+from benchmarks.fake_openai_server import start_fake_server
+from image_backends import OpenAIBackend
+
+PDF_ARGS = ("Benchmark", 12, None, 3, "Inside Bottom", "#4A4A4A")
+
+
+def client_threads():
+    # Live threads, leaving out the fake server's one thread per connection
+    return sum(1 for thread in threading.enumerate() if "process_request" not in thread.name)
+
+
+class ThreadSampler:
+    # Peak number of live client threads while the run is going
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = client_threads()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, client_threads())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def story(n):
+    return f"Comic {n}: a fox and a crow meet by the river, argue about cheese and part as friends."
+
+
+async def async_comic(n, frames):
+    results = await async_pipeline.process_story_async(story(n), frames, "comic", output_dir=None)
+    images = [image for label, image in results if not label.endswith("(Error)")]
+    pdf = await async_pipeline.render_pdf_async(images, story(n), *PDF_ARGS, pdf_path=None)
+    return len(images), len(pdf)
+
+
+def sync_comic(n, frames):
+    from comic_pdf import create_pdf
+
+    results = image_generation.process_story(story(n), frames, "comic", output_dir=None)
+    images = [image for label, image in results if not label.endswith("(Error)")]
+    pdf = create_pdf(images, story(n), *PDF_ARGS, pdf_path=None)
+    return len(images), len(pdf)
+
+
+async def run_async(comics, frames):
+    return await asyncio.gather(*(async_comic(n, frames) for n in range(comics)))
+
+
+def run_sync(comics, frames):
+    # What a threaded server needs for the same load: a handler thread per comic
+    with ThreadPoolExecutor(max_workers=comics) as executor:
+        return list(executor.map(lambda n: sync_comic(n, frames), range(comics)))
+
+
+def run_once(args):
+    # One mode and load per process, so the peak RSS belongs to this run only
+    server, base_url = start_fake_server(image_latency=args.image_latency, token_delay=args.token_delay,
+                                         num_frames=args.frames, image_size=args.image_size)
+    api_scheduler.HTTP_MAX_CONNECTIONS = args.connections
+    image_generation.backend = OpenAIBackend(
+        api_scheduler.create_openai_client(api_key="fake", base_url=base_url),
+        async_client=api_scheduler.create_async_openai_client(api_key="fake", base_url=base_url))
+    # Every comic pays for its API calls, with no client-side rate limit
+    scheduler = api_scheduler.RequestScheduler(limits={"chat": 0, "image": 0})
+    image_generation.scheduler = async_pipeline.scheduler = scheduler
+    image_cache.IMAGE_CACHE_MAX_BYTES = 0
+    prompt_cache.PROMPT_CACHE_MEMORY_ENTRIES = 0
+    checkpoints.CHECKPOINTS_ENABLED = False
+    async_pipeline.ASYNC_IMAGE_CONCURRENCY = args.connections
+
+    try:
+        with ThreadSampler() as sampler:
+            start = time.perf_counter()
+            if args.mode == "async":
+                results = asyncio.run(run_async(args.run_comics, args.frames))
+            else:
+                results = run_sync(args.run_comics, args.frames)
+            elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    print(json.dumps({
+        "seconds": elapsed,
+        "frames_ok": sum(images for images, _ in results),
+        "pdfs": sum(1 for _, pdf_bytes in results if pdf_bytes),
+        "peak_threads": sampler.peak,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the async pipeline against the threaded one")
+    parser.add_argument("--comics", type=int, nargs="+", default=[8, 24, 48], help="Concurrent comics per run")
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    parser.add_argument("--frames", type=int, default=4)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--token-delay", type=float, default=0.005, help="Delay between streamed chat chunks")
+    parser.add_argument("--image-size", type=int, default=512, help="Side of the fake PNG frames")
+    parser.add_argument("--connections", type=int, default=64, help="HTTP pool size and image calls in flight")
+    parser.add_argument("--mode", choices=["sync", "async"], help=argparse.SUPPRESS)
+    parser.add_argument("--run-comics", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_once(args)
+        return
+
+    print(f"{args.frames} frames per comic, images {args.image_latency:.2f}s each, {args.connections} connections")
+    print(f"{'comics':>6} {'mode':>6} {'seconds':>8} {'comics/s':>9} {'frames':>7} {'threads':>8} {'rss MB':>7}")
+    for comics in args.comics:
+        for mode in args.modes:
+            command = [sys.executable, "-m", "benchmarks.bench_async_load", "--mode", mode, "--run-comics",
+                       str(comics), "--frames", str(args.frames), "--image-latency", str(args.image_latency),
+                       "--token-delay", str(args.token_delay), "--image-size", str(args.image_size),
+                       "--connections", str(args.connections)]
+            result = json.loads(subprocess.run(command, capture_output=True, text=True, check=True)
+                                .stdout.splitlines()[-1])
+            print(f"{comics:>6} {mode:>6} {result['seconds']:>8.2f} {comics / result['seconds']:>9.2f} "
+                  f"{result['frames_ok']:>3}/{comics * args.frames:<3} {result['peak_threads']:>8} "
+                  f"{result['peak_rss_mb']:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
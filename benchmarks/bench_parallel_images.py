@@ -0,0 +1,51 @@
+# Wall-clock time of process_story with the mock backend, by number of image calls in flight.
+# Run from the repository root: python -m benchmarks.bench_parallel_images
+import argparse
+import tempfile
+import time
+
+import api_scheduler
+import checkpoints
+import image_cache
+import image_generation
+import prompt_cache
+from mock_image_generation import MockBackend
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel frame generation")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mock image call latency in seconds")
+    parser.add_argument("--frames", type=int, nargs="+", default=[1, 2, 4, 6])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 6])
+    args = parser.parse_args()
+
+    # Instant chat answers, so the time is the image calls and what the pipeline does around them
+    image_generation.backend = MockBackend(image_size="256x256", image_latency=f"fixed:{args.latency}",
+                                           chat_latency="fixed:0", token_delay=0)
+    # Measure the API round-trips, with no client-side rate limit capping the workers
+    image_generation.scheduler = api_scheduler.RequestScheduler(limits={"chat": 0, "image": 0})
+    # Every run must pay for its image calls, not resume or reuse the previous one
+    image_cache.IMAGE_CACHE_MAX_BYTES = 0
+    prompt_cache.PROMPT_CACHE_MEMORY_ENTRIES = 0
+    checkpoints.CHECKPOINTS_ENABLED = False
+
+    print(f"Mock image latency: {args.latency:.2f}s")
+    print(f"{'frames':>6} {'workers':>7} {'seconds':>8} {'speedup':>7}")
+    for num_frames in args.frames:
+        story = " ".join(f"The hero reaches place {i + 1}." for i in range(num_frames))
+        sequential = None
+        for workers in args.concurrency:
+            with tempfile.TemporaryDirectory() as output_dir:
+                start = time.perf_counter()
+                results = image_generation.process_story(story, num_frames, "comic", max_workers=workers,
+                                                         output_dir=output_dir)
+                elapsed = time.perf_counter() - start
+            failed = sum(1 for label, _ in results if label.endswith("(Error)"))
+            if sequential is None:
+                sequential = elapsed
+            note = f" ({failed} failed)" if failed else ""
+            print(f"{num_frames:>6} {workers:>7} {elapsed:>8.2f} {sequential / elapsed:>6.1f}x{note}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# PDF size and render time with full-resolution frames versus frames resampled to the panel DPI.
+# Run from the repository root: python -m benchmarks.bench_pdf_images
+import argparse
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from comic_pdf import create_pdf
+
+
+def make_frames(count, size=1024, seed=0):
+    # Smooth colour fields plus grain, which compress about as badly as real DALL·E frames
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        low = rng.integers(0, 256, (16, 16, 3), dtype=np.uint8)
+        base = np.asarray(Image.fromarray(low).resize((size, size), Image.BICUBIC), dtype=np.int16)
+        grain = rng.integers(-12, 13, (size, size, 3), dtype=np.int16)
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(base + grain, 0, 255).astype(np.uint8)).save(buffer, format="PNG")
+        frames.append(buffer.getvalue())
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark panel image preparation for create_pdf")
+    parser.add_argument("--frames", type=int, default=6)
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--jpeg-quality", type=int, default=85)
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames)
+    settings = [("original", 0, 0), (f"{args.dpi} dpi png", args.dpi, 0),
+                (f"{args.dpi} dpi jpeg q{args.jpeg_quality}", args.dpi, args.jpeg_quality)]
+
+    print(f"{args.frames} frames of {sum(len(f) for f in frames) / 1024 / 1024:.1f} MB total")
+    for name, dpi, quality in settings:
+        start = time.perf_counter()
+        pdf = create_pdf(frames, "Once upon a time.", "Benchmark", 12, None, 3, "Inside Bottom", "#4A4A4A",
+                         pdf_path=None, image_dpi=dpi, jpeg_quality=quality)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>22}: {len(pdf) / 1024:8.0f} KB  {elapsed:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# End-to-end process_story latency with and without streamed prompt generation.
+# Run from the repository root: python -m benchmarks.bench_pipeline
+import argparse
+import tempfile
+import time
+
+from openai import OpenAI
+
+import api_scheduler
+import image_cache
+import image_generation
+from image_backends import OpenAIBackend
+import prompt_cache
+from benchmarks.fake_openai_server import start_fake_server, split_tokens, fake_prompts_text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt streaming pipelined with image generation")
+    parser.add_argument("--frames", type=int, default=6)
+    parser.add_argument("--workers", type=int, default=2, help="Image calls in flight")
+    parser.add_argument("--image-latency", type=float, default=0.5)
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Delay between streamed chat chunks")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(image_latency=args.image_latency, token_delay=args.token_delay,
+                                         num_frames=args.frames)
+    image_generation.backend = OpenAIBackend(OpenAI(api_key="fake", base_url=base_url, max_retries=0))
+    # Measure the API round-trips, with no client-side rate limit capping the workers
+    image_generation.scheduler = api_scheduler.RequestScheduler(limits={"chat": 0, "image": 0})
+    # Every run must pay for the chat and image calls
+    image_cache.IMAGE_CACHE_MAX_BYTES = 0
+    prompt_cache.PROMPT_CACHE_MEMORY_ENTRIES = 0
+
+    completion_seconds = args.token_delay * len(split_tokens(fake_prompts_text(args.frames)))
+    print(f"{args.frames} frames, completion takes {completion_seconds:.2f}s, images {args.image_latency:.2f}s each, "
+          f"{args.workers} in flight")
+    try:
+        for stream in (False, True):
+            with tempfile.TemporaryDirectory() as output_dir:
+                start = time.perf_counter()
+                image_generation.process_story("Once upon a time", args.frames, "comic",
+                                               max_workers=args.workers, stream=stream, output_dir=output_dir)
+                elapsed = time.perf_counter() - start
+            print(f"{'streamed' if stream else 'buffered':>9}: {elapsed:.2f}s")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Image calls through the request scheduler against a fake server that throttles and fails.
+# Run from the repository root: python -m benchmarks.bench_scheduler
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import api_scheduler
+import image_generation
+from image_backends import OpenAIBackend
+from benchmarks.fake_openai_server import start_fake_server
+
+
+def run(args, client_limit):
+    server, base_url = start_fake_server(image_latency=0.05, images_per_minute=args.server_limit,
+                                         window_seconds=args.window, error_rate=args.error_rate)
+    image_generation.backend = OpenAIBackend(api_scheduler.create_openai_client(api_key="fake", base_url=base_url))
+    # Budgets are per window here; the scheduler takes them per minute
+    image_generation.scheduler = api_scheduler.RequestScheduler(
+        limits={"chat": 0, "image": client_limit * 60 / args.window},
+        backoff_base=0.05, backoff_max=args.window, max_retries=args.max_retries, burst_seconds=args.window / 4)
+
+    ok = failed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(image_generation.create_image, f"A hero in scene {i}")
+                   for i in range(args.requests)]
+        for future in futures:
+            try:
+                future.result()
+                ok += 1
+            except Exception:
+                failed += 1
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    state = server.RequestHandlerClass.state
+    stats = image_generation.scheduler.stats()["image"]
+    label = f"{client_limit}/window" if client_limit else "none"
+    print(f"{label:>12} {elapsed:>8.2f} {ok:>4} {failed:>6} {state['throttled']:>5} {state['errors']:>5} "
+          f"{stats['retries']:>7} {stats['wait_avg_s']:>8.3f} {stats['wait_max_s']:>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API scheduler under throttling")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--window", type=float, default=2.0, help="Length of the fake rate-limit window in seconds")
+    parser.add_argument("--server-limit", type=int, default=12, help="Image requests the server allows per window")
+    parser.add_argument("--client-limits", type=int, nargs="+", default=[0, 12],
+                        help="Scheduler image budgets per window to compare (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="Share of fake 503 responses")
+    parser.add_argument("--max-retries", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.requests} image requests, {args.workers} workers, server allows {args.server_limit} "
+          f"per {args.window:.0f}s window, {args.error_rate:.0%} transient 503s")
+    print(f"{'client limit':>12} {'seconds':>8} {'ok':>4} {'failed':>6} {'429s':>5} {'503s':>5} "
+          f"{'retries':>7} {'wait avg':>8} {'wait max':>8}")
+    for client_limit in args.client_limits:
+        run(args, client_limit)
+
+
+if __name__ == "__main__":
+    main()
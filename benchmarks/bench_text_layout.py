@@ -0,0 +1,84 @@
+# Story wrapping cost on novel-length input: the old per-word re-measuring loop versus text_layout.
+# Run from the repository root: python -m benchmarks.bench_text_layout
+import argparse
+import random
+import time
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from font_manager import string_width
+from text_layout import wrap_lines
+
+FONT_NAME = "Helvetica"
+FONT_SIZE = 12
+MAX_WIDTH = 523  # A4 width minus two half-inch margins, in points
+
+
+def make_story(words, paragraph_words, seed=0):
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10)))
+                  for _ in range(5000)]
+    paragraphs = []
+    for start in range(0, words, paragraph_words):
+        count = min(paragraph_words, words - start)
+        paragraphs.append(" ".join(rng.choice(vocabulary) for _ in range(count)))
+    return "\n\n".join(paragraphs)
+
+
+def legacy_wrap(text, max_width):
+    # The wrapping loop create_pdf used before text_layout, minus the drawing
+    lines = []
+    for line in text.split('\n'):
+        if not line.strip():
+            lines.append("")
+            continue
+        current_line = []
+        for word in line.split():
+            current_line.append(word)
+            test_line = ' '.join(current_line)
+            if stringWidth(test_line, FONT_NAME, FONT_SIZE) > max_width:
+                if len(current_line) > 1:
+                    current_line.pop()
+                    lines.append(' '.join(current_line))
+                    current_line = [word]
+                else:
+                    lines.append(test_line)
+                    current_line = []
+        if current_line:
+            lines.append(' '.join(current_line))
+    return lines
+
+
+def linear_wrap(text, max_width):
+    # Measured as create_pdf does, through the shared width cache of font_manager
+    return wrap_lines(text, max_width, lambda word: string_width(word, FONT_NAME, FONT_SIZE),
+                      string_width(' ', FONT_NAME, FONT_SIZE))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark story text wrapping")
+    parser.add_argument("--words", type=int, nargs="+", default=[10000, 50000, 100000, 200000])
+    parser.add_argument("--paragraph-words", type=int, default=200)
+    parser.add_argument("--width", type=float, default=MAX_WIDTH,
+                        help="Line width in points; wider lines make the old loop quadratic sooner")
+    args = parser.parse_args()
+
+    print(f"{'words':>8} {'lines':>7} {'legacy s':>9} {'linear s':>9} {'us/word':>8}")
+    for words in args.words:
+        story = make_story(words, args.paragraph_words)
+
+        start = time.perf_counter()
+        expected = legacy_wrap(story, args.width)
+        legacy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        lines = linear_wrap(story, args.width)
+        linear_seconds = time.perf_counter() - start
+
+        mismatch = "" if lines == expected else "  (output differs!)"
+        print(f"{words:>8} {len(lines):>7} {legacy_seconds:>9.3f} {linear_seconds:>9.3f} "
+              f"{linear_seconds / words * 1e6:>8.2f}{mismatch}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import base64
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+
+def make_png_b64(size=256):
+    # Small gradient PNG standing in for a DALL·E frame
+    image = Image.linear_gradient("L").resize((size, size)).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    # Set per server in start_fake_server
+    image_latency = 0.5
+    chat_latency = 0.0
+    token_delay = 0.0
+    png_b64 = ""
+    prompts_text = ""
+    # Server-side throttling: image requests above this many per window get a 429 with Retry-After (0 = no limit)
+    images_per_minute = 0
+    # Benchmarks shrink the rate-limit window to keep runs short
+    window_seconds = 60
+    # Share of image requests answered with a 503
+    error_rate = 0.0
+    state = None
+
+    def _throttled(self):
+        # Fixed window shared by all handler threads; returns the Retry-After seconds or None
+        if not self.images_per_minute:
+            return None
+        with self.state["lock"]:
+            now = time.monotonic()
+            if now - self.state["window_start"] >= self.window_seconds:
+                self.state["window_start"], self.state["count"] = now, 0
+            if self.state["count"] >= self.images_per_minute:
+                self.state["throttled"] += 1
+                return self.window_seconds - (now - self.state["window_start"])
+            self.state["count"] += 1
+            return None
+
+    def _send_error(self, status, message, retry_after=None):
+        body = json.dumps({"error": {"message": message, "type": "fake_error"}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if retry_after is not None:
+            self.send_header("Retry-After", f"{retry_after:.2f}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.endswith("/images/generations"):
+            retry_after = self._throttled()
+            if retry_after is not None:
+                self._send_error(429, "Rate limit reached for images per minute", retry_after)
+                return
+            if self.error_rate and self.state["random"].random() < self.error_rate:
+                with self.state["lock"]:
+                    self.state["errors"] += 1
+                self._send_error(503, "The server is overloaded")
+                return
+            time.sleep(self.image_latency)
+            self._send_json({
+                "created": int(time.time()),
+                "data": [{"b64_json": self.png_b64, "revised_prompt": request.get("prompt")}],
+            })
+        elif self.path.endswith("/chat/completions") and request.get("stream"):
+            self._stream_chat(request)
+        elif self.path.endswith("/chat/completions"):
+            time.sleep(self.chat_latency + self.token_delay * len(split_tokens(self.prompts_text)))
+            self._send_json({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o"),
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": self.prompts_text},
+                }],
+            })
+        else:
+            self._send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+    def _stream_chat(self, request):
+        # Server-sent events in the shape of a streamed chat.completion.chunk
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        time.sleep(self.chat_latency)
+        for token in split_tokens(self.prompts_text):
+            time.sleep(self.token_delay)
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": token}}],
+            }
+            try:
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # The client closed the stream once it had all the prompts it needed
+                return
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def split_tokens(text, size=4):
+    # Roughly token-sized pieces, so markers and quotes get split across chunks
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def fake_prompts_text(num_frames):
+    return "\n".join(f'[{i + 1}] "A hero in scene {i + 1}, comic style."' for i in range(num_frames))
+
+
+def start_fake_server(image_latency=0.5, chat_latency=0.0, token_delay=0.0, num_frames=6, image_size=256,
+                      images_per_minute=0, window_seconds=60, error_rate=0.0, seed=0):
+    handler = type("Handler", (FakeOpenAIHandler,), {
+        "images_per_minute": images_per_minute,
+        "window_seconds": window_seconds,
+        "error_rate": error_rate,
+        # Shared by all requests of this server; counters are read back by the benchmarks
+        "state": {"lock": threading.Lock(), "window_start": time.monotonic(), "count": 0, "throttled": 0,
+                  "errors": 0, "random": random.Random(seed)},
+        "image_latency": image_latency,
+        "chat_latency": chat_latency,
+        "token_delay": token_delay,
+        "png_b64": make_png_b64(image_size),
+        "prompts_text": fake_prompts_text(num_frames),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    return server, base_url
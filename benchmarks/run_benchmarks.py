@@ -0,0 +1,330 @@
+# End-to-end benchmark suite: cold-start imports, font loading, prompt parsing, frame decode and save, PDF image
+# placement, multi-page comics and story pagination.
+# Run from the repository root:
+#   python -m benchmarks.run_benchmarks --output benchmark_results.json
+#   python -m benchmarks.run_benchmarks --baseline benchmark_results.json   (exits 1 on a regression)
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from benchmarks.bench_text_layout import make_story
+from benchmarks.fake_openai_server import split_tokens
+from comic_layout import PAGE_MARGIN, TITLE_HEIGHT
+from comic_pdf import create_pdf
+from font_manager import get_main_font, string_width
+from image_generation import save_frame_image
+from mock_image_generation import synthetic_png
+import page_preview
+from prompt_parser import PromptStreamParser, parse_prompts
+from text_layout import wrap_lines, lines_per_page, paginate, draw_text_page
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED = 1234
+# What each kind of process imports first: utilities, the pipeline, the batch CLI and the full UI
+COLD_START_IMPORTS = {
+    "prompt_parser": "import prompt_parser",
+    "comic_layout": "import comic_layout",
+    "comic_pdf": "import comic_pdf",
+    "image_generation": "import image_generation",
+    "async_pipeline": "import async_pipeline",
+    "batch_generate": "import batch_generate",
+    # Builds the Blocks without launching the server
+    "ui": "import runpy; runpy.run_path('ui.kt.py')"
+}
+HEAVY_MODULES = ("gradio", "openai", "httpx", "numpy")
+FRAME_COUNTS = [1, 2, 3, 4, 5, 6]
+LAYOUT_STYLES = ["default", "option1", "option2"]
+# Story sizes in words, from a paragraph to a novel
+STORY_SIZES = {"paragraph": 120, "short_story": 2000, "novella": 20000, "novel": 100000}
+QUICK_FRAME_COUNTS = [1, 3, 6]
+# Serialized comics spread over several panel pages; 512x512 frames keep the setup short
+PAGED_FRAME_COUNTS = [30, 100]
+QUICK_PAGED_FRAME_COUNTS = [30]
+QUICK_STORY_SIZES = {"paragraph": 120, "novella": 20000}
+# Changes smaller than this are timer noise, whatever the ratio
+NOISE_FLOOR_SECONDS = 0.002
+
+
+def prompts_text(num_frames, seed=SEED):
+    # A completion in the PROMPT_GENERATION_TEMPLATE format, with a preamble and multi-line prompts
+    story = make_story(60 * num_frames, 60, seed)
+    scenes = story.split("\n\n")
+    return "Here are the prompts:\n" + "\n".join(
+        f'[{i + 1}] "{scene[:300]}.\n Consistent characters, comic style."' for i, scene in enumerate(scenes))
+
+
+def parse_importtime(stderr):
+    # Top-level entries of `-X importtime`: {module: cumulative seconds}, in import order
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("  "):
+            continue
+        modules[name.strip()] = int(cumulative) / 1e6
+    return modules
+
+
+def interpreter_modules():
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"], capture_output=True, text=True,
+                            check=True, cwd=ROOT)
+    return set(parse_importtime(result.stderr))
+
+
+def cold_start_case(code, startup_modules):
+    # A fresh interpreter per run; the time is the wall clock of the whole process
+    check_loaded = "; import sys; print(' '.join(m for m in %r if m in sys.modules))" % (HEAVY_MODULES,)
+
+    def run():
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code + check_loaded],
+                                capture_output=True, text=True, check=True, cwd=ROOT)
+        modules = parse_importtime(result.stderr)
+        return {"import_seconds": round(sum(seconds for name, seconds in modules.items()
+                                            if name not in startup_modules), 4),
+                "heavy_modules": result.stdout.split()}
+    return run, 1
+
+
+def font_load_case():
+    # Fonts register once per process, so each run is a fresh interpreter; the time is the TTF parsing only
+    code = ("import json, font_manager; font_manager.get_main_font(); "
+            "print(json.dumps(font_manager.font_load_timings()))")
+
+    def run():
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=ROOT)
+        timings = json.loads(result.stdout)
+        return {"font_load_seconds": round(sum(timings.values()), 4), "fonts": sorted(timings)}
+    return run, 1
+
+
+def parse_case(num_frames, loops=200):
+    text = prompts_text(num_frames)
+    chunks = split_tokens(text)
+
+    def run():
+        for _ in range(loops):
+            parse_prompts(text)
+            parser = PromptStreamParser()
+            prompts = []
+            for chunk in chunks:
+                prompts.extend(parser.feed(chunk))
+            prompts.extend(parser.close())
+        return {"prompts": len(prompts)}
+    return run, loops
+
+
+def decode_save_case(encoded_frames, output_dir):
+    # What generate_frame does with each response: base64 decode, then write the PNG
+    def run():
+        for i, encoded in enumerate(encoded_frames):
+            save_frame_image(i, base64.b64decode(encoded), output_dir)
+        return {"frame_bytes": sum(len(encoded) * 3 // 4 for encoded in encoded_frames)}
+    return run, 1
+
+
+def pdf_case(frames, layout_style, full_fill):
+    # A one-line story, so the time is the image preparation and placement
+    def run():
+        pdf = create_pdf(frames, "Once upon a time.", "Benchmark", 12, None, 3, "Inside Bottom", "#4A4A4A",
+                         full_fill=full_fill, layout_style=layout_style, pdf_path=None)
+        return {"pdf_bytes": len(pdf)}
+    return run, 1
+
+
+def page_preview_case(frames, layout_style, cached):
+    # Raster panel pages; warm runs are what a live preview pays for each settings change
+    def run():
+        if not cached:
+            page_preview._decoded.cache_clear()
+            page_preview._resized.cache_clear()
+        pages = page_preview.render_pages(frames, "Benchmark", 12, None, 3, "Inside Bottom", "#4A4A4A",
+                                          layout_style=layout_style)
+        return {"pages": len(pages)}
+    return run, 1
+
+
+def pagination_case(story, font_size=12):
+    # The story half of create_pdf: wrap, paginate and draw every page
+    def run():
+        main_font = get_main_font()
+        page_width, page_height = A4
+        output = io.BytesIO()
+        c = canvas.Canvas(output, pagesize=A4)
+        line_height = font_size * 1.2
+        text_top = page_height - PAGE_MARGIN - TITLE_HEIGHT
+        lines = wrap_lines(story, page_width - 2 * PAGE_MARGIN, lambda word: string_width(word, main_font, font_size),
+                           string_width(' ', main_font, font_size))
+        pages = paginate(lines, lines_per_page(text_top, PAGE_MARGIN, line_height))
+        for page_number, page_lines in enumerate(pages):
+            if page_number > 0:
+                c.showPage()
+            draw_text_page(c, page_lines, PAGE_MARGIN, text_top, main_font, font_size, line_height, "black")
+        c.save()
+        return {"pages": len(pages), "pdf_bytes": len(output.getvalue())}
+    return run, 1
+
+
+def measure(run, loops, repeat, traced=True):
+    # Timed runs without tracing, then one traced run for the peak Python heap
+    run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extra = run()
+        times.append((time.perf_counter() - start) / loops)
+    result = dict(extra, seconds=statistics.median(times), min_seconds=min(times))
+    if traced:
+        tracemalloc.start()
+        run()
+        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def build_cases(quick, workdir):
+    frame_counts = QUICK_FRAME_COUNTS if quick else FRAME_COUNTS
+    story_sizes = QUICK_STORY_SIZES if quick else STORY_SIZES
+    frames = [synthetic_png(f"Benchmark frame {i + 1}", "1024x1024", SEED) for i in range(max(frame_counts))]
+    encoded = [base64.b64encode(frame).decode("ascii") for frame in frames]
+
+    startup_modules = interpreter_modules()
+    for name, code in COLD_START_IMPORTS.items():
+        # Runs in a subprocess, the peak heap of this one would mean nothing
+        yield f"cold_start/{name}", "cold_start", {"code": code}, cold_start_case(code, startup_modules), False
+    yield "font_load", "font_load", {}, font_load_case(), False
+
+    for n in frame_counts:
+        yield f"parse/frames={n}", "prompt_parsing", {"frames": n}, parse_case(n)
+    for n in frame_counts:
+        yield f"decode_save/frames={n}", "decode_save", {"frames": n}, decode_save_case(encoded[:n], workdir)
+    for n in frame_counts:
+        for style in LAYOUT_STYLES:
+            for full_fill in (False, True):
+                yield (f"pdf_images/frames={n}/style={style}/full_fill={int(full_fill)}", "pdf_images",
+                       {"frames": n, "layout_style": style, "full_fill": full_fill},
+                       pdf_case(frames[:n], style, full_fill))
+    paged_counts = QUICK_PAGED_FRAME_COUNTS if quick else PAGED_FRAME_COUNTS
+    paged_frames = [synthetic_png(f"Paged frame {i + 1}", "512x512", SEED) for i in range(max(paged_counts))]
+    for n in paged_counts:
+        yield f"pdf_pages/frames={n}", "pdf_pages", {"frames": n}, pdf_case(paged_frames[:n], "default", False)
+    for n in frame_counts:
+        for cached in (False, True):
+            yield (f"page_preview/frames={n}/cache={'warm' if cached else 'cold'}", "page_preview",
+                   {"frames": n, "cached": cached}, page_preview_case(frames[:n], "default", cached))
+    for name, words in story_sizes.items():
+        yield (f"pagination/{name}", "pagination", {"words": words},
+               pagination_case(make_story(words, 200, SEED)))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(repeat, quick=False, only=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, stage, params, (run, loops), *traced in build_cases(quick, workdir):
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            result = dict(stage=stage, params=params, **measure(run, loops, repeat, *traced))
+            results[name] = result
+            note = ""
+            if "peak_bytes" in result:
+                note += f"  peak {result['peak_bytes'] / 1024 / 1024:7.2f} MB"
+            if "pdf_bytes" in result:
+                note += f"  {result['pdf_bytes'] / 1024:8.0f} KB"
+            if "import_seconds" in result:
+                note += f"  imports {result['import_seconds'] * 1000:7.1f} ms {' '.join(result['heavy_modules'])}"
+            if "font_load_seconds" in result:
+                note += f"  fonts {result['font_load_seconds'] * 1000:7.1f} ms {' '.join(result['fonts'])}"
+            print(f"{name:<45} {result['seconds'] * 1000:10.2f} ms{note}")
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": SEED,
+            "repeat": repeat,
+            "quick": quick
+        },
+        "results": results
+    }
+
+
+def compare(current, baseline, threshold):
+    # Returns the regressions: cases slower, larger or hungrier than the baseline by more than threshold
+    regressions = []
+    print(f"\n{'case':<45} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        change = result["seconds"] / base["seconds"] - 1 if base["seconds"] else 0.0
+        flags = []
+        if change > threshold and result["seconds"] - base["seconds"] > NOISE_FLOOR_SECONDS:
+            flags.append("time")
+        for metric in ("pdf_bytes", "peak_bytes"):
+            if base.get(metric) and result.get(metric, 0) > base[metric] * (1 + threshold):
+                flags.append(metric)
+        for metric in ("import_seconds", "font_load_seconds"):
+            if (base.get(metric) is not None and result.get(metric, 0) > base[metric] * (1 + threshold)
+                    and result[metric] - base[metric] > NOISE_FLOOR_SECONDS):
+                flags.append(metric)
+        # A module that starts pulling in gradio or openai is a cold-start regression whatever the timing
+        if set(result.get("heavy_modules", [])) - set(base.get("heavy_modules", [])):
+            flags.append("heavy_modules")
+        if flags:
+            regressions.append((name, flags))
+        print(f"{name:<45} {base['seconds'] * 1000:8.2f}ms {result['seconds'] * 1000:8.2f}ms {change:+8.1%}"
+              f"{'  REGRESSION: ' + ', '.join(flags) if flags else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the StoryGen benchmark suite")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against results saved earlier with --output")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown or growth, 0.2 = 20%%")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case; the median is reported")
+    parser.add_argument("--quick", action="store_true", help="Fewer frame counts and story sizes")
+    parser.add_argument("--only", nargs="+", help="Run only cases whose name starts with one of these prefixes")
+    args = parser.parse_args()
+
+    current = run_suite(args.repeat, args.quick, args.only)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(current, file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+            raise SystemExit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
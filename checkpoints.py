@@ -0,0 +1,84 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Record prompts and finished frames per job so a retry only regenerates what is missing
+CHECKPOINTS_ENABLED = os.environ.get("STORYGEN_CHECKPOINTS", "1") == "1"
+CHECKPOINT_PATH = os.environ.get("STORYGEN_CHECKPOINT_PATH", os.path.join(".cache", "checkpoints.sqlite3"))
+CHECKPOINT_TTL_SECONDS = int(os.environ.get("STORYGEN_CHECKPOINT_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+class CheckpointStore:
+    """Durable job progress in SQLite: the prompt list and one row per frame.
+
+    The prompt list is saved as each prompt is parsed and marked complete once the
+    completion ends. Frame rows hold the status, the saved image path, the SHA-256
+    of the PNG and its image cache key, which is enough to find the image again
+    after a crash or retry.
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS jobs (job_key TEXT PRIMARY KEY, prompts TEXT, updated REAL, "
+                         "complete INTEGER DEFAULT 1)")
+        # Files written before prompts were saved one at a time only hold complete lists
+        if "complete" not in {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN complete INTEGER DEFAULT 1")
+        self._db.execute("CREATE TABLE IF NOT EXISTS frames (job_key TEXT, idx INTEGER, prompt TEXT, status TEXT, "
+                         "image_path TEXT, image_hash TEXT, image_key TEXT, error TEXT, updated REAL, "
+                         "PRIMARY KEY (job_key, idx))")
+
+    def load(self, job_key):
+        # Returns (prompt list or None, whether the list is complete, {frame index: frame record})
+        with self._lock:
+            row = self._db.execute("SELECT prompts, complete FROM jobs WHERE job_key = ?", (job_key,)).fetchone()
+            rows = self._db.execute("SELECT idx, prompt, status, image_path, image_hash, image_key, error "
+                                    "FROM frames WHERE job_key = ?", (job_key,)).fetchall()
+        prompts = json.loads(row[0]) if row and row[0] else None
+        complete = prompts is not None and bool(row[1])
+        frames = {idx: {"index": idx, "prompt": prompt, "status": status, "path": image_path,
+                        "image_hash": image_hash, "image_key": image_key, "error": error}
+                  for idx, prompt, status, image_path, image_hash, image_key, error in rows}
+        return prompts, complete, frames
+
+    def save_prompts(self, job_key, prompts, complete=True):
+        # Called with the prompts parsed so far before each frame starts, and once more with complete=True
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO jobs (job_key, prompts, updated, complete) VALUES (?, ?, ?, ?)",
+                             (job_key, json.dumps(list(prompts), ensure_ascii=False), now, int(complete)))
+            if not complete:
+                return
+            # Forget jobs nobody has retried for a while
+            expired = now - CHECKPOINT_TTL_SECONDS
+            self._db.execute("DELETE FROM frames WHERE updated < ?", (expired,))
+            self._db.execute("DELETE FROM jobs WHERE updated < ?", (expired,))
+
+    def save_frame(self, job_key, frame):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (job_key, frame["index"], frame["prompt"], frame["status"], frame.get("path"),
+                              frame.get("image_hash"), frame.get("image_key"), frame.get("error"), time.time()))
+
+
+_checkpoint_store = None
+_checkpoint_store_lock = threading.Lock()
+
+
+def get_checkpoint_store():
+    # Built on first use; returns None when checkpoints are disabled
+    global _checkpoint_store
+    if not CHECKPOINTS_ENABLED:
+        return None
+    with _checkpoint_store_lock:
+        if _checkpoint_store is None:
+            _checkpoint_store = CheckpointStore()
+    return _checkpoint_store
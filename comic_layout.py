@@ -0,0 +1,220 @@
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import inch
+import functools
+import json
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+PAGE_MARGIN = 0.5 * inch
+TITLE_HEIGHT = 1 * inch
+# Distance of the page title baseline from the top of the page
+TITLE_BASELINE = 0.5 * inch
+# Share of the content height used by the panels on a panel page
+IMAGE_AREA_RATIO = 0.8
+# Longer comics are spread over several panel pages of at most this many panels
+PANELS_PER_PAGE = int(os.environ.get("STORYGEN_PANELS_PER_PAGE", "6"))
+# Vertical strips per row when option2 is used for more panels than fit in one row
+MAX_STRIPS_PER_ROW = 6
+# Dialogue bubbles: padding around the text and corner radius, in points
+BUBBLE_MARGIN = 10
+BUBBLE_RADIUS = 5
+DIALOGUE_POSITIONS = {
+    "Inside Top": "inside_top",
+    "Inside Bottom": "inside_bottom",
+    "Outside Bottom": "outside_bottom"
+}
+
+def create_flexible_layout(num_images, custom_layout=None, layout_style='default'):
+    # Each number of frames now has 3 layout options
+    default_layouts = {
+        1: {
+            'default': [(0, 0, 1, 1)],  # Single full frame
+            'option1': [(0.1, 0.1, 0.8, 0.8)],  # Centered frame with margin
+            'option2': [(0.2, 0, 0.6, 1)]  # Centered vertical strip
+        },
+        2: {
+            'default': [(0, 0, 0.5, 1), (0.5, 0, 0.5, 1)],  # Vertical split
+            'option1': [(0, 0, 1, 0.5), (0, 0.5, 1, 0.5)],  # Horizontal split
+            'option2': [(0.1, 0, 0.4, 1), (0.5, 0, 0.4, 1)]  # Vertical split with margins
+        },
+        3: {
+            'default': [(0, 0, 0.5, 0.5), (0.5, 0, 0.5, 0.5), (0, 0.5, 1, 0.5)],  # Two top, one bottom
+            'option1': [(0, 0, 1, 0.4), (0, 0.4, 0.5, 0.6), (0.5, 0.4, 0.5, 0.6)],  # One top, two bottom
+            'option2': [(0, 0, 0.33, 1), (0.33, 0, 0.34, 1), (0.67, 0, 0.33, 1)]  # Three vertical strips
+        },
+        4: {
+            'default': [(0, 0, 0.5, 0.5), (0.5, 0, 0.5, 0.5), (0, 0.5, 0.5, 0.5), (0.5, 0.5, 0.5, 0.5)],  # Grid
+            'option1': [(0, 0, 1, 0.4), (0, 0.4, 0.33, 0.6), (0.33, 0.4, 0.34, 0.6), (0.67, 0.4, 0.33, 0.6)],  # One top, three bottom
+            'option2': [(0, 0, 0.25, 1), (0.25, 0, 0.25, 1), (0.5, 0, 0.25, 1), (0.75, 0, 0.25, 1)]  # Four vertical strips
+        },
+        5: {
+            'default': [(0, 0, 0.33, 0.5), (0.33, 0, 0.33, 0.5), (0.66, 0, 0.34, 0.5),
+                        (0, 0.5, 0.5, 0.5), (0.5, 0.5, 0.5, 0.5)],  # Three top, two bottom
+            'option1': [(0, 0, 1, 0.4), (0, 0.4, 0.25, 0.6), (0.25, 0.4, 0.25, 0.6),
+                        (0.5, 0.4, 0.25, 0.6), (0.75, 0.4, 0.25, 0.6)],  # One top, four bottom
+            'option2': [(0, 0, 0.2, 1), (0.2, 0, 0.2, 1), (0.4, 0, 0.2, 1),
+                        (0.6, 0, 0.2, 1), (0.8, 0, 0.2, 1)]  # Five vertical strips
+        },
+        6: {
+            'default': [(0, 0, 0.33, 0.5), (0.33, 0, 0.33, 0.5), (0.66, 0, 0.34, 0.5),
+                        (0, 0.5, 0.33, 0.5), (0.33, 0.5, 0.33, 0.5), (0.66, 0.5, 0.34, 0.5)],  # 3x2 grid
+            'option1': [(0, 0, 1, 0.33), (0, 0.33, 0.5, 0.34), (0.5, 0.33, 0.5, 0.34),
+                        (0, 0.67, 0.33, 0.33), (0.33, 0.67, 0.33, 0.33), (0.66, 0.67, 0.34, 0.33)],  # One top, two middle, three bottom
+            'option2': [(0, 0, 0.167, 1), (0.167, 0, 0.167, 1), (0.334, 0, 0.167, 1),
+                        (0.501, 0, 0.167, 1), (0.668, 0, 0.167, 1), (0.835, 0, 0.165, 1)]  # Six vertical strips
+        }
+    }
+
+    if custom_layout:
+        try:
+            return parse_custom_layout(custom_layout)
+        except ValueError as e:
+            logger.warning("%s. Using the %s layout.", e, layout_style)
+
+    if num_images not in default_layouts:
+        return grid_layout(num_images, layout_style)
+    return default_layouts[num_images][layout_style]
+
+
+def _rows(counts, top=0.0, height=1.0):
+    # Boxes for rows of panels, each row split evenly across the page width
+    boxes = []
+    row_height = height / len(counts)
+    for r, count in enumerate(counts):
+        y = round(top + r * row_height, 4)
+        boxes.extend((round(c / count, 4), y, round(1 / count, 4), round(row_height, 4)) for c in range(count))
+    return boxes
+
+
+def _balanced(num_images, per_row):
+    # Row sizes as even as possible, the larger rows first
+    rows = math.ceil(num_images / per_row)
+    return [num_images // rows + (1 if r < num_images % rows else 0) for r in range(rows)]
+
+
+def grid_layout(num_images, layout_style='default'):
+    # Layouts for panel counts without a hand-made one, in the spirit of each style:
+    # default is a near-square grid, option1 opens with a full-width panel, option2 uses vertical strips
+    if num_images <= 0:
+        return []
+    if layout_style == 'option1' and num_images > 1:
+        rest = _balanced(num_images - 1, math.ceil(math.sqrt(num_images - 1)))
+        splash_height = 1 / (len(rest) + 1)
+        return _rows([1], 0, splash_height) + _rows(rest, splash_height, 1 - splash_height)
+    if layout_style == 'option2':
+        return _rows(_balanced(num_images, MAX_STRIPS_PER_ROW))
+    return _rows(_balanced(num_images, math.ceil(math.sqrt(num_images))))
+
+
+def page_panel_counts(num_images, per_page=None):
+    # Panels on each page, spread evenly so the last page is never a lone panel
+    per_page = PANELS_PER_PAGE if per_page is None else per_page
+    if num_images <= 0:
+        return []
+    return _balanced(num_images, max(1, per_page))
+
+
+@functools.lru_cache(maxsize=256)
+def _page_layouts(num_images, layout_style, per_page):
+    return tuple(tuple(create_flexible_layout(count, layout_style=layout_style))
+                 for count in page_panel_counts(num_images, per_page))
+
+
+def parse_custom_layout(custom_layout):
+    # Boxes (x, y, width, height) of a custom layout given as JSON; raises ValueError when it is not a
+    # non-empty list of four numbers each with a positive size
+    try:
+        layout = json.loads(custom_layout)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Custom layout is not valid JSON: {e}") from e
+    if not isinstance(layout, list) or not layout:
+        raise ValueError("Custom layout must be a non-empty list of [x, y, width, height] boxes")
+    boxes = []
+    for i, box in enumerate(layout, 1):
+        if (not isinstance(box, (list, tuple)) or len(box) != 4
+                or not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in box)):
+            raise ValueError(f"Box {i} of the custom layout is not [x, y, width, height]")
+        if box[2] <= 0 or box[3] <= 0:
+            raise ValueError(f"Box {i} of the custom layout has no area")
+        boxes.append(tuple(box))
+    return boxes
+
+
+def page_layouts(num_images, custom_layout=None, layout_style='default', per_page=None):
+    # Layout boxes of each panel page. A custom layout is repeated on as many pages as the frames need;
+    # an invalid one is ignored and the frames are paginated as without it.
+    if custom_layout:
+        try:
+            layout = parse_custom_layout(custom_layout)
+        except ValueError as e:
+            logger.warning("%s. Using the %s layout.", e, layout_style)
+        else:
+            return [layout[:num_images - start] for start in range(0, num_images, len(layout))]
+    per_page = PANELS_PER_PAGE if per_page is None else per_page
+    return [list(layout) for layout in _page_layouts(num_images, layout_style, per_page)]
+
+
+@functools.lru_cache(maxsize=256)
+def _page_panel_rects(num_images, layout_style, per_page, page_size):
+    return tuple(tuple(layout_panel_rects(layout, page_size))
+                 for layout in _page_layouts(num_images, layout_style, per_page))
+
+
+def page_panel_rects(num_images, custom_layout=None, layout_style='default', page_size=A4, per_page=None):
+    # Page positions of the panels, one list per page; computed once per (count, style, page size)
+    per_page = PANELS_PER_PAGE if per_page is None else per_page
+    if custom_layout:
+        return [layout_panel_rects(layout, page_size)
+                for layout in page_layouts(num_images, custom_layout, layout_style, per_page)]
+    return [list(rects) for rects in _page_panel_rects(num_images, layout_style, per_page, tuple(page_size))]
+
+
+def layout_panel_rects(layout, page_size=A4):
+    # Page position (x, y, width, height) in points of each layout box on the image page
+    page_width, page_height = page_size
+    content_width = page_width - 2 * PAGE_MARGIN
+    content_height = page_height - 2 * PAGE_MARGIN
+    image_area_height = content_height * IMAGE_AREA_RATIO
+    image_start_y = page_height - PAGE_MARGIN - TITLE_HEIGHT - image_area_height
+
+    return [(PAGE_MARGIN + x * content_width,
+             image_start_y + (1 - y - h) * image_area_height,
+             w * content_width,
+             h * image_area_height) for x, y, w, h in layout]
+
+
+def panel_image_rect(panel_rect, border_thickness):
+    # The area of a panel left for its image inside the border, which is stroked on the panel edge
+    img_x, img_y, img_w, img_h = panel_rect
+    image_margin = border_thickness / 2
+    return img_x + image_margin, img_y + image_margin, img_w - 2 * image_margin, img_h - 2 * image_margin
+
+
+def bubble_rect(panel_rect, text_width, font_size, border_thickness, position):
+    # Page position (x, y, width, height) of the dialogue bubble of a panel; the text baseline is
+    # BUBBLE_MARGIN above its bottom edge
+    img_x, img_y, img_w, img_h = panel_rect
+    bubble_width = min(text_width + 2 * BUBBLE_MARGIN, img_w - 2 * BUBBLE_MARGIN)
+    bubble_height = font_size + 2 * BUBBLE_MARGIN
+    bubble_x = img_x + img_w / 2 - bubble_width / 2
+
+    if position == "inside_bottom":
+        bubble_y = img_y + bubble_height + border_thickness
+    elif position == "outside_bottom":
+        bubble_y = img_y - bubble_height
+    else:  # inside_top
+        bubble_y = img_y + img_h - bubble_height - border_thickness
+    return bubble_x, bubble_y, bubble_width, bubble_height
+
+
+def page_title(title, page_number, page_count):
+    # Later panel pages of a long comic are numbered
+    return title if page_number == 0 else f"{title} ({page_number + 1}/{page_count})"
+
+
+def parse_color(color):
+    # "#RRGGBB" as (red, green, blue) between 0 and 1
+    return tuple(int(color.lstrip('#')[i:i + 2], 16) / 255 for i in (0, 2, 4))
@@ -0,0 +1,127 @@
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from reportlab.lib.colors import Color
+from reportlab.lib.utils import ImageReader
+from comic_layout import (PAGE_MARGIN, TITLE_HEIGHT, TITLE_BASELINE, BUBBLE_MARGIN, BUBBLE_RADIUS, DIALOGUE_POSITIONS,
+                          page_panel_rects, panel_image_rect, bubble_rect, page_title, parse_color)
+from image_prep import prepare_panel_images
+from font_manager import get_main_font, string_width
+from text_layout import wrap_lines, lines_per_page, paginate, draw_text_page
+from telemetry import span
+import io
+
+
+def pdf_image_source(image):
+    # Frames arrive as file paths or as decoded PNG bytes straight from the API
+    if isinstance(image, (bytes, bytearray)):
+        return ImageReader(io.BytesIO(image))
+    return image
+
+
+def draw_panel(c, i, image, img_x, img_y, img_w, img_h, main_font, font_size, border_thickness, dialogue_position,
+               position, frame_color, full_fill):
+    # page_preview.render_page draws the same panel with NumPy and Pillow; keep the two in step
+    img_path = pdf_image_source(image)
+
+    c.setStrokeColor(frame_color)
+    c.setLineWidth(border_thickness)
+    c.rect(img_x, img_y, img_w, img_h)
+
+    image_x, image_y, image_w, image_h = panel_image_rect((img_x, img_y, img_w, img_h), border_thickness)
+    if full_fill:
+        c.drawImage(img_path, image_x, image_y, width=image_w, height=image_h, mask='auto')
+    else:
+        c.drawImage(img_path, image_x, image_y, width=image_w, height=image_h, preserveAspectRatio=True,
+                    mask='auto')
+
+    if dialogue_position != "None":
+        c.setFont(main_font, font_size)
+        dialogue_text = f"{i + 1}"
+        bubble_x, bubble_y, bubble_width, bubble_height = bubble_rect(
+            (img_x, img_y, img_w, img_h), string_width(dialogue_text, main_font, font_size), font_size,
+            border_thickness, position)
+
+        c.setFillColor(Color(1, 1, 1))
+        c.setStrokeColor(frame_color)
+        c.roundRect(bubble_x, bubble_y, bubble_width, bubble_height, BUBBLE_RADIUS, fill=1, stroke=1)
+
+        c.setFillColor(Color(0.1, 0.1, 0.1))
+        c.drawCentredString(bubble_x + bubble_width / 2, bubble_y + BUBBLE_MARGIN, dialogue_text)
+
+
+def create_pdf(images, story_content, title, font_size, custom_layout, border_thickness, dialogue_position, frame_color,
+               full_fill=False, layout_style='default', pdf_path="story_output.pdf", image_dpi=None, jpeg_quality=None):
+    # Font Unicode, đăng ký một lần cho mỗi process
+    main_font = get_main_font()
+
+    page_width, page_height = A4
+    margin = PAGE_MARGIN
+
+    # With pdf_path=None the PDF is built in memory and returned as bytes
+    output = io.BytesIO() if pdf_path is None else pdf_path
+    c = canvas.Canvas(output, pagesize=A4)
+
+    # Panel pages, one at a time: only the frames of the current page are resampled and held in memory
+    title_height = TITLE_HEIGHT
+    pages = page_panel_rects(len(images), custom_layout, layout_style) or [[]]
+
+    # Parse frame color
+    frame_color = Color(*parse_color(frame_color))
+
+    # Map dialogue positions
+    position = DIALOGUE_POSITIONS.get(dialogue_position, "inside_bottom")
+
+    first_panel = 0
+    for page_number, panel_rects in enumerate(pages):
+        if page_number > 0:
+            c.showPage()
+        # Set title
+        c.setFont(main_font, font_size + 8)
+        c.setFillColor(Color(0.1, 0.1, 0.1))
+        c.drawCentredString(page_width / 2, page_height - TITLE_BASELINE, page_title(title, page_number, len(pages)))
+
+        # Resample each frame to its printed panel size instead of embedding the full 1024x1024 PNG
+        with span("pdf_images", frames=len(panel_rects), page=page_number + 1):
+            page_images = prepare_panel_images(
+                images[first_panel:first_panel + len(panel_rects)],
+                [panel_image_rect(rect, border_thickness)[2:] for rect in panel_rects],
+                dpi=image_dpi,
+                jpeg_quality=jpeg_quality,
+                full_fill=full_fill
+            )
+
+        # Draw images
+        for i, (image, (img_x, img_y, img_w, img_h)) in enumerate(zip(page_images, panel_rects), first_panel):
+            draw_panel(c, i, image, img_x, img_y, img_w, img_h, main_font, font_size, border_thickness,
+                       dialogue_position, position, frame_color, full_fill)
+        first_panel += len(panel_rects)
+
+    # New page for story
+    c.showPage()
+
+    # Story page settings
+    c.setFont(main_font, font_size + 8)
+    c.setFillColor(Color(0.1, 0.1, 0.1))
+    c.drawCentredString(page_width / 2, page_height - TITLE_BASELINE, f"{title} - Story")
+
+    # Draw story content: wrap and paginate first, then emit each page in one text object
+    max_width = page_width - 2 * margin
+    line_height = font_size * 1.2
+    text_top = page_height - margin - title_height
+
+    with span("pdf_text", characters=len(story_content)):
+        lines = wrap_lines(story_content, max_width, lambda word: string_width(word, main_font, font_size),
+                           string_width(' ', main_font, font_size))
+        pages = paginate(lines, lines_per_page(text_top, margin, line_height))
+
+        for page_number, page_lines in enumerate(pages):
+            if page_number > 0:
+                c.showPage()
+            draw_text_page(c, page_lines, margin, text_top, main_font, font_size, line_height, Color(0.1, 0.1, 0.1))
+
+    # Compresses and writes every page, including the embedded panels
+    with span("pdf_write"):
+        c.save()
+    if pdf_path is None:
+        return output.getvalue()
+    return pdf_path
@@ -0,0 +1,81 @@
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+logger = logging.getLogger(__name__)
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Fonts")
+
+# Tried in order until one registers; each entry is (font name, TTF path, optional bold variant)
+FONT_FALLBACK_CHAIN = [
+    ("DejaVuSans", os.path.join(FONTS_DIR, "dsf", "DejaVuSans.ttf"),
+     ("DejaVuSans-Bold", os.path.join(FONTS_DIR, "dsf", "DejaVuSans-Bold.ttf"))),
+    ("ArialUnicode", os.path.join(FONTS_DIR, "ArialUnicode.ttf"), None),
+    ("ComicSansMS", os.path.join(FONTS_DIR, "dsf", "DejaVuSans.ttf"), None),
+]
+# Built into reportlab, always available but without Vietnamese glyphs
+LAST_RESORT_FONT = "Helvetica"
+
+_main_font = None
+_font_lock = threading.Lock()
+_load_timings = {}
+
+
+def _register(name, path):
+    start = time.perf_counter()
+    try:
+        pdfmetrics.registerFont(TTFont(name, path))
+    finally:
+        _load_timings[name] = time.perf_counter() - start
+
+
+def get_main_font():
+    # Registers the first available font of the fallback chain on first use, once per process
+    global _main_font
+    if _main_font is not None:
+        return _main_font
+
+    with _font_lock:
+        if _main_font is None:
+            for name, path, bold in FONT_FALLBACK_CHAIN:
+                try:
+                    _register(name, path)
+                    if bold is not None:
+                        _register(*bold)
+                    _main_font = name
+                    break
+                except Exception as e:
+                    logger.info("Font %s unavailable: %s", name, str(e))
+            else:
+                logger.warning("No Unicode font available. Vietnamese characters may not display correctly.")
+                _main_font = LAST_RESORT_FONT
+    return _main_font
+
+
+@lru_cache(maxsize=65536)
+def _unit_width(text, font_name):
+    return pdfmetrics.stringWidth(text, font_name, 1)
+
+
+def string_width(text, font_name, font_size):
+    # Shared width cache for text wrapping and bubble sizing: widths scale linearly with the size
+    return _unit_width(text, font_name) * font_size
+
+
+def main_font_path():
+    # TTF file of the main font, for text drawn with Pillow; None when it is the reportlab built-in
+    name = get_main_font()
+    for font_name, path, _ in FONT_FALLBACK_CHAIN:
+        if font_name == name:
+            return path
+    return None
+
+
+def font_load_timings():
+    # Seconds spent parsing each registered TTF file
+    return dict(_load_timings)
@@ -0,0 +1,120 @@
+import base64
+import os
+
+from api_scheduler import create_openai_client, create_async_openai_client
+from telemetry import span
+
+# Which backend serves chat and image calls: "openai", or "mock" for offline load tests
+IMAGE_BACKEND = os.environ.get("STORYGEN_IMAGE_BACKEND", "openai")
+
+
+class OpenAIBackend:
+    """The three raw API calls the pipeline makes.
+
+    complete() returns the completion text, stream() an iterator of text deltas
+    (closing it closes the HTTP stream) and create_image() the PNG bytes. The
+    *_async methods are the same calls on the AsyncOpenAI client. Rate limits and
+    retries are applied around these calls by the scheduler.
+    """
+
+    name = "openai"
+
+    def __init__(self, client=None, chat_model="gpt-4o", async_client=None):
+        self._client = client
+        self._async_client = async_client
+        self.chat_model = chat_model
+
+    @property
+    def client(self):
+        # Created on first use, so a process serving only async requests never builds the sync pool
+        if self._client is None:
+            self._client = create_openai_client()
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = create_async_openai_client()
+        return self._async_client
+
+    def complete(self, prompt):
+        response = self.client.chat.completions.create(
+            model=self.chat_model,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        return response.choices[0].message.content
+
+    def stream(self, prompt):
+        # The request is sent here, so a failure surfaces inside scheduler.call and can be retried
+        response = self.client.chat.completions.create(
+            model=self.chat_model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True
+        )
+        return self._deltas(response)
+
+    def _deltas(self, response):
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            response.close()
+
+    def create_image(self, prompt, model="dall-e-3", size="1024x1024", quality="standard"):
+        response = self.client.images.generate(
+            model=model,
+            prompt=prompt,
+            n=1,
+            size=size,
+            response_format="b64_json",
+            quality=quality
+        )
+        with span("decode"):
+            return base64.b64decode(response.data[0].b64_json)
+
+    async def complete_async(self, prompt):
+        response = await self.async_client.chat.completions.create(
+            model=self.chat_model,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        return response.choices[0].message.content
+
+    async def stream_async(self, prompt):
+        response = await self.async_client.chat.completions.create(
+            model=self.chat_model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True
+        )
+        return self._deltas_async(response)
+
+    async def _deltas_async(self, response):
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
+
+    async def create_image_async(self, prompt, model="dall-e-3", size="1024x1024", quality="standard"):
+        response = await self.async_client.images.generate(
+            model=model,
+            prompt=prompt,
+            n=1,
+            size=size,
+            response_format="b64_json",
+            quality=quality
+        )
+        with span("decode"):
+            return base64.b64decode(response.data[0].b64_json)
+
+
+def get_backend(name=None):
+    name = IMAGE_BACKEND if name is None else name
+    if name == "openai":
+        return OpenAIBackend()
+    if name == "mock":
+        # Only load tests need NumPy image synthesis
+        from mock_image_generation import MockBackend
+        return MockBackend()
+    raise ValueError(f"Unknown image backend: {name}")
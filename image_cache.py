@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+IMAGE_CACHE_DIR = os.environ.get("STORYGEN_IMAGE_CACHE_DIR", os.path.join(".cache", "images"))
+# Total size of cached PNGs before least recently used entries are evicted (0 disables the cache)
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("STORYGEN_IMAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Reuse the cached image of an earlier prompt at least this similar (TF-IDF cosine, 0 disables)
+SIMILAR_PROMPT_THRESHOLD = float(os.environ.get("STORYGEN_SIMILAR_PROMPT_THRESHOLD", "0"))
+SIMILARITY_INDEX_DIR = os.environ.get("STORYGEN_SIMILARITY_INDEX_DIR",
+                                      os.path.join(IMAGE_CACHE_DIR, "similarity"))
+
+
+def image_cache_key(**params):
+    # Hash every request parameter so a change of size or quality is a different entry
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    """Content-addressed PNG store shared by every worker process on the host.
+
+    Image bytes live in one file per key; a SQLite index in WAL mode tracks sizes,
+    last access times and the hit/miss/eviction counters, and serialises eviction
+    between processes.
+    """
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.index_path = os.path.join(cache_dir, "index.sqlite3")
+        self._local = threading.local()
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, last_access REAL)")
+        db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+        db.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+
+    def _db(self):
+        # sqlite3 connections cannot be shared between threads, keep one per thread
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            self._local.db = db
+        return db
+
+    def _object_path(self, key):
+        return os.path.join(self.objects_dir, key[:2], f"{key}.png")
+
+    def _count(self, db, name, amount=1):
+        db.execute("UPDATE stats SET value = value + ? WHERE name = ?", (amount, name))
+
+    def get(self, key):
+        db = self._db()
+        row = db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        data = None
+        if row is not None:
+            try:
+                with open(self._object_path(key), "rb") as file:
+                    data = file.read()
+            except FileNotFoundError:
+                # Evicted by another process between the lookup and the read
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+        if data is None:
+            self._count(db, "misses")
+            return None
+
+        db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._count(db, "hits")
+        return data
+
+    def put(self, key, data):
+        # Returns the number of entries evicted to make room
+        path = self._object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write under a temporary name first so readers never see a half-written PNG
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+        db = self._db()
+        evicted = []
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, len(data), time.time()))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, size in db.execute(
+                        "SELECT key, size FROM entries WHERE key != ? ORDER BY last_access", (key,)).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append(old_key)
+                    total -= size
+                db.executemany("DELETE FROM entries WHERE key = ?", [(old_key,) for old_key in evicted])
+                self._count(db, "evictions", len(evicted))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+        for old_key in evicted:
+            try:
+                os.remove(self._object_path(old_key))
+            except FileNotFoundError:
+                pass
+        return len(evicted)
+
+    def keys(self):
+        return {key for key, in self._db().execute("SELECT key FROM entries")}
+
+    def __len__(self):
+        return self._db().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self):
+        db = self._db()
+        result = dict(db.execute("SELECT name, value FROM stats").fetchall())
+        entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        result.update(entries=entries, bytes=size, max_bytes=self.max_bytes)
+        return result
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    # Built on first use; returns None when the cache is disabled
+    global _image_cache
+    if IMAGE_CACHE_MAX_BYTES <= 0:
+        return None
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = ImageCache()
+    return _image_cache
+
+
+_similarity_index = None
+
+
+def get_similarity_index():
+    # Built on first use; returns None when similar-prompt reuse or the image cache is disabled
+    global _similarity_index
+    if SIMILAR_PROMPT_THRESHOLD <= 0 or IMAGE_CACHE_MAX_BYTES <= 0:
+        return None
+    with _image_cache_lock:
+        if _similarity_index is None:
+            # Only processes that reuse similar prompts need NumPy
+            from similarity_index import SimilarityIndex
+            _similarity_index = SimilarityIndex(SIMILARITY_INDEX_DIR)
+    return _similarity_index
+
+
+if __name__ == "__main__":
+    cache = get_image_cache()
+    print(json.dumps(cache.stats() if cache else {"enabled": False}, indent=2))
@@ -1,68 +1,477 @@
-import base64
-from openai import OpenAI
-from prompt_template import PROMPT_GENERATION_TEMPLATE
+import contextvars
+import hashlib
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from api_scheduler import scheduler
+from image_backends import get_backend, IMAGE_BACKEND
+from prompt_template import PROMPT_GENERATION_TEMPLATE, KEY_EVENTS_TEMPLATE
+from long_story import is_long_story, condense_story
+from image_cache import get_image_cache, image_cache_key, get_similarity_index, SIMILAR_PROMPT_THRESHOLD
+from prompt_cache import get_prompt_cache, prompt_cache_key
+from prompt_parser import PromptStreamParser, parse_prompts
+from checkpoints import get_checkpoint_store
+from telemetry import span, iter_in_job, new_job_id, FRAMES, JOBS
 import os
 
-client = OpenAI(api_key="key")
+logger = logging.getLogger(__name__)
+
+# OpenAI by default, or the synthetic mock backend (STORYGEN_IMAGE_BACKEND=mock).
+# Built on first use, so importing this module does not create an HTTP client.
+backend = None
+_backend_lock = threading.Lock()
+
+# Maximum number of images.generate calls in flight for one story (1 = sequential)
+IMAGE_CONCURRENCY = int(os.environ.get("STORYGEN_IMAGE_CONCURRENCY", "4"))
+# Start each image as soon as its prompt has been streamed instead of waiting for the full list
+STREAM_PROMPTS = os.environ.get("STORYGEN_STREAM_PROMPTS", "1") == "1"
+# Write each frame to output_dir; with 0 frames stay in memory as PNG bytes only
+SAVE_FRAMES = os.environ.get("STORYGEN_SAVE_FRAMES", "1") == "1"
+# Image request of each render tier: drafts are cheap, fast frames for trying styles and layouts,
+# finals are rendered from the same prompts once the user is happy with them
+RENDER_TIERS = {
+    "draft": {"model": os.environ.get("STORYGEN_DRAFT_MODEL", "dall-e-2"),
+              "size": os.environ.get("STORYGEN_DRAFT_SIZE", "512x512"), "quality": "standard"},
+    "final": {"model": "dall-e-3", "size": "1024x1024", "quality": "standard"}
+}
+# Tier of newly generated comics, draft or final
+RENDER_TIER = os.environ.get("STORYGEN_RENDER_TIER", "final")
 
 def read_story_from_file(story_file):
     with open(story_file, 'r', encoding='utf-8') as file:
         return file.read()
 
+def current_backend():
+    global backend
+    if backend is None:
+        with _backend_lock:
+            if backend is None:
+                backend = get_backend()
+    return backend
+
+
+def backend_name():
+    # Known without building the backend, so cache hits never create a client
+    return backend.name if backend is not None else IMAGE_BACKEND
+
+
+def story_prompt_key(story_content, num_frames, art_style):
+    # Prompt cache and checkpoint key; long stories also depend on the map template
+    template = PROMPT_GENERATION_TEMPLATE
+    if is_long_story(story_content):
+        template += KEY_EVENTS_TEMPLATE
+    if backend_name() != "openai":
+        # Synthetic prompts must never be served to real requests
+        template += backend_name()
+    return prompt_cache_key(story_content, num_frames, art_style, template)
+
+
+def checkpoint_key(story_content, num_frames, art_style, tier):
+    # Draft and final runs of the same story may run side by side, so each tier keeps its own checkpoint
+    return f"{story_prompt_key(story_content, num_frames, art_style)}:{tier}"
+
+
+def resume_prompts(saved_prompts, prompts):
+    # The prompts of a job interrupted while its completion streamed: the ones it saved, which its finished
+    # frames were made from, then the rest of a new completion
+    for i, prompt in enumerate(prompts):
+        yield saved_prompts[i] if i < len(saved_prompts) else prompt
+
+
+def chat_completion(prompt):
+    with span("chat", prompt_chars=len(prompt)):
+        return scheduler.call("chat", current_backend().complete, prompt)
+
+
+def prompt_request(story_content, num_frames, art_style):
+    # Long stories are condensed by parallel map requests, so only the reduce step sees the whole plot
+    if is_long_story(story_content):
+        story_content = condense_story(story_content, num_frames, chat_completion)
+    return PROMPT_GENERATION_TEMPLATE.format(story=story_content, number=num_frames, style=art_style)
+
+
+def lookup_prompts(story_content, num_frames, art_style):
+    # Font or border tweaks resubmit the same story, so reuse the prompts from last time.
+    # Returns (cache, key, prompts), prompts None on a miss; shared with async_pipeline.
+    cache = get_prompt_cache()
+    key = story_prompt_key(story_content, num_frames, art_style)
+    cached_prompts = cache.get(key) if cache is not None else None
+    if cached_prompts is not None:
+        logger.info("Using cached prompts")
+    return cache, key, cached_prompts
+
+
+def keep_prompts(cache, key, prompts):
+    if cache is not None and prompts:
+        cache.put(key, prompts)
+
+
 def generate_prompts(story_content, num_frames, art_style):
-    prompt = PROMPT_GENERATION_TEMPLATE.format(story=story_content, number=num_frames, style=art_style)
-
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    prompts = response.choices[0].message.content.split('[')
-    cleaned_prompts = []
-    for prompt in prompts:
-        if prompt.strip():  # Ignore empty or whitespace-only strings
-            # Remove the leading number and bracket, and strip any excess whitespace
-            cleaned_prompt = prompt.split(']', 1)[-1].strip().strip('"')
-            cleaned_prompts.append(cleaned_prompt)    
-    return cleaned_prompts
-
-
-def create_image(prompt, model="dall-e-3"):
-    print(f"Creating image with prompt: {prompt}")
+    cache, key, cached_prompts = lookup_prompts(story_content, num_frames, art_style)
+    if cached_prompts is not None:
+        return cached_prompts
+
+    with span("prompts", frames=num_frames):
+        prompts = request_prompts(story_content, num_frames, art_style)
+    keep_prompts(cache, key, prompts)
+    return prompts
+
+
+def request_prompts(story_content, num_frames, art_style):
+    prompt = prompt_request(story_content, num_frames, art_style)
+    return parse_prompts(chat_completion(prompt))[:num_frames]
+
+
+def stream_prompts(story_content, num_frames, art_style):
+    # Yields each prompt as soon as it is complete in the streamed chat completion
+    cache, key, cached_prompts = lookup_prompts(story_content, num_frames, art_style)
+    if cached_prompts is not None:
+        yield from cached_prompts
+        return
+
+    # The span runs until the last prompt is parsed, including the time to first token
+    with span("prompts", frames=num_frames, streamed=True):
+        prompt = prompt_request(story_content, num_frames, art_style)
+        stream = scheduler.call("chat", current_backend().stream, prompt)
+
+        parser = PromptStreamParser()
+        prompts = []
+        for text in stream:
+            for finished_prompt in parser.feed(text)[:num_frames - len(prompts)]:
+                prompts.append(finished_prompt)
+                yield finished_prompt
+            if len(prompts) >= num_frames:
+                # Anything past the requested frame count would be dropped anyway
+                stream.close()
+                break
+        else:
+            for finished_prompt in parser.close()[:num_frames - len(prompts)]:
+                prompts.append(finished_prompt)
+                yield finished_prompt
+
+    keep_prompts(cache, key, prompts)
+
+
+def create_image(prompt, model="dall-e-3", size="1024x1024", quality="standard"):
+    logger.debug("Creating image with prompt: %s", prompt)
     if not prompt:
         raise ValueError("Empty prompt provided to create_image function")
 
-    response = client.images.generate(
-        model=model,
-        prompt=prompt,
-        n=1,
-        size="1024x1024",
-        response_format="b64_json",
-        quality="standard"
-    )
-    return response.data[0].b64_json
+    # PNG bytes
+    with span("image", model=model, size=size):
+        return scheduler.call("image", current_backend().create_image, prompt, model=model, size=size,
+                              quality=quality)
 
 
-def process_story(story_content, num_frames, art_style):
-    prompts = generate_prompts(story_content, num_frames, art_style)
-    print(f"Generated prompts: {prompts}")
+def frame_image_key(prompt, model="dall-e-3", size="1024x1024", quality="standard"):
+    if backend_name() != "openai":
+        return image_cache_key(prompt=prompt, model=model, size=size, quality=quality, n=1, backend=backend_name())
+    return image_cache_key(prompt=prompt, model=model, size=size, quality=quality, n=1)
 
-    result_images = []
-    os.makedirs("images", exist_ok=True)
 
-    for i, prompt in enumerate(prompts):
+def cached_image(cache, prompt, model="dall-e-3", size="1024x1024", quality="standard"):
+    # The cached PNG of this request or, when enabled, of an earlier prompt close enough to it
+    key = frame_image_key(prompt, model=model, size=size, quality=quality)
+    image_data = cache.get(key)
+    index = get_similarity_index()
+    if image_data is not None or index is None:
+        return image_data
+
+    with span("similar_lookup"):
+        # Only prompts with the same model, size, quality and backend can match
+        matches = index.search(prompt, frame_image_key("", model=model, size=size, quality=quality))
+    # Best first; the image of a closer prompt may have been evicted since it was indexed
+    for match_key, similarity in matches:
+        if similarity < SIMILAR_PROMPT_THRESHOLD:
+            break
+        image_data = cache.get(match_key)
+        if image_data is not None:
+            logger.info("Reusing the image of a similar prompt (similarity %.3f)", similarity)
+            # The next identical request is an exact hit
+            index.note_evictions(cache.put(key, image_data))
+            return image_data
+    return None
+
+
+def store_image(cache, prompt, image_data, model="dall-e-3", size="1024x1024", quality="standard"):
+    key = frame_image_key(prompt, model=model, size=size, quality=quality)
+    evicted = cache.put(key, image_data)
+    index = get_similarity_index()
+    if index is not None:
+        index.note_evictions(evicted)
+        row = index.add(prompt, frame_image_key("", model=model, size=size, quality=quality), key)
+        # The cache evicts least recently used images; the index drops their rows in batches
+        index.compact_if_stale(cache, row + 1)
+
+
+def lookup_image(prompt, model="dall-e-3", size="1024x1024", quality="standard"):
+    # Returns (cache, png_bytes), png_bytes None on a miss; shared with async_pipeline
+    cache = get_image_cache()
+    image_data = cached_image(cache, prompt, model=model, size=size, quality=quality) if cache is not None else None
+    return cache, image_data
+
+
+def keep_image(cache, prompt, image_data, model="dall-e-3", size="1024x1024", quality="standard"):
+    if cache is not None:
+        store_image(cache, prompt, image_data, model=model, size=size, quality=quality)
+
+
+def fetch_image(prompt, model="dall-e-3", size="1024x1024", quality="standard"):
+    # Returns (png_bytes, from_cache); identical or near-identical requests are served from the image cache
+    cache, image_data = lookup_image(prompt, model=model, size=size, quality=quality)
+    if image_data is not None:
+        return image_data, True
+
+    image_data = create_image(prompt, model=model, size=size, quality=quality)
+    keep_image(cache, prompt, image_data, model=model, size=size, quality=quality)
+    return image_data, False
+
+
+def generate_frame(i, prompt, output_dir="images", save=None, tier="final"):
+    # Returns a frame dict; a failure only marks its own frame, the others keep going.
+    # The decoded PNG stays in frame["image"] so the PDF never has to read it back from disk.
+    frame = {"index": i, "prompt": prompt, "tier": tier}
+    try:
+        image_data, from_cache = fetch_image(prompt, **RENDER_TIERS[tier])
+        write_frame(frame, image_data, from_cache, output_dir, save)
+    except Exception as e:
+        fail_frame(frame, e)
+    FRAMES.inc(status=frame["status"], tier=tier)
+    return frame
+
+
+def write_frame(frame, image_data, from_cache, output_dir, save=None):
+    # Saves and hashes a fetched image and marks its frame done or cached; shared with async_pipeline
+    if save is None:
+        save = SAVE_FRAMES and output_dir is not None
+    i = frame["index"]
+    tier = frame.get("tier", "final")
+    with span("frame_write", frame=i + 1, bytes=len(image_data)):
+        image_path = None
+        if save:
+            image_path = save_frame_image(i, image_data, output_dir, tier)
+            logger.debug("Saved image: %s%s", image_path, " (cached)" if from_cache else "")
+        image_hash = hashlib.sha256(image_data).hexdigest()
+
+    frame.update(status="cached" if from_cache else "done", label=f"Frame {i + 1}",
+                 image=image_data, path=image_path, image_key=frame_image_key(frame["prompt"], **RENDER_TIERS[tier]),
+                 image_hash=image_hash)
+    return frame
+
+
+def needs_final(frame):
+    # Draft and failed frames; finalizing leaves frames that already have their full-quality image alone
+    return frame.get("tier", "final") != "final" or frame["status"] not in SUCCESS_FRAME_STATUSES
+
+
+def fail_frame(frame, error):
+    logger.warning("Error generating image for prompt %d: %s", frame["index"] + 1, str(error))
+    frame.update(status="failed", label=f"Frame {frame['index'] + 1} (Error)", image=None, path=None,
+                 error=str(error))
+    return frame
+
+
+def save_frame_image(i, image_data, output_dir, tier="final"):
+    # Drafts get their own file, so finalizing a frame never overwrites an image still in use
+    suffix = "" if tier == "final" else f"_{tier}"
+    image_path = os.path.join(output_dir, f"frame_{i + 1}{suffix}.png")
+    with open(image_path, "wb") as file:
+        file.write(image_data)
+    return image_path
+
+
+def frame_result(frame):
+    # The (label, image) pair returned by process_story: the image path, the PNG bytes
+    # when frames are kept in memory, or the error message for a failed frame
+    if frame["status"] == "failed":
+        return frame["label"], frame["error"]
+    return frame["label"], frame["path"] or frame["image"]
+
+
+FINAL_FRAME_STATUSES = ("done", "cached", "failed")
+SUCCESS_FRAME_STATUSES = ("done", "cached")
+
+
+def job_outcome(statuses):
+    failed = statuses.count("failed")
+    return "failed" if not statuses or failed == len(statuses) else "partial" if failed else "ok"
+
+
+def load_checkpoint_image(record):
+    # The PNG of a checkpointed frame, from its saved file or the image cache, if it still matches its hash
+    candidates = []
+    if record.get("path") and os.path.exists(record["path"]):
+        with open(record["path"], "rb") as file:
+            candidates.append(file.read())
+    cache = get_image_cache()
+    if cache is not None and record.get("image_key"):
+        candidates.append(cache.get(record["image_key"]))
+
+    for image_data in candidates:
+        if image_data is not None and hashlib.sha256(image_data).hexdigest() == record.get("image_hash"):
+            return image_data
+    return None
+
+
+def restore_frame(record, i, prompt, output_dir, save=None, tier="final"):
+    # A frame finished by an earlier attempt of the same job, or None if it must be generated again
+    if not record or record["status"] not in SUCCESS_FRAME_STATUSES or record["prompt"] != prompt:
+        return None
+    # The model or size of the tier may have changed since the frame was saved
+    if record.get("image_key") != frame_image_key(prompt, **RENDER_TIERS[tier]):
+        return None
+    image_data = load_checkpoint_image(record)
+    if image_data is None:
+        return None
+
+    if save is None:
+        save = SAVE_FRAMES and output_dir is not None
+    image_path = save_frame_image(i, image_data, output_dir, tier) if save else None
+    logger.info("Restored frame %d from checkpoint", i + 1)
+    return {"index": i, "prompt": prompt, "tier": tier, "status": "cached", "label": f"Frame {i + 1}",
+            "image": image_data, "path": image_path, "image_key": record["image_key"],
+            "image_hash": record["image_hash"], "restored": True}
+
+
+def frame_event(i, prompt, tier, status):
+    # The queued and generating events of a frame, before it has a result
+    return {"index": i, "prompt": prompt, "tier": tier, "status": status}
+
+
+class JobCheckpoint:
+    """Checkpoint of one job: a retry of the same story resumes from its saved prompts and finished frames.
+
+    Shared by both pipelines. The constructor and every method touch SQLite or image files,
+    so async_pipeline calls them through asyncio.to_thread.
+    """
+
+    def __init__(self, story_content, num_frames, art_style, tier):
+        self.store = get_checkpoint_store()
+        self.job_key = checkpoint_key(story_content, num_frames, art_style, tier)
+        self.tier = tier
+        self.saved_prompts, self.complete, self.saved_frames = (
+            self.store.load(self.job_key) if self.store is not None else (None, False, {}))
+        if self.complete:
+            logger.info("Resuming job %s from checkpoint", self.job_key[:12])
+        elif self.saved_prompts:
+            logger.info("Resuming job %s after prompt %d", self.job_key[:12], len(self.saved_prompts))
+
+    def prompt_added(self, prompts):
+        # Saved before the new prompt's frame starts, so a crash mid-stream still leaves a job to resume
+        if self.store is not None and not self.complete:
+            self.store.save_prompts(self.job_key, prompts, complete=False)
+
+    def prompts_done(self, prompts):
+        if self.store is not None and not self.complete and prompts:
+            self.store.save_prompts(self.job_key, prompts)
+
+    def restore(self, i, prompt, output_dir):
+        # The frame finished by an earlier attempt, or None if it must be generated again
+        frame = restore_frame(self.saved_frames.get(i), i, prompt, output_dir, tier=self.tier)
+        if frame is not None:
+            self.save_frame(frame)
+        return frame
+
+    def save_frame(self, frame):
+        if self.store is not None:
+            self.store.save_frame(self.job_key, frame)
+
+
+def finish_job(job_span, statuses):
+    outcome = job_span["outcome"] = job_outcome(statuses)
+    JOBS.inc(outcome=outcome)
+    logger.info("Job finished: %s, %d/%d frames", outcome, len(statuses) - statuses.count("failed"), len(statuses))
+
+
+def iter_story_frames(story_content, num_frames, art_style, max_workers=None, stream=None, output_dir="images",
+                      executor=None, job_id=None, tier=None):
+    # Yields a frame dict every time a frame changes status: queued, generating, then done, cached or failed.
+    # Pass a shared executor to bound image calls across several stories (max_workers is then ignored).
+    # Every log line and span of the job, including those from worker threads, carries job_id.
+    # tier is a key of RENDER_TIERS, RENDER_TIER by default.
+    frames = _iter_story_frames(story_content, num_frames, art_style, max_workers, stream, output_dir, executor,
+                                tier or RENDER_TIER)
+    return iter_in_job(job_id or new_job_id(), frames)
+
+
+def _iter_story_frames(story_content, num_frames, art_style, max_workers, stream, output_dir, executor, tier):
+    if stream is None:
+        stream = STREAM_PROMPTS
+    if max_workers is None:
+        max_workers = IMAGE_CONCURRENCY
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    logger.info("Job started: %d frames, %s style, %s tier, %d characters", num_frames, art_style, tier,
+                len(story_content))
+    statuses = []
+    with span("job", frames=num_frames, tier=tier) as job_span:
+        checkpoint = JobCheckpoint(story_content, num_frames, art_style, tier)
+        if checkpoint.complete:
+            prompts = checkpoint.saved_prompts
+        else:
+            if stream:
+                prompts = stream_prompts(story_content, num_frames, art_style)
+            else:
+                prompts = generate_prompts(story_content, num_frames, art_style)
+                logger.debug("Generated prompts: %s", prompts)
+            if checkpoint.saved_prompts:
+                prompts = resume_prompts(checkpoint.saved_prompts, prompts)
+
+        events = queue.Queue()
+
+        def run_frame(i, prompt):
+            events.put(frame_event(i, prompt, tier, "generating"))
+            frame = generate_frame(i, prompt, output_dir, tier=tier)
+            checkpoint.save_frame(frame)
+            events.put(frame)
+
+        def take_event():
+            nonlocal pending
+            event = events.get()
+            if event["status"] in FINAL_FRAME_STATUSES:
+                pending -= 1
+                statuses.append(event["status"])
+            return event
+
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
         try:
-            b64_image = create_image(prompt)
-            image_data = base64.b64decode(b64_image)
+            pending = 0
+            all_prompts = []
+            for i, prompt in enumerate(prompts):
+                all_prompts.append(prompt)
+                checkpoint.prompt_added(all_prompts)
+                restored = checkpoint.restore(i, prompt, output_dir)
+                if restored is not None:
+                    statuses.append(restored["status"])
+                    yield restored
+                    continue
+
+                yield frame_event(i, prompt, tier, "queued")
+                # Carry the caller's context (request priority, job ID) into the worker thread
+                executor.submit(contextvars.copy_context().run, run_frame, i, prompt)
+                pending += 1
+                # Report progress while the model is still writing the later prompts
+                while not events.empty():
+                    yield take_event()
+
+            checkpoint.prompts_done(all_prompts)
+            while pending:
+                yield take_event()
+        finally:
+            if own_executor:
+                executor.shutdown(wait=True)
 
-            image_filename = f"frame_{i + 1}.png"
-            image_path = os.path.join("images", image_filename)
-            with open(image_path, "wb") as file:
-                file.write(image_data)
+        finish_job(job_span, statuses)
 
-            result_images.append((f"Frame {i + 1}", image_path))
-            print(f"Saved image: {image_path}")
-        except Exception as e:
-            print(f"Error generating image for prompt {i + 1}: {str(e)}")
-            result_images.append((f"Frame {i + 1} (Error)", str(e)))
 
-    return result_images
\ No newline at end of file
+def process_story(story_content, num_frames, art_style, max_workers=None, stream=None, output_dir="images",
+                  executor=None, job_id=None, tier=None):
+    frames = {}
+    for frame in iter_story_frames(story_content, num_frames, art_style, max_workers, stream, output_dir, executor,
+                                   job_id, tier):
+        frames[frame["index"]] = frame
+    return [frame_result(frames[i]) for i in sorted(frames)]
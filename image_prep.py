@@ -0,0 +1,64 @@
+import io
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+# Resolution panels are resampled to for the PDF (0 embeds the original frames)
+PDF_IMAGE_DPI = int(os.environ.get("STORYGEN_PDF_IMAGE_DPI", "200"))
+# JPEG quality used for panels in the PDF; 0, the default, keeps lossless PNG
+PDF_JPEG_QUALITY = int(os.environ.get("STORYGEN_PDF_JPEG_QUALITY", "0"))
+PDF_PREP_WORKERS = int(os.environ.get("STORYGEN_PDF_PREP_WORKERS", "4"))
+
+POINTS_PER_INCH = 72
+
+
+def open_image(image):
+    if isinstance(image, (bytes, bytearray)):
+        return Image.open(io.BytesIO(image))
+    return Image.open(image)
+
+
+def prepare_panel_image(image, width, height, dpi=None, jpeg_quality=None, full_fill=False):
+    # Resample one frame to the pixels its panel needs when printed (width/height in points)
+    dpi = PDF_IMAGE_DPI if dpi is None else dpi
+    jpeg_quality = PDF_JPEG_QUALITY if jpeg_quality is None else jpeg_quality
+    if dpi <= 0:
+        return image
+
+    with open_image(image) as source:
+        target_width = max(1, math.ceil(width / POINTS_PER_INCH * dpi))
+        target_height = max(1, math.ceil(height / POINTS_PER_INCH * dpi))
+        if full_fill:
+            # The PDF stretches the image to the panel anyway, so each axis can shrink on its own
+            size = (min(source.width, target_width), min(source.height, target_height))
+        else:
+            scale = min(target_width / source.width, target_height / source.height, 1)
+            size = (max(1, round(source.width * scale)), max(1, round(source.height * scale)))
+
+        has_alpha = "A" in source.getbands() or "transparency" in source.info
+        use_jpeg = jpeg_quality > 0 and not has_alpha
+        if size == source.size and not use_jpeg:
+            return image
+
+        resized = source.resize(size, Image.LANCZOS) if size != source.size else source.copy()
+
+    output = io.BytesIO()
+    if use_jpeg:
+        resized.convert("RGB").save(output, format="JPEG", quality=jpeg_quality, optimize=True)
+    else:
+        resized.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+def prepare_panel_images(images, sizes, dpi=None, jpeg_quality=None, full_fill=False, max_workers=None):
+    # Resample every frame for its panel in parallel; Pillow releases the GIL while resizing and encoding
+    max_workers = PDF_PREP_WORKERS if max_workers is None else max_workers
+    jobs = list(zip(images, sizes))
+    if max_workers <= 1 or len(jobs) <= 1:
+        return [prepare_panel_image(image, w, h, dpi, jpeg_quality, full_fill) for image, (w, h) in jobs]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as executor:
+        return list(executor.map(
+            lambda job: prepare_panel_image(job[0], job[1][0], job[1][1], dpi, jpeg_quality, full_fill), jobs))
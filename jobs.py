@@ -0,0 +1,98 @@
+import io
+import os
+import uuid
+
+from PIL import Image
+
+from image_generation import needs_final
+from workspace import create_job_workspace
+
+
+def new_job(story_content, num_frames, art_style):
+    # Everything a generation produced that a later re-layout needs, kept in the Gradio session.
+    # Frames and PDF go to the job's own workspace so concurrent requests never share files.
+    job_id = uuid.uuid4().hex
+    return {
+        "id": job_id,
+        "workspace": create_job_workspace(job_id),
+        "story_content": story_content,
+        "num_frames": num_frames,
+        "art_style": art_style,
+        "frames": {}
+    }
+
+
+def update_job_frame(job, frame):
+    job["frames"][frame["index"]] = frame
+
+
+def job_images(job):
+    # PNG bytes of the successful frames in frame order, ready for create_pdf without a disk read
+    frames = job["frames"]
+    return [frames[i]["image"] for i in sorted(frames) if frames[i].get("image")]
+
+
+def job_gallery(job):
+    # Gallery items: the saved frame file, or a PIL image when frames are kept in memory
+    frames = job["frames"]
+    return [frame_gallery_item(frames[i]) for i in sorted(frames) if frames[i].get("image")]
+
+
+def frame_gallery_item(frame):
+    # The small preview when there is one, so the browser does not download every full-size PNG.
+    # The janitor may have removed the workspace of an idle session since, then the kept bytes are shown.
+    if frame.get("thumbnail") and os.path.exists(frame["thumbnail"]):
+        return frame["thumbnail"]
+    return frame_full_image(frame)
+
+
+def frame_full_image(frame):
+    if frame.get("path") and os.path.exists(frame["path"]):
+        return frame["path"]
+    return Image.open(io.BytesIO(frame["image"]))
+
+
+def job_frame_at(job, position):
+    # The frame at a position of the gallery, which only lists the successful frames
+    frames = job["frames"]
+    shown = [frames[i] for i in sorted(frames) if frames[i].get("image")]
+    return shown[position] if 0 <= position < len(shown) else None
+
+
+def job_pdf_path(job):
+    return os.path.join(job["workspace"], "story_output.pdf")
+
+
+def parse_frame_numbers(selection, num_frames):
+    # Frame indices of a selection like "1, 3-4" (1-based, inclusive); every frame when it is empty
+    if not selection or not selection.strip():
+        return set(range(num_frames))
+    indices = set()
+    for part in selection.split(","):
+        first, _, last = part.strip().partition("-")
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            raise ValueError(f"Not a frame number or range: {part.strip()!r}") from None
+        if not 1 <= first <= last <= num_frames:
+            raise ValueError(f"Frames run from 1 to {num_frames}: {part.strip()!r}")
+        indices.update(range(first - 1, last))
+    return indices
+
+
+def job_frames_to_finalize(job, selection=None):
+    # The approved frames that still lack their full-quality image
+    frames = job["frames"]
+    indices = parse_frame_numbers(selection, len(frames))
+    return [frames[i] for i in sorted(frames) if i in indices and needs_final(frames[i])]
+
+
+def update_job_final_frame(job, frame):
+    # A final render that failed keeps the draft in the comic and records why; finalizing can simply be
+    # retried, and a final image that lands replaces the entry along with the error
+    current = job["frames"][frame["index"]]
+    if frame["status"] == "failed" and current.get("image"):
+        current["final_error"] = frame["error"]
+        return
+    update_job_frame(job, frame)
@@ -0,0 +1,119 @@
+import contextvars
+import logging
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from prompt_template import KEY_EVENTS_TEMPLATE
+
+logger = logging.getLogger(__name__)
+
+# Stories longer than this are condensed chunk by chunk before prompt generation
+LONG_STORY_CHARS = int(os.environ.get("STORYGEN_LONG_STORY_CHARS", "12000"))
+LONG_STORY_CHUNK_CHARS = int(os.environ.get("STORYGEN_LONG_STORY_CHUNK_CHARS", "6000"))
+LONG_STORY_WORKERS = int(os.environ.get("STORYGEN_LONG_STORY_WORKERS", "4"))
+
+# Lines that open a new scene: "***", "---", "# Heading", "Chapter 3", "Chương 3"
+SCENE_BREAK = re.compile(r'^\s*(?:[*#~=-]\s*){3,}$|^\s*#+\s|^\s*(?:chapter|chương)\s+\w+', re.IGNORECASE)
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+# Bullet or number opening a list item: "- ", "• ", "* ", "3. ", "3) "
+LIST_MARKER = re.compile(r'^\s*(?:[-•*]|\d+[.)])\s+')
+
+
+def is_long_story(story_content):
+    return LONG_STORY_CHARS > 0 and len(story_content) > LONG_STORY_CHARS
+
+
+def _split_paragraph(paragraph, max_chars):
+    # Only paragraphs longer than a chunk are cut, at sentence ends
+    if len(paragraph) <= max_chars:
+        return [paragraph]
+    pieces, current = [], ""
+    for sentence in SENTENCE_END.split(paragraph):
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(story_content, max_chars=None):
+    # Scene-aware chunks of at most max_chars: paragraphs are never split unless they alone are
+    # too long, and a scene break starts a new chunk once the current one is half full
+    max_chars = LONG_STORY_CHUNK_CHARS if max_chars is None else max_chars
+    paragraphs = [p.strip() for p in re.split(r'\n\s*\n', story_content) if p.strip()]
+
+    chunks, current = [], []
+    current_length = 0
+    for paragraph in paragraphs:
+        scene_break = SCENE_BREAK.match(paragraph.split('\n', 1)[0]) is not None
+        for piece in _split_paragraph(paragraph, max_chars):
+            too_long = current_length + len(piece) + 2 > max_chars
+            if current and (too_long or (scene_break and current_length >= max_chars / 2)):
+                chunks.append("\n\n".join(current))
+                current, current_length = [], 0
+            current.append(piece)
+            current_length += len(piece) + 2
+            scene_break = False
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _parse_sections(text):
+    # Splits a KEY_EVENTS_TEMPLATE answer into (character lines, event lines)
+    sections = {"CHARACTERS": [], "EVENTS": []}
+    current = None
+    for line in text.splitlines():
+        stripped = line.strip().strip('*').strip()
+        header = stripped.rstrip(':').upper()
+        if header in sections:
+            current = header
+            continue
+        if current and stripped:
+            sections[current].append(LIST_MARKER.sub('', stripped).strip())
+    return sections["CHARACTERS"], sections["EVENTS"]
+
+
+def key_event_requests(story_content, num_frames):
+    # Map step: one KEY_EVENTS_TEMPLATE request per chunk
+    chunks = split_into_chunks(story_content)
+    max_events = max(2, math.ceil(2 * num_frames / len(chunks)))
+    logger.info("Long story: %d characters in %d chunks", len(story_content), len(chunks))
+    return [KEY_EVENTS_TEMPLATE.format(part=i + 1, total=len(chunks), max_events=max_events, chunk=chunk)
+            for i, chunk in enumerate(chunks)]
+
+
+def condense_story(story_content, num_frames, complete, max_workers=None):
+    # Map: extract characters and key events from every chunk in parallel.
+    # Reduce input: one character sheet plus all events in story order, short enough for a single prompt request.
+    max_workers = LONG_STORY_WORKERS if max_workers is None else max_workers
+    requests = key_event_requests(story_content, num_frames)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(requests)))) as executor:
+        # One copy of the caller's context per request: job ID and request priority follow the map calls
+        contexts = [contextvars.copy_context() for _ in requests]
+        answers = list(executor.map(lambda context, request: context.run(complete, request), contexts, requests))
+    return merge_key_events(answers)
+
+
+def merge_key_events(answers):
+    # Reduce input from the answers in chunk order
+    characters, seen = [], set()
+    event_lines = []
+    for i, answer in enumerate(answers):
+        chunk_characters, chunk_events = _parse_sections(answer)
+        for line in chunk_characters:
+            # The first description of a character wins, so traits stay consistent across frames
+            name = re.split(r'[:\-–(]', line, 1)[0].strip().lower()
+            if name and name not in seen:
+                seen.add(name)
+                characters.append(line)
+        event_lines.extend(f"Part {i + 1}: {event}" for event in chunk_events)
+
+    return ("Character sheet (keep these traits identical in every prompt):\n" + "\n".join(characters) +
+            "\n\nKey events in story order:\n" + "\n".join(event_lines))
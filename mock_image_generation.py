@@ -1,36 +1,219 @@
-import os
-
-def read_story_from_file(file):
-    return file.decode('utf-8')
-
-def generate_prompts(story_content, num_frames, art_style):
-    # Mock prompts
-    mock_prompts = [
-        "A young hero embarking on a journey",
-        "The hero facing a fearsome dragon",
-        "The hero discovering a magical artifact",
-        "The hero returning triumphantly to their village",
-        "The hero celebrating with friends and family"
-    ]
-    return mock_prompts[:num_frames]
-
-def create_image(i):
-    # Instead of creating an image, we'll return a path to a mock image
-    return f"images/frame_{i + 1}.png"
-
-def process_story(story_content, num_frames, art_style):
-    prompts = generate_prompts(story_content, num_frames, art_style)
-    print(f"Generated prompts: {prompts}")
-
-    result_images = []
-
-    for i, prompt in enumerate(prompts):
-        try:
-            image_path = create_image(i)
-            result_images.append((f"Frame {i + 1}", image_path))
-            print(f"Mock image path: {image_path}")
-        except Exception as e:
-            print(f"Error generating image for prompt {i + 1}: {str(e)}")
-            result_images.append((f"Frame {i + 1} (Error)", str(e)))
-
-    return result_images
\ No newline at end of file
+import asyncio
+import hashlib
+import os
+import random
+import re
+import string
+import threading
+import time
+from collections import Counter
+from io import BytesIO
+
+import httpx
+import numpy as np
+import openai
+from PIL import Image
+
+from prompt_template import PROMPT_GENERATION_TEMPLATE, KEY_EVENTS_TEMPLATE
+
+# Synthetic backend for offline load tests: STORYGEN_IMAGE_BACKEND=mock
+# Frame size, e.g. 256x256; empty uses the size of the request
+MOCK_IMAGE_SIZE = os.environ.get("STORYGEN_MOCK_IMAGE_SIZE", "")
+# Latency distributions: "fixed:S", "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA" (seconds)
+MOCK_IMAGE_LATENCY = os.environ.get("STORYGEN_MOCK_IMAGE_LATENCY", "lognormal:1.0,0.5")
+MOCK_CHAT_LATENCY = os.environ.get("STORYGEN_MOCK_CHAT_LATENCY", "lognormal:0.5,0.3")
+MOCK_TOKEN_DELAY = float(os.environ.get("STORYGEN_MOCK_TOKEN_DELAY", "0.005"))
+# Fraction of calls failing with a 503, and with a 429 carrying Retry-After
+MOCK_FAILURE_RATE = float(os.environ.get("STORYGEN_MOCK_FAILURE_RATE", "0"))
+MOCK_RATE_LIMIT_RATE = float(os.environ.get("STORYGEN_MOCK_RATE_LIMIT_RATE", "0"))
+MOCK_SEED = int(os.environ.get("STORYGEN_MOCK_SEED", "0"))
+
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+|\s*\n\s*')
+
+
+def parse_latency(spec):
+    # Returns a function drawing one latency in seconds from a random.Random
+    kind, _, values = spec.partition(":")
+    if not values:
+        kind, values = "fixed", kind
+    params = [float(value) for value in values.split(",")]
+    if kind == "fixed":
+        return lambda rng: params[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == "lognormal":
+        # Parameterised by the median, which is what latency dashboards show
+        return lambda rng: params[0] * rng.lognormvariate(0, params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def parse_size(size):
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+
+def synthetic_png(prompt, size="1024x1024", seed=0):
+    # The same prompt, size and seed always give the same PNG
+    width, height = parse_size(size)
+    digest = hashlib.sha256(f"{seed}:{size}:{prompt}".encode("utf-8")).digest()
+    rng = np.random.default_rng(int.from_bytes(digest[:8], "big"))
+
+    # A gradient sky, a few flat shapes and some grain, so it compresses like an illustration
+    top, bottom = rng.integers(0, 256, (2, 3))
+    blend = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+    pixels = np.broadcast_to(top * (1 - blend) + bottom * blend, (height, width, 3)).copy()
+    for _ in range(rng.integers(3, 8)):
+        x0, x1 = np.sort(rng.integers(0, width, 2))
+        y0, y1 = np.sort(rng.integers(0, height, 2))
+        pixels[y0:y1 + 1, x0:x1 + 1] = rng.integers(0, 256, 3)
+    pixels += rng.normal(0, 6, pixels.shape).astype(np.float32)
+
+    buffer = BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def api_error(status_code, message, retry_after=None):
+    # Raised like the SDK does, so the scheduler retries it as it would a real failure
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else None
+    response = httpx.Response(status_code, headers=headers, request=httpx.Request("POST", "https://mock.invalid/v1"))
+    error_class = openai.RateLimitError if status_code == 429 else openai.InternalServerError
+    return error_class(message, response=response, body=None)
+
+
+def template_pattern(template):
+    # Regex matching a formatted template; repeated fields must repeat the same value
+    parts, seen = [], set()
+    for literal, field, _, _ in string.Formatter().parse(template):
+        parts.append(re.escape(literal))
+        if field is None:
+            continue
+        parts.append(f"(?P={field})" if field in seen else f"(?P<{field}>.*?)")
+        seen.add(field)
+    return re.compile("".join(parts), re.DOTALL)
+
+
+PROMPT_PATTERN = template_pattern(PROMPT_GENERATION_TEMPLATE)
+KEY_EVENTS_PATTERN = template_pattern(KEY_EVENTS_TEMPLATE)
+
+
+def pick_sentences(text, count):
+    sentences = [" ".join(s.split()) for s in SENTENCE_END.split(text) if s.strip()]
+    if not sentences:
+        sentences = ["A quiet scene"]
+    return [sentences[i * len(sentences) // count] for i in range(count)]
+
+
+def mock_prompts_text(story, number, style):
+    scenes = pick_sentences(story, number)
+    return "\n".join(f'[{i + 1}] "{scene[:200].rstrip(".")}. Illustrated in {style} style."'
+                     for i, scene in enumerate(scenes))
+
+
+def mock_key_events_text(chunk, max_events):
+    # Capitalised words that do not open a sentence are taken as character names
+    names = Counter(re.findall(r'(?<=[a-z,;] )([A-Z][a-z]{2,})\b', chunk))
+    characters = [f"{name}: the same outfit and hair in every scene" for name, _ in names.most_common(3)]
+    events = pick_sentences(chunk, max_events)
+    return "CHARACTERS:\n" + "\n".join(characters) + "\n\nEVENTS:\n" + "\n".join(f"- {e}" for e in events)
+
+
+class MockBackend:
+    """Same interface as image_backends.OpenAIBackend, without the network.
+
+    Answers the prompt templates with scenes taken from the story, draws
+    deterministic synthetic PNGs, and sleeps and fails with the configured
+    distributions so the whole pipeline can be load-tested offline.
+    """
+
+    name = "mock"
+
+    def __init__(self, image_size=MOCK_IMAGE_SIZE, image_latency=MOCK_IMAGE_LATENCY, chat_latency=MOCK_CHAT_LATENCY,
+                 token_delay=MOCK_TOKEN_DELAY, failure_rate=MOCK_FAILURE_RATE, rate_limit_rate=MOCK_RATE_LIMIT_RATE,
+                 seed=MOCK_SEED):
+        self.image_size = image_size
+        self.image_latency = parse_latency(image_latency)
+        self.chat_latency = parse_latency(chat_latency)
+        self.token_delay = token_delay
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self, latency):
+        # Returns (latency, status code of an injected failure or None)
+        with self._lock:
+            roll = self._rng.random()
+            seconds = latency(self._rng)
+        if roll < self.rate_limit_rate:
+            return seconds, 429
+        if roll < self.rate_limit_rate + self.failure_rate:
+            return seconds, 503
+        return seconds, None
+
+    def _wait(self, latency):
+        seconds, status_code = self._draw(latency)
+        if status_code == 429:
+            # Throttling is answered straight away
+            raise api_error(429, "Mock rate limit reached", retry_after=1)
+        time.sleep(max(0.0, seconds))
+        if status_code is not None:
+            raise api_error(status_code, "Mock server error")
+
+    async def _wait_async(self, latency):
+        seconds, status_code = self._draw(latency)
+        if status_code == 429:
+            raise api_error(429, "Mock rate limit reached", retry_after=1)
+        await asyncio.sleep(max(0.0, seconds))
+        if status_code is not None:
+            raise api_error(status_code, "Mock server error")
+
+    def _answer(self, prompt):
+        match = PROMPT_PATTERN.fullmatch(prompt)
+        if match:
+            return mock_prompts_text(match["story"], int(match["number"]), match["style"])
+        match = KEY_EVENTS_PATTERN.fullmatch(prompt)
+        if match:
+            return mock_key_events_text(match["chunk"], int(match["max_events"]))
+        return "OK"
+
+    def complete(self, prompt):
+        self._wait(self.chat_latency)
+        text = self._answer(prompt)
+        # A buffered completion still takes as long as generating every token
+        time.sleep(self.token_delay * len(text) / 4)
+        return text
+
+    def stream(self, prompt):
+        self._wait(self.chat_latency)
+        return self._deltas(self._answer(prompt))
+
+    def _deltas(self, text):
+        for i in range(0, len(text), 4):
+            time.sleep(self.token_delay)
+            yield text[i:i + 4]
+
+    def create_image(self, prompt, model="dall-e-3", size="1024x1024", quality="standard"):
+        self._wait(self.image_latency)
+        return synthetic_png(prompt, self.image_size or size, self.seed)
+
+    async def complete_async(self, prompt):
+        await self._wait_async(self.chat_latency)
+        text = self._answer(prompt)
+        await asyncio.sleep(self.token_delay * len(text) / 4)
+        return text
+
+    async def stream_async(self, prompt):
+        await self._wait_async(self.chat_latency)
+        return self._deltas_async(self._answer(prompt))
+
+    async def _deltas_async(self, text):
+        for i in range(0, len(text), 4):
+            await asyncio.sleep(self.token_delay)
+            yield text[i:i + 4]
+
+    async def create_image_async(self, prompt, model="dall-e-3", size="1024x1024", quality="standard"):
+        await self._wait_async(self.image_latency)
+        # Drawing the PNG is CPU work, keep it off the event loop
+        return await asyncio.to_thread(synthetic_png, prompt, self.image_size or size, self.seed)
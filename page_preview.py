@@ -0,0 +1,181 @@
+import functools
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.lib.pagesizes import A4
+
+from comic_layout import (TITLE_BASELINE, BUBBLE_MARGIN, BUBBLE_RADIUS, DIALOGUE_POSITIONS, page_panel_rects,
+                          panel_image_rect, bubble_rect, page_title, parse_color)
+from font_manager import get_main_font, main_font_path, string_width
+from image_prep import open_image
+from telemetry import span
+
+# Panel pages as raster images, with the layout math of create_pdf but composited with NumPy and Pillow:
+# the live page preview of the UI and share images of batch runs, without going through reportlab.
+
+# Width in pixels of a rendered A4 page
+PREVIEW_WIDTH = int(os.environ.get("STORYGEN_PREVIEW_WIDTH", "800"))
+# Frames kept decoded between renders, so a layout tweak does not decode every PNG again
+PREVIEW_CACHE_ENTRIES = int(os.environ.get("STORYGEN_PREVIEW_CACHE_ENTRIES", "32"))
+
+WHITE = (255, 255, 255)
+TEXT_COLOR = (26, 26, 26)
+# Panels without a frame yet, when previewing a layout before generating
+EMPTY_PANEL_COLOR = (232, 232, 232)
+
+
+@functools.lru_cache(maxsize=max(1, PREVIEW_CACHE_ENTRIES))
+def _decoded(image, max_side, modified=None):
+    # A frame (path or PNG bytes) as RGB or RGBA, shrunk to at most max_side pixels.
+    # modified is the mtime of a path, so a rewritten file is decoded again.
+    with open_image(image) as source:
+        source.draft("RGB", (max_side, max_side))
+        source.thumbnail((max_side, max_side), Image.BILINEAR)
+        has_alpha = "A" in source.getbands() or "transparency" in source.info
+        return source.convert("RGBA" if has_alpha else "RGB")
+
+
+@functools.lru_cache(maxsize=max(1, 4 * PREVIEW_CACHE_ENTRIES))
+def _resized(image, max_side, modified, size):
+    # Pixels of a frame at its panel size; settings that keep the panel sizes, like colours, bubbles and
+    # the title, redraw the page without resampling anything
+    decoded = _decoded(image, max_side, modified)
+    resized = decoded.resize(size, Image.BILINEAR, reducing_gap=2.0) if size != decoded.size else decoded
+    return np.asarray(resized)
+
+
+@functools.lru_cache(maxsize=64)
+def _font(size):
+    path = main_font_path()
+    if path is None:
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(path, size)
+
+
+def _box(rect, scale, page_height):
+    # Pixel box (left, top, right, bottom) of a rectangle in points, whose origin is the bottom-left corner
+    x, y, w, h = rect
+    return x * scale, (page_height - y - h) * scale, (x + w) * scale, (page_height - y) * scale
+
+
+def _fill(pixels, box, color):
+    height, width = pixels.shape[:2]
+    left, top, right, bottom = (round(value) for value in box)
+    left, top, right, bottom = max(left, 0), max(top, 0), min(right, width), min(bottom, height)
+    if left < right and top < bottom:
+        pixels[top:bottom, left:right] = color
+
+
+def _stroke(pixels, box, line_width, color):
+    # A rectangle outline centred on the box edges, as reportlab strokes it
+    half = max(line_width, 1) / 2
+    left, top, right, bottom = box
+    outer_left, outer_top, outer_right, outer_bottom = left - half, top - half, right + half, bottom + half
+    inner_left, inner_top, inner_right, inner_bottom = left + half, top + half, right - half, bottom - half
+    _fill(pixels, (outer_left, outer_top, outer_right, inner_top), color)
+    _fill(pixels, (outer_left, inner_bottom, outer_right, outer_bottom), color)
+    _fill(pixels, (outer_left, inner_top, inner_left, inner_bottom), color)
+    _fill(pixels, (inner_right, inner_top, outer_right, inner_bottom), color)
+
+
+def _paste(pixels, array, left, top):
+    # Copies RGB or RGBA pixels onto the page at (left, top), clipped to the page; alpha is blended as
+    # drawImage's mask does
+    height, width = pixels.shape[:2]
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(left + array.shape[1], width), min(top + array.shape[0], height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    array = array[y0 - top:y1 - top, x0 - left:x1 - left]
+    region = pixels[y0:y1, x0:x1]
+    if array.shape[2] == 4:
+        alpha = array[..., 3:].astype(np.float32) / 255
+        region[:] = (region * (1 - alpha) + array[..., :3] * alpha + 0.5).astype(np.uint8)
+    else:
+        region[:] = array
+
+
+def _draw_image(pixels, image, box, full_fill, max_side):
+    left, top, right, bottom = box
+    area_width, area_height = right - left, bottom - top
+    if area_width < 1 or area_height < 1:
+        return
+    if image is None:
+        _fill(pixels, box, EMPTY_PANEL_COLOR)
+        return
+
+    if isinstance(image, (bytes, bytearray)):
+        image, modified = bytes(image), None
+    else:
+        modified = os.stat(image).st_mtime_ns
+    decoded = _decoded(image, max_side, modified)
+    if full_fill:
+        size = (round(area_width), round(area_height))
+    else:
+        # preserveAspectRatio: the largest size that fits, centred in the panel
+        fit = min(area_width / decoded.width, area_height / decoded.height)
+        size = (max(1, round(decoded.width * fit)), max(1, round(decoded.height * fit)))
+    _paste(pixels, _resized(image, max_side, modified, size), round(left + (area_width - size[0]) / 2),
+           round(top + (area_height - size[1]) / 2))
+
+
+def render_page(images, panel_rects, title, font_size, border_thickness, dialogue_position, frame_color,
+                full_fill=False, first_panel=0, width=None, page_size=A4):
+    # One panel page as a PIL image, width pixels wide; images holds the frames of this page, None for
+    # an empty panel, and panel_rects their page positions in points as create_pdf gets them.
+    # comic_pdf.draw_panel draws the same panel with reportlab; keep the two in step.
+    width = PREVIEW_WIDTH if width is None else width
+    page_width, page_height = page_size
+    scale = width / page_width
+    height = round(page_height * scale)
+    color = tuple(round(channel * 255) for channel in parse_color(frame_color))
+    position = DIALOGUE_POSITIONS.get(dialogue_position, "inside_bottom")
+    line_width = border_thickness * scale
+
+    # Borders and frames are slice assignments on one array, so the cost is the resampling, not the drawing
+    pixels = np.full((height, width, 3), 255, dtype=np.uint8)
+    for image, rect in zip(images, panel_rects):
+        _stroke(pixels, _box(rect, scale, page_height), line_width, color)
+        # No panel is wider than the page, so frames are never decoded larger than that
+        _draw_image(pixels, image, _box(panel_image_rect(rect, border_thickness), scale, page_height), full_fill,
+                    width)
+
+    page = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(page)
+    main_font = get_main_font()
+    draw.text((width / 2, TITLE_BASELINE * scale), title or "", fill=TEXT_COLOR,
+              font=_font(max(1, round((font_size + 8) * scale))), anchor="ms")
+
+    # Bubbles go on top of every panel; in the PDF a later panel can cover an outside bubble
+    if dialogue_position != "None":
+        half = line_width / 2
+        for i, rect in enumerate(panel_rects[:len(images)], first_panel):
+            dialogue_text = f"{i + 1}"
+            bubble = bubble_rect(rect, string_width(dialogue_text, main_font, font_size), font_size, border_thickness,
+                                 position)
+            left, top, right, bottom = _box(bubble, scale, page_height)
+            if right <= left or bottom <= top:
+                continue
+            # Pillow draws the outline inside the box, reportlab centres it on the edge
+            draw.rounded_rectangle((left - half, top - half, right + half, bottom + half),
+                                   radius=BUBBLE_RADIUS * scale + half, fill=WHITE, outline=color,
+                                   width=max(1, round(line_width)))
+            draw.text(((left + right) / 2, bottom - BUBBLE_MARGIN * scale), dialogue_text, fill=TEXT_COLOR,
+                      font=_font(max(1, round(font_size * scale))), anchor="ms")
+    return page
+
+
+def render_pages(images, title, font_size, custom_layout, border_thickness, dialogue_position, frame_color,
+                 full_fill=False, layout_style='default', width=None, page_size=A4):
+    # Every panel page create_pdf would draw for the same arguments, as PIL images; the story pages are left out
+    pages = page_panel_rects(len(images), custom_layout, layout_style, page_size) or [[]]
+    rendered = []
+    with span("page_preview", pages=len(pages), frames=len(images)):
+        first_panel = 0
+        for page_number, panel_rects in enumerate(pages):
+            rendered.append(render_page(images[first_panel:first_panel + len(panel_rects)], panel_rects,
+                                        page_title(title, page_number, len(pages)), font_size, border_thickness,
+                                        dialogue_position, frame_color, full_fill, first_panel, width, page_size))
+            first_panel += len(panel_rects)
+    return rendered
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+PROMPT_CACHE_PATH = os.environ.get("STORYGEN_PROMPT_CACHE_PATH", os.path.join(".cache", "prompts.sqlite3"))
+# Entries kept in the in-memory tier and in the on-disk store (0 disables the cache)
+PROMPT_CACHE_MEMORY_ENTRIES = int(os.environ.get("STORYGEN_PROMPT_CACHE_MEMORY_ENTRIES", "256"))
+PROMPT_CACHE_DISK_ENTRIES = int(os.environ.get("STORYGEN_PROMPT_CACHE_DISK_ENTRIES", "5000"))
+
+
+def normalize_story(story_content):
+    # Whitespace and Unicode composition differences should not change the digest
+    text = unicodedata.normalize("NFC", story_content)
+    return " ".join(text.split())
+
+
+def story_digest(story_content):
+    return hashlib.sha256(normalize_story(story_content).encode("utf-8")).hexdigest()
+
+
+def template_version(template):
+    # Any edit to the template text yields a new version and invalidates old entries
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+
+def prompt_cache_key(story_content, num_frames, art_style, template):
+    payload = json.dumps([story_digest(story_content), int(num_frames), art_style, template_version(template)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PromptCache:
+    """Prompt lists keyed by prompt_cache_key: an LRU dict in front of a SQLite file."""
+
+    def __init__(self, path=PROMPT_CACHE_PATH, memory_entries=PROMPT_CACHE_MEMORY_ENTRIES,
+                 disk_entries=PROMPT_CACHE_DISK_ENTRIES):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS prompts (key TEXT PRIMARY KEY, prompts TEXT, created REAL)")
+
+    def _remember(self, key, prompts):
+        self._memory[key] = prompts
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return list(self._memory[key])
+
+            row = self._db.execute("SELECT prompts FROM prompts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            prompts = json.loads(row[0])
+            self._remember(key, prompts)
+            return list(prompts)
+
+    def put(self, key, prompts):
+        prompts = list(prompts)
+        with self._lock:
+            self._remember(key, prompts)
+            self._db.execute("INSERT OR REPLACE INTO prompts VALUES (?, ?, ?)",
+                             (key, json.dumps(prompts, ensure_ascii=False), time.time()))
+            self._db.execute("DELETE FROM prompts WHERE key NOT IN "
+                             "(SELECT key FROM prompts ORDER BY created DESC LIMIT ?)", (self.disk_entries,))
+
+
+_prompt_cache = None
+_prompt_cache_lock = threading.Lock()
+
+
+def get_prompt_cache():
+    # Built on first use; returns None when the cache is disabled
+    global _prompt_cache
+    if PROMPT_CACHE_MEMORY_ENTRIES <= 0:
+        return None
+    with _prompt_cache_lock:
+        if _prompt_cache is None:
+            _prompt_cache = PromptCache()
+    return _prompt_cache
@@ -0,0 +1,79 @@
+import re
+
+# "[3]" opens a prompt at the start of a line (or right after the previous prompt's
+# closing quote); brackets anywhere else are part of the prompt text
+PROMPT_MARKER = re.compile(r'(?m)(?:^|(?<=["”]))[ \t]*\[(\d+)\][ \t]*')
+# A quoted prompt is finished once its closing quote ends the line
+CLOSING_QUOTE = re.compile(r'["”][ \t]*\r?\n')
+
+
+def clean_prompt(text):
+    return text.strip().strip('"“”').strip()
+
+
+class PromptStreamParser:
+    """Incremental parser for the `[n] "..."` list produced by PROMPT_GENERATION_TEMPLATE.
+
+    feed() accepts arbitrary chunks of the completion and returns the prompts that
+    became complete; close() flushes the last one when the stream ends.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._in_prompt = False
+        self._seen_marker = False
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        prompts = []
+        while True:
+            if not self._in_prompt:
+                match = PROMPT_MARKER.search(self._buffer)
+                if match is None:
+                    break
+                # Drop the preamble and the marker itself
+                self._buffer = self._buffer[match.end():]
+                self._in_prompt = True
+                self._seen_marker = True
+
+            end = self._find_prompt_end()
+            if end is None:
+                break
+            prompt = clean_prompt(self._buffer[:end])
+            self._buffer = self._buffer[end:]
+            self._in_prompt = False
+            if prompt:
+                prompts.append(prompt)
+        return prompts
+
+    def _find_prompt_end(self):
+        ends = []
+        next_marker = PROMPT_MARKER.search(self._buffer, 1)
+        if next_marker is not None:
+            ends.append(next_marker.start())
+
+        body = self._buffer.lstrip()
+        if body.startswith(('"', '“')):
+            offset = len(self._buffer) - len(body)
+            closing = CLOSING_QUOTE.search(self._buffer, offset + 1)
+            if closing is not None:
+                ends.append(closing.end())
+        return min(ends) if ends else None
+
+    def close(self):
+        remainder = self._buffer
+        in_prompt = self._in_prompt
+        self._buffer = ""
+        self._in_prompt = False
+        # Text after the last finished prompt is the model's commentary, not another frame
+        if self._seen_marker and not in_prompt:
+            return []
+        # The last prompt runs to the end of the stream; without any "[n]" marker the whole
+        # completion is treated as one prompt
+        prompt = clean_prompt(remainder)
+        return [prompt] if prompt else []
+
+
+def parse_prompts(text):
+    parser = PromptStreamParser()
+    return parser.feed(text) + parser.close()
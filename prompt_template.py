@@ -18,3 +18,18 @@ Ensure all prompts are concise, written in English, and clearly illustrate each
 The story for generating prompts is:
 {story}
 """
+
+KEY_EVENTS_TEMPLATE = """
+You are reading part {part} of {total} of a long story. Extract what an illustrator needs from this part only:
+
+CHARACTERS:
+One line per character appearing in this part, formatted as "Name: fixed visual traits" (age, hair, clothing, distinguishing features).
+
+EVENTS:
+Up to {max_events} key moments of this part in story order, one short line each, describing a static visual scene with its setting, lighting and key objects.
+
+Write in English. Provide only these two sections; do not include any additional information.
+
+The part of the story is:
+{chunk}
+"""
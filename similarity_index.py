@@ -0,0 +1,316 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+
+# Hashed feature space of the prompt vectors
+VECTOR_DIMENSIONS = 512
+# MinHash LSH over the word and word-pair sets: a prompt is only compared with prompts sharing a band.
+# Prompts a few words apart share most pairs and collide in some band; unrelated prompts almost never do.
+LSH_BANDS = 8
+LSH_BAND_ROWS = 4
+# Rows kept per bucket, newest first, so a crowded bucket cannot make a lookup slow
+MAX_BUCKET_ROWS = 64
+# Rows added since the sorted bucket tables were built, before they are rebuilt
+MAX_PENDING_ROWS = 4096
+# Matches search() returns, best first, so a lookup can fall back when the best image was evicted
+MAX_MATCHES = 8
+# Rows per live image cache entry before compact() drops the rows of evicted images
+COMPACT_RATIO = 2
+SEED = 20240607
+
+WORD = re.compile(r"\w+")
+RECORD = np.dtype([("group", "<i8"), ("buckets", "<u4", (LSH_BANDS,)), ("vector", "<f2", (VECTOR_DIMENSIONS,))])
+
+# One multiply-shift hash per MinHash row; the multipliers must be odd
+_MINHASH_MULTIPLIERS, _MINHASH_OFFSETS = np.random.default_rng(SEED).integers(
+    1, 2 ** 63, size=(2, LSH_BANDS * LSH_BAND_ROWS), dtype=np.uint64)
+_MINHASH_MULTIPLIERS |= np.uint64(1)
+
+
+# Multipliers of the polynomial byte hash, by position in the word
+_POSITION_WEIGHTS = np.random.default_rng(SEED + 1).integers(1, 2 ** 63, size=64, dtype=np.uint64) | np.uint64(1)
+_PAIR_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _word_hashes(words):
+    # Stable 64-bit hashes of the words, computed over all their bytes at once
+    encoded = [word.encode("utf-8") for word in words]
+    lengths = np.fromiter((len(word) for word in encoded), dtype=np.intp, count=len(encoded))
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64) + np.uint64(1)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    positions = np.arange(len(data)) - np.repeat(starts, lengths)
+    with np.errstate(over="ignore"):
+        return np.add.reduceat(data * _POSITION_WEIGHTS[positions % len(_POSITION_WEIGHTS)], starts)
+
+
+def word_feature_hashes(prompt):
+    # Hashes of the words and of each pair of neighbouring words
+    words = WORD.findall(prompt.lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    hashes = _word_hashes(words)
+    with np.errstate(over="ignore"):
+        pairs = hashes[:-1] * _PAIR_MULTIPLIER + (hashes[1:] ^ (hashes[1:] >> np.uint64(31)))
+    return np.concatenate((hashes, pairs))
+
+
+def trigram_hashes(prompt):
+    # Character trigrams of each word, so "lantern" and "lanterns" still overlap
+    data = np.frombuffer(("#" + "#".join(WORD.findall(prompt.lower())) + "#").encode("utf-8"), dtype=np.uint8)
+    codes = (data[:-2].astype(np.uint64) << np.uint64(16)) | (data[1:-1].astype(np.uint64) << np.uint64(8)) | data[2:]
+    # A trigram centred on a word boundary spans two words
+    return codes[data[1:-1] != ord("#")]
+
+
+def sketch(prompt):
+    # (TF-IDF term vector before the IDF weights, LSH bucket per band) of a prompt
+    word_hashes = word_feature_hashes(prompt)
+    with np.errstate(over="ignore"):
+        hashes = np.concatenate((word_hashes, trigram_hashes(prompt) * _PAIR_MULTIPLIER))
+        hashes ^= hashes >> np.uint64(29)
+    # Sublinear term frequencies of words, word pairs and trigrams in the hashed feature space, L2-normalised
+    counts = np.bincount((hashes % np.uint64(VECTOR_DIMENSIONS)).astype(np.intp), minlength=VECTOR_DIMENSIONS)
+    vector = counts.astype(np.float32)
+    nonzero = counts > 0
+    vector[nonzero] = 1 + np.log(vector[nonzero])
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+
+    # MinHash signature of the word and pair set, LSH_BAND_ROWS values hashed into one bucket per band
+    word_hashes = np.unique(word_hashes)
+    if not len(word_hashes):
+        return vector, np.zeros(LSH_BANDS, dtype=np.uint32)
+    with np.errstate(over="ignore"):
+        signature = ((word_hashes[:, None] * _MINHASH_MULTIPLIERS + _MINHASH_OFFSETS) >> np.uint64(32)).min(axis=0)
+    buckets = np.array([zlib.crc32(band.tobytes()) for band in signature.reshape(LSH_BANDS, LSH_BAND_ROWS)],
+                       dtype=np.uint32)
+    return vector, buckets
+
+
+def group_id(group):
+    # Prompts only match prompts of the same model, size, quality and backend
+    return int.from_bytes(hashlib.blake2b(group.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+class SimilarityIndex:
+    """Nearest-prompt search over every prompt that produced a cached image.
+
+    Each row stores the hashed term vector of a prompt, its LSH bucket per table
+    and its request group in an append-only memory-mapped file; a SQLite table
+    maps rows to image cache keys and serialises appends between processes.
+    search() gathers the rows sharing a bucket with the query and ranks them by
+    TF-IDF cosine, with document frequencies kept up to date as rows arrive.
+    compact() rewrites the live rows into a file of the next generation, so
+    readers still mapping the previous one are never cut short.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, "index.sqlite3")
+        self._local = threading.local()
+        self._lock = threading.RLock()
+
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS prompts (row INTEGER PRIMARY KEY, key TEXT)")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        db.execute("INSERT OR IGNORE INTO meta VALUES ('generation', 0)")
+        data_path = self._data_path(self._generation(db))
+        if not os.path.exists(data_path):
+            open(data_path, "ab").close()
+
+        self.generation = None
+        self._reset()
+
+    def _data_path(self, generation):
+        # Generation 0 keeps the name the file had before compaction existed
+        name = "vectors.bin" if generation == 0 else f"vectors.{generation}.bin"
+        return os.path.join(self.directory, name)
+
+    def _generation(self, db):
+        return db.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()[0]
+
+    def _reset(self):
+        self.rows = 0
+        self.records = None
+        self.document_frequency = np.zeros(VECTOR_DIMENSIONS, dtype=np.int64)
+        # Per band: bucket ids sorted, and the rows in that order
+        self.sorted_buckets = None
+        self.sorted_rows = None
+        self.indexed_rows = 0
+        # Buckets of the rows added after the sorted tables were built
+        self.pending = {}
+        # Images this process saw the cache evict since the index was last compacted
+        self.evictions = 0
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            self._local.db = db
+        return db
+
+    def refresh(self):
+        # Maps the rows other processes appended since the last call, or all of them after a compaction
+        generation, rows = self._db().execute(
+            "SELECT (SELECT value FROM meta WHERE name = 'generation'), COALESCE(MAX(row) + 1, 0) FROM prompts"
+        ).fetchone()
+        with self._lock:
+            if generation != self.generation:
+                self._reset()
+                self.generation = generation
+            if rows <= self.rows:
+                return
+            try:
+                records = np.memmap(self._data_path(generation), dtype=RECORD, mode="r", shape=(rows,))
+            except FileNotFoundError:
+                # Compacted by another process since the query; the next call maps the new generation
+                return
+            self.records = records
+            for start in range(self.rows, rows, 65536):
+                vectors = self.records["vector"][start:min(rows, start + 65536)]
+                self.document_frequency += (vectors > 0).sum(axis=0)
+            new_rows = range(self.rows, rows)
+            self.rows = rows
+
+            if rows - self.indexed_rows > MAX_PENDING_ROWS:
+                self._build_tables()
+            else:
+                for row in new_rows:
+                    for band, bucket in enumerate(self.records["buckets"][row]):
+                        self.pending.setdefault((band, int(bucket)), []).append(row)
+
+    def _build_tables(self):
+        buckets = np.asarray(self.records["buckets"])
+        # Stable sort of the reversed rows keeps the newest rows first within each bucket
+        reversed_rows = np.arange(self.rows - 1, -1, -1)
+        self.sorted_rows = []
+        self.sorted_buckets = []
+        for band in range(LSH_BANDS):
+            order = reversed_rows[np.argsort(buckets[reversed_rows, band], kind="stable")]
+            self.sorted_rows.append(order)
+            self.sorted_buckets.append(buckets[order, band])
+        self.indexed_rows = self.rows
+        self.pending = {}
+
+    def _candidates(self, buckets):
+        candidates = []
+        for band, bucket in enumerate(buckets):
+            candidates.extend(self.pending.get((band, int(bucket)), [])[-MAX_BUCKET_ROWS:])
+            if self.sorted_buckets is not None:
+                keys = self.sorted_buckets[band]
+                # bucket is a np.uint32: a Python int would make searchsorted convert the whole table
+                start = keys.searchsorted(bucket, side="left")
+                end = min(keys.searchsorted(bucket, side="right"), start + MAX_BUCKET_ROWS)
+                candidates.extend(self.sorted_rows[band][start:end].tolist())
+        return np.unique(np.asarray(candidates, dtype=np.int64))
+
+    def search(self, prompt, group, limit=MAX_MATCHES):
+        # Returns [(image cache key, cosine similarity)] of the closest earlier prompts in the group, best first
+        self.refresh()
+        query, buckets = sketch(prompt)
+        with self._lock:
+            if not self.rows:
+                return []
+            generation = self.generation
+            candidates = self._candidates(buckets)
+            if not len(candidates):
+                return []
+            records = self.records[candidates]
+            in_group = records["group"] == group_id(group)
+            candidates = candidates[in_group]
+            if not len(candidates):
+                return []
+            vectors = records["vector"][in_group].astype(np.float32)
+            idf = np.log((1 + self.rows) / (1 + self.document_frequency)).astype(np.float32) + 1
+
+        weighted_query = query * idf
+        weighted = vectors * idf
+        norms = np.linalg.norm(weighted, axis=1) * np.linalg.norm(weighted_query)
+        scores = weighted @ weighted_query / np.where(norms > 0, norms, 1)
+        best = np.argsort(-scores, kind="stable")[:limit]
+        rows = [int(row) for row in candidates[best]]
+        # Row numbers change with a compaction; matches of an older generation are dropped
+        keys = dict(self._db().execute(
+            f"SELECT row, key FROM prompts WHERE row IN ({','.join('?' * len(rows))}) "
+            "AND (SELECT value FROM meta WHERE name = 'generation') = ?", rows + [generation]).fetchall())
+        matches = {}
+        for row, i in zip(rows, best):
+            # A prompt indexed again after its image was evicted has several rows with the same key
+            if row in keys and keys[row] not in matches and not math.isnan(scores[i]):
+                matches[keys[row]] = float(scores[i])
+        return list(matches.items())
+
+    def add(self, prompt, group, key):
+        record = np.zeros(1, dtype=RECORD)
+        record["vector"], record["buckets"] = sketch(prompt)
+        record["group"] = group_id(group)
+        db = self._db()
+        # The row number is taken and written inside one write transaction, so appends never interleave
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM prompts").fetchone()[0]
+            with open(self._data_path(self._generation(db)), "r+b") as file:
+                file.seek(row * RECORD.itemsize)
+                file.write(record.tobytes())
+            db.execute("INSERT INTO prompts VALUES (?, ?)", (row, key))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return row
+
+    def compact(self, live_keys):
+        # Rewrites the index with only the rows whose image is in live_keys, the newest row per key.
+        # Returns the number of rows kept.
+        live_keys = set(live_keys)
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            generation = self._generation(db)
+            newest = {}
+            for row, key in db.execute("SELECT row, key FROM prompts ORDER BY row"):
+                if key in live_keys:
+                    newest[key] = row
+            kept = sorted((row, key) for key, row in newest.items())
+            rows = np.fromiter((row for row, _ in kept), dtype=np.int64, count=len(kept))
+            old_path, new_path = self._data_path(generation), self._data_path(generation + 1)
+            # Only the kept rows are read from the old file
+            records = np.memmap(old_path, dtype=RECORD, mode="r")[rows] if kept else np.zeros(0, dtype=RECORD)
+            records.tofile(new_path)
+            db.execute("DELETE FROM prompts")
+            db.executemany("INSERT INTO prompts VALUES (?, ?)", enumerate(key for _, key in kept))
+            db.execute("UPDATE meta SET value = ? WHERE name = 'generation'", (generation + 1,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        # Processes still mapping the old file keep reading it until they refresh
+        os.remove(old_path)
+        with self._lock:
+            self.evictions = 0
+        return len(kept)
+
+    def note_evictions(self, count):
+        with self._lock:
+            self.evictions += count
+
+    def compact_if_stale(self, cache, rows):
+        # Drops the rows of images the cache has evicted once they outnumber its live entries. rows is the
+        # size of the index returned by the last add(), so the write path never counts either table.
+        with self._lock:
+            stale = rows > COMPACT_RATIO * max(rows - self.evictions, 1)
+        if stale:
+            self.compact(cache.keys())
+
+    def __len__(self):
+        self.refresh()
+        return self.rows
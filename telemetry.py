@@ -0,0 +1,226 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# INFO logs job progress; DEBUG adds prompts and per-frame details
+LOG_LEVEL = os.environ.get("STORYGEN_LOG_LEVEL", "INFO").upper()
+# Emit every span as a JSON line on the storygen.trace logger
+TRACE_SPANS = os.environ.get("STORYGEN_TRACE", "0") == "1"
+# Prometheus text endpoint next to the Gradio app (0 disables)
+METRICS_PORT = int(os.environ.get("STORYGEN_METRICS_PORT", "7861"))
+# Loopback by default; set 0.0.0.0 for a scraper on another host
+METRICS_HOST = os.environ.get("STORYGEN_METRICS_HOST", "127.0.0.1")
+
+# Seconds; wide enough for a 1 ms parse and a two-minute image call with retries
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# The job every log line and span of the current request belongs to
+current_job_id = contextvars.ContextVar("current_job_id", default="-")
+
+trace_logger = logging.getLogger("storygen.trace")
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+class JobIdFilter(logging.Filter):
+    def filter(self, record):
+        record.job_id = current_job_id.get()
+        return True
+
+
+def configure_logging(level=None):
+    # Called by the entry points; library modules only create their loggers
+    handler = logging.StreamHandler()
+    handler.addFilter(JobIdFilter())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(job_id)s] %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level or LOG_LEVEL)
+    trace_logger.setLevel(logging.DEBUG if TRACE_SPANS else logging.WARNING)
+
+
+def run_in_job(job_id, fn, *args, **kwargs):
+    # Calls fn in a copy of the current context with current_job_id set; pass it to an executor's submit
+    context = contextvars.copy_context()
+    context.run(current_job_id.set, job_id)
+    return context.run(fn, *args, **kwargs)
+
+
+def iter_in_job(job_id, iterator):
+    # Runs every step of iterator with current_job_id set, whichever thread pulls the next item.
+    # Work submitted with contextvars.copy_context() inside it inherits the job ID.
+    context = contextvars.copy_context()
+    context.run(current_job_id.set, job_id)
+    try:
+        while True:
+            try:
+                item = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        # Closing this generator closes iterator too, so its cleanup runs now and in the job's context
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            context.run(close)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], series["counts"]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("storygen_stage_seconds", "Duration of pipeline stages")
+STAGE_ERRORS = Counter("storygen_stage_errors_total", "Pipeline stages that raised")
+API_REQUESTS = Counter("storygen_api_requests_total", "API attempts by kind and outcome")
+API_WAIT_SECONDS = Histogram("storygen_api_wait_seconds", "Time API calls waited for the rate limiter")
+SCHEDULER_QUEUE_DEPTH = Gauge("storygen_scheduler_queue_depth", "API calls waiting for the rate limiter")
+FRAMES = Counter("storygen_frames_total", "Frames by final status and render tier")
+JOBS = Counter("storygen_jobs_total", "Finished generation jobs by outcome")
+METRICS = [STAGE_SECONDS, STAGE_ERRORS, API_REQUESTS, API_WAIT_SECONDS, SCHEDULER_QUEUE_DEPTH, FRAMES, JOBS]
+
+
+@contextmanager
+def span(name, **attributes):
+    # Times one stage of the current job into storygen_stage_seconds, and traces it when enabled
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield attributes
+    except GeneratorExit:
+        # The consumer stopped iterating, e.g. a closed browser tab
+        status = "cancelled"
+        raise
+    except BaseException:
+        status = "error"
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if trace_logger.isEnabledFor(logging.DEBUG):
+            trace_logger.debug(json.dumps(dict(attributes, job=current_job_id.get(), span=name, status=status,
+                                               ms=round(elapsed * 1000, 2)), ensure_ascii=False, default=str))
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port=None, host=None):
+    port = METRICS_PORT if port is None else port
+    host = METRICS_HOST if host is None else host
+    if port <= 0:
+        return None
+    # Only the UI serves metrics, so workers and CLIs skip importing http.server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would drown the app log
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.getLogger(__name__).info("Metrics on http://%s:%d/metrics", host, port)
+    return server
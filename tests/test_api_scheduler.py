@@ -0,0 +1,37 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api_scheduler import RequestScheduler
+from telemetry import render_metrics
+
+
+def test_calls_of_every_kind_share_the_in_flight_limit():
+    scheduler = RequestScheduler(limits={"chat": 0, "image": 0}, max_in_flight=2)
+    lock = threading.Lock()
+    running = peak = 0
+
+    def request():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for future in [executor.submit(scheduler.call, kind, request) for kind in ("chat", "image") * 4]:
+            future.result()
+    assert peak == 2
+
+
+def test_queue_depth_is_exported():
+    scheduler = RequestScheduler(limits={"chat": 0, "image": 600}, burst_seconds=0.001)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(scheduler.call, "image", lambda: None) for _ in range(3)]
+        time.sleep(0.05)
+        assert 'storygen_scheduler_queue_depth{kind="image"} ' in render_metrics()
+        for future in futures:
+            future.result()
+    assert 'storygen_scheduler_queue_depth{kind="image"} 0\n' in render_metrics()
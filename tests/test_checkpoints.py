@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import api_scheduler
+import async_pipeline
+import image_cache
+import image_generation
+from checkpoints import CheckpointStore
+from mock_image_generation import MockBackend
+
+STORY = "A fox wakes at dawn. It crosses a river. It finds a lantern. It walks home at dusk."
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite3"))
+    backend = MockBackend(image_size="64x64", image_latency="fixed:0", chat_latency="fixed:0", token_delay=0.01)
+    scheduler = api_scheduler.RequestScheduler(limits={"chat": 0, "image": 0})
+    for module in (image_generation, async_pipeline):
+        monkeypatch.setattr(module, "scheduler", scheduler)
+    monkeypatch.setattr(image_generation, "get_checkpoint_store", lambda: store)
+    monkeypatch.setattr(image_generation, "get_prompt_cache", lambda: None)
+    monkeypatch.setattr(image_generation, "backend", backend)
+    monkeypatch.setattr(image_cache, "IMAGE_CACHE_MAX_BYTES", 0)
+    return store
+
+
+def interrupted_run(tmp_path, tier):
+    # Stops like a crashed worker once the first frame is done, while the completion is still streaming
+    frames = image_generation.iter_story_frames(STORY, 4, "comic", stream=True, output_dir=str(tmp_path / tier),
+                                                tier=tier)
+    for frame in frames:
+        if frame["status"] == "done":
+            break
+    frames.close()
+
+
+def test_prompts_are_saved_before_the_completion_ends(store, tmp_path):
+    interrupted_run(tmp_path, "final")
+    prompts, complete, frames = store.load(image_generation.checkpoint_key(STORY, 4, "comic", "final"))
+    assert len(prompts) < 4 and not complete
+    assert frames[0]["status"] == "done"
+
+
+def test_interrupted_job_resumes_its_finished_frames(store, tmp_path):
+    interrupted_run(tmp_path, "final")
+    frames = {}
+    for frame in image_generation.iter_story_frames(STORY, 4, "comic", stream=True, output_dir=str(tmp_path / "retry"),
+                                                    tier="final"):
+        frames[frame["index"]] = frame
+    assert frames[0].get("restored")
+    assert all(frames[i]["status"] in image_generation.SUCCESS_FRAME_STATUSES for i in range(4))
+    prompts, complete, _ = store.load(image_generation.checkpoint_key(STORY, 4, "comic", "final"))
+    assert len(prompts) == 4 and complete
+
+
+def test_async_pipeline_resumes_the_same_checkpoint(store, tmp_path):
+    interrupted_run(tmp_path, "draft")
+
+    async def run():
+        return {frame["index"]: frame async for frame in async_pipeline.iter_story_frames_async(
+            STORY, 4, "comic", stream=True, output_dir=str(tmp_path / "async"), tier="draft")}
+    frames = asyncio.run(run())
+    assert frames[0].get("restored")
+    assert len(frames) == 4
+
+
+def test_tiers_keep_separate_checkpoints(store, tmp_path):
+    interrupted_run(tmp_path, "draft")
+    assert store.load(image_generation.checkpoint_key(STORY, 4, "comic", "final")) == (None, False, {})
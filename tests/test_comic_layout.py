@@ -0,0 +1,17 @@
+import pytest
+
+from comic_layout import create_flexible_layout, page_layouts, parse_custom_layout
+
+
+def test_custom_layout_repeats_per_page():
+    layout = "[[0, 0, 1, 0.5], [0, 0.5, 1, 0.5]]"
+    assert [len(page) for page in page_layouts(5, layout)] == [2, 2, 1]
+
+
+@pytest.mark.parametrize("custom_layout", ["[[0,0", "{}", "[]", "[[0, 0, 1]]", "[[0, 0, 0, 1]]", '[["a", 0, 1, 1]]'])
+def test_invalid_custom_layout_is_paginated_as_without_it(custom_layout):
+    with pytest.raises(ValueError):
+        parse_custom_layout(custom_layout)
+    assert page_layouts(30, custom_layout) == page_layouts(30)
+    assert [len(page) for page in page_layouts(30, custom_layout)] == [6, 6, 6, 6, 6]
+    assert create_flexible_layout(4, custom_layout) == create_flexible_layout(4)
@@ -0,0 +1,15 @@
+from PIL import Image
+
+from jobs import frame_gallery_item, frame_full_image
+from mock_image_generation import synthetic_png
+
+
+def test_frame_files_removed_by_the_janitor_fall_back_to_the_kept_bytes(tmp_path):
+    frame = {"thumbnail": str(tmp_path / "frame_1.webp"), "path": str(tmp_path / "frame_1.png"),
+             "image": synthetic_png("A hero", "64x64")}
+    assert isinstance(frame_gallery_item(frame), Image.Image)
+    assert isinstance(frame_full_image(frame), Image.Image)
+
+    (tmp_path / "frame_1.png").write_bytes(frame["image"])
+    assert frame_gallery_item(frame) == frame["path"]
+    assert frame_full_image(frame) == frame["path"]
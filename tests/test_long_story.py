@@ -0,0 +1,18 @@
+from long_story import _parse_sections
+
+
+def test_parse_sections_strips_only_list_markers():
+    answer = "\n".join([
+        "**CHARACTERS:**",
+        "- Linh, a young scout",
+        "• 3 soldiers guarding the gate",
+        "EVENTS:",
+        "1. Linh climbs the wall",
+        "2) 3 soldiers guard the gate",
+        "* 10,000 arrows fall at dawn",
+        "3 soldiers guard the gate",
+    ])
+    characters, events = _parse_sections(answer)
+    assert characters == ["Linh, a young scout", "3 soldiers guarding the gate"]
+    assert events == ["Linh climbs the wall", "3 soldiers guard the gate", "10,000 arrows fall at dawn",
+                      "3 soldiers guard the gate"]
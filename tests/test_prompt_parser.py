@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+from prompt_parser import PromptStreamParser, parse_prompts
+
+# Completions as the chat model returned them for PROMPT_GENERATION_TEMPLATE, with the prompts they hold
+RECORDED_COMPLETIONS = {
+    "plain": (
+        '[1] "A young girl with red braids and a blue dress stands at the edge of a misty forest at dawn, '
+        'holding a lantern. Illustrated in comic style."\n'
+        '[2] "The same girl sits on a mossy log beside a sleeping fox under tall pines, soft morning light. '
+        'Illustrated in comic style."\n'
+        '[3] "The girl and the fox look out over a sunlit valley from a rocky hilltop. Illustrated in comic style."',
+        ["A young girl with red braids and a blue dress stands at the edge of a misty forest at dawn, holding a "
+         "lantern. Illustrated in comic style.",
+         "The same girl sits on a mossy log beside a sleeping fox under tall pines, soft morning light. "
+         "Illustrated in comic style.",
+         "The girl and the fox look out over a sunlit valley from a rocky hilltop. Illustrated in comic style."]
+    ),
+    "preamble_and_commentary": (
+        'Here are the prompts for your story:\n\n'
+        '[1] "An old fisherman in a yellow raincoat mends a net on a wooden pier at sunset."\n\n'
+        '[2] "The fisherman\'s small boat rests on a calm grey sea under low clouds."\n\n'
+        'These prompts capture the story.',
+        ["An old fisherman in a yellow raincoat mends a net on a wooden pier at sunset.",
+         "The fisherman's small boat rests on a calm grey sea under low clouds."]
+    ),
+    "curly_quotes_and_brackets": (
+        '[1] “A knight in silver armour [with a torn red cape] kneels in a ruined chapel.”\n'
+        '[2] “The knight’s sword lies on a stone altar lit by a single candle.”\n',
+        ["A knight in silver armour [with a torn red cape] kneels in a ruined chapel.",
+         "The knight’s sword lies on a stone altar lit by a single candle."]
+    ),
+    "same_line": (
+        '[1] "A robot waters a rooftop garden at night." [2] "The robot watches fireworks over the city."',
+        ["A robot waters a rooftop garden at night.", "The robot watches fireworks over the city."]
+    ),
+    "no_markers": (
+        "A lighthouse on a cliff at dusk, painted in watercolour.",
+        ["A lighthouse on a cliff at dusk, painted in watercolour."]
+    ),
+}
+
+
+def stream(chunks):
+    parser = PromptStreamParser()
+    prompts = []
+    for chunk in chunks:
+        prompts.extend(parser.feed(chunk))
+    return prompts + parser.close()
+
+
+def random_chunks(text, seed):
+    rng = random.Random(seed)
+    chunks, start = [], 0
+    while start < len(text):
+        end = start + rng.randint(1, 12)
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+@pytest.mark.parametrize("name", sorted(RECORDED_COMPLETIONS))
+def test_parse_prompts(name):
+    text, expected = RECORDED_COMPLETIONS[name]
+    assert parse_prompts(text) == expected
+
+
+@pytest.mark.parametrize("name", sorted(RECORDED_COMPLETIONS))
+def test_stream_one_character_at_a_time(name):
+    text, expected = RECORDED_COMPLETIONS[name]
+    assert stream(text) == expected
+
+
+@pytest.mark.parametrize("name", sorted(RECORDED_COMPLETIONS))
+@pytest.mark.parametrize("seed", range(5))
+def test_stream_random_chunks(name, seed):
+    text, expected = RECORDED_COMPLETIONS[name]
+    assert stream(random_chunks(text, seed)) == expected
+
+
+def test_prompt_is_returned_as_soon_as_it_is_complete():
+    parser = PromptStreamParser()
+    assert parser.feed('[1] "A cat on a windowsill."') == []
+    assert parser.feed('\n[2] "A dog') == ["A cat on a windowsill."]
+    assert parser.close() == ["A dog"]
+
+
+def test_empty_completion():
+    assert parse_prompts("") == []
+    assert parse_prompts("   \n") == []
@@ -0,0 +1,70 @@
+import image_generation
+from image_cache import ImageCache
+from similarity_index import SimilarityIndex
+
+PROMPTS = [
+    "A young girl with red braids stands at the edge of a misty forest at dawn, holding a lantern",
+    "A young girl with red braids stands at the edge of a misty forest at dusk, holding a lantern",
+    "A robot waters a rooftop garden at night",
+]
+REWORDED = "A young girl with red braids stands at the edge of the misty forest at dawn, holding a lantern"
+QUERY = "A young girl with red braids stands at the edge of a misty forest at dawn, holding lanterns"
+
+
+def test_search_ranks_matches_best_first(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    for i, prompt in enumerate(PROMPTS):
+        index.add(prompt, "group", f"key{i}")
+    # Indexed again after an eviction: still one match per key
+    index.add(PROMPTS[0], "group", "key0")
+    index.add(PROMPTS[0], "other group", "key3")
+
+    matches = index.search(QUERY, "group")
+    assert [key for key, _ in matches][:2] == ["key0", "key1"]
+    assert len({key for key, _ in matches}) == len(matches)
+    assert [score for _, score in matches] == sorted((score for _, score in matches), reverse=True)
+
+
+def test_compact_keeps_live_keys_for_every_reader(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    reader = SimilarityIndex(str(tmp_path))
+    for i, prompt in enumerate(PROMPTS):
+        index.add(prompt, "group", f"key{i}")
+    assert [key for key, _ in reader.search(QUERY, "group")][:2] == ["key0", "key1"]
+
+    assert index.compact({"key1", "key2"}) == 2
+    assert len(reader) == 2
+    assert [key for key, _ in reader.search(QUERY, "group")] == ["key1"]
+    index.add(PROMPTS[0], "group", "key0")
+    assert [key for key, _ in reader.search(QUERY, "group")] == ["key0", "key1"]
+
+
+def test_cached_image_falls_back_to_the_next_match(tmp_path, monkeypatch):
+    cache = ImageCache(str(tmp_path / "images"), max_bytes=1 << 20)
+    index = SimilarityIndex(str(tmp_path / "similarity"))
+    monkeypatch.setattr(image_generation, "get_similarity_index", lambda: index)
+    monkeypatch.setattr(image_generation, "SIMILAR_PROMPT_THRESHOLD", 0.88)
+    image_generation.store_image(cache, PROMPTS[0], b"dawn")
+    image_generation.store_image(cache, REWORDED, b"dawn, reworded")
+    image_generation.store_image(cache, PROMPTS[1], b"dusk")
+    image_generation.store_image(cache, PROMPTS[2], b"robot")
+
+    # The closest prompt's image was evicted, the next one above the threshold is reused
+    cache._db().execute("DELETE FROM entries WHERE key = ?", (image_generation.frame_image_key(PROMPTS[0]),))
+    assert image_generation.cached_image(cache, QUERY) == b"dawn, reworded"
+    # The same scene at another time of day is a different picture
+    cache._db().execute("DELETE FROM entries WHERE key = ?", (image_generation.frame_image_key(REWORDED),))
+    cache._db().execute("DELETE FROM entries WHERE key = ?", (image_generation.frame_image_key(QUERY),))
+    assert image_generation.cached_image(cache, QUERY) is None
+    assert image_generation.cached_image(cache, "A lighthouse on a cliff at dusk") is None
+
+
+def test_store_image_compacts_the_index_after_evictions(tmp_path, monkeypatch):
+    # Room for two images, so every store evicts the oldest
+    cache = ImageCache(str(tmp_path / "images"), max_bytes=8)
+    index = SimilarityIndex(str(tmp_path / "similarity"))
+    monkeypatch.setattr(image_generation, "get_similarity_index", lambda: index)
+    for i in range(20):
+        image_generation.store_image(cache, f"A hero in scene {i}", b"png!")
+    assert len(cache) == 2
+    assert len(index) <= 4
@@ -0,0 +1,51 @@
+# Story text layout for create_pdf: wrap once, paginate, then draw each page as one text object.
+# Widths are summed per word instead of re-measuring the growing line, so wrapping is linear.
+
+
+def wrap_lines(text, max_width, word_width, space_width):
+    # Greedy single-pass wrap. Returns one string per printed line, "" for blank lines;
+    # a word wider than max_width gets a line of its own.
+    lines = []
+    for paragraph in text.split('\n'):
+        words = paragraph.split()
+        if not words:
+            lines.append("")
+            continue
+
+        current_line = []
+        current_width = 0
+        for word in words:
+            width = word_width(word)
+            if current_line and current_width + space_width + width > max_width:
+                lines.append(' '.join(current_line))
+                current_line = [word]
+                current_width = width
+            else:
+                current_width += width + (space_width if current_line else 0)
+                current_line.append(word)
+        lines.append(' '.join(current_line))
+    return lines
+
+
+def lines_per_page(top, bottom, line_height):
+    # Lines whose baseline fits between top and bottom, stepping down line_height each time
+    count = 1
+    y_position = top - line_height
+    while y_position >= bottom:
+        count += 1
+        y_position -= line_height
+    return count
+
+
+def paginate(lines, page_lines):
+    return [lines[i:i + page_lines] for i in range(0, len(lines), page_lines)]
+
+
+def draw_text_page(c, lines, x, top, font_name, font_size, line_height, fill_color):
+    # The whole page goes out as a single text object instead of one drawString per line
+    text_object = c.beginText(x, top)
+    text_object.setFont(font_name, font_size, leading=line_height)
+    text_object.setFillColor(fill_color)
+    for line in lines:
+        text_object.textLine(line)
+    c.drawText(text_object)
@@ -0,0 +1,95 @@
+import asyncio
+import contextvars
+import functools
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, features
+
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Longest side of the gallery previews in pixels
+THUMBNAIL_SIZE = int(os.environ.get("STORYGEN_THUMBNAIL_SIZE", "384"))
+# WEBP or JPEG; WEBP falls back to JPEG when Pillow was built without it
+THUMBNAIL_FORMAT = os.environ.get("STORYGEN_THUMBNAIL_FORMAT", "WEBP").upper()
+THUMBNAIL_QUALITY = int(os.environ.get("STORYGEN_THUMBNAIL_QUALITY", "75"))
+THUMBNAIL_WORKERS = int(os.environ.get("STORYGEN_THUMBNAIL_WORKERS", "2"))
+# Subdirectory of the frame's directory holding its previews
+THUMBNAIL_DIR = ".thumbs"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def thumbnail_format():
+    if THUMBNAIL_FORMAT == "WEBP" and not features.check("webp"):
+        return "JPEG"
+    return THUMBNAIL_FORMAT
+
+
+def make_thumbnail(image_data, size=None, image_format=None, quality=None):
+    # A small preview of the PNG bytes of a frame, encoded as WebP or JPEG
+    size = THUMBNAIL_SIZE if size is None else size
+    image_format = thumbnail_format() if image_format is None else image_format
+    quality = THUMBNAIL_QUALITY if quality is None else quality
+
+    with Image.open(io.BytesIO(image_data)) as source:
+        # draft() lets JPEG sources decode at a reduced scale; PNGs are decoded in full
+        source.draft("RGB", (size, size))
+        preview = source.convert("RGBA" if image_format == "WEBP" and "A" in source.getbands() else "RGB")
+    preview.thumbnail((size, size), Image.LANCZOS)
+
+    output = io.BytesIO()
+    preview.save(output, format=image_format, quality=quality)
+    return output.getvalue()
+
+
+def thumbnail_path(directory, image_hash):
+    extension = "webp" if thumbnail_format() == "WEBP" else "jpg"
+    return os.path.join(directory, THUMBNAIL_DIR, f"{image_hash}.{extension}")
+
+
+def frame_thumbnail(frame, directory):
+    # Path of the preview of a finished frame, made once per image hash in the job's workspace: frames of
+    # the same job with the same image share it, other jobs make their own
+    path = thumbnail_path(directory, frame["image_hash"])
+    if os.path.exists(path):
+        return path
+
+    with span("thumbnail", frame=frame["index"] + 1):
+        thumbnail = make_thumbnail(frame["image"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name, so a concurrent reader never sees half a file
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(thumbnail)
+        os.replace(temporary_path, path)
+    return path
+
+
+def thumbnail_executor():
+    # Decoding a 1024x1024 PNG takes tens of milliseconds; a small pool keeps that off the event loop
+    # and bounds how many frames are decoded at once
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, THUMBNAIL_WORKERS), thread_name_prefix="thumbnails")
+    return _executor
+
+
+async def frame_thumbnail_async(frame, directory):
+    # frame_thumbnail on the thumbnail pool; None when the preview could not be made, so the full frame is shown
+    loop = asyncio.get_running_loop()
+    try:
+        # The job ID follows the call into the pool
+        call = functools.partial(contextvars.copy_context().run, frame_thumbnail, frame, directory)
+        return await loop.run_in_executor(thumbnail_executor(), call)
+    except Exception as e:
+        logger.warning("Could not create the thumbnail of frame %d: %s", frame["index"] + 1, str(e))
+        return None
@@ -1,252 +1,23 @@
 import gradio as gr
-from image_generation import read_story_from_file, process_story
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus import Paragraph, Frame
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.colors import Color
-import textwrap
-import json
+from image_generation import read_story_from_file, SUCCESS_FRAME_STATUSES, RENDER_TIER
+from async_pipeline import iter_story_frames_async, iter_finalized_frames_async, render_pdf_async
+from comic_layout import page_layouts, parse_custom_layout
+from jobs import (new_job, update_job_frame, update_job_final_frame, job_images, job_gallery, job_pdf_path,
+                  frame_gallery_item, frame_full_image, job_frame_at, job_frames_to_finalize)
+from thumbnails import frame_thumbnail_async
+from page_preview import render_pages
+from workspace import start_janitor, touch_workspace
+from telemetry import configure_logging, start_metrics_server
 import os
 
-# Register fonts
-pdfmetrics.registerFont(TTFont('DejaVuSans', 'Fonts/dsf/DejaVuSans.ttf'))
-pdfmetrics.registerFont(TTFont('ComicSansMS', 'Fonts/dsf/DejaVuSans.ttf'))
-
-def create_flexible_layout(num_images, custom_layout=None, layout_style='default'):
-    # Each number of frames now has 3 layout options
-    default_layouts = {
-        1: {
-            'default': [(0, 0, 1, 1)],  # Single full frame
-            'option1': [(0.1, 0.1, 0.8, 0.8)],  # Centered frame with margin
-            'option2': [(0.2, 0, 0.6, 1)]  # Centered vertical strip
-        },
-        2: {
-            'default': [(0, 0, 0.5, 1), (0.5, 0, 0.5, 1)],  # Vertical split
-            'option1': [(0, 0, 1, 0.5), (0, 0.5, 1, 0.5)],  # Horizontal split
-            'option2': [(0.1, 0, 0.4, 1), (0.5, 0, 0.4, 1)]  # Vertical split with margins
-        },
-        3: {
-            'default': [(0, 0, 0.5, 0.5), (0.5, 0, 0.5, 0.5), (0, 0.5, 1, 0.5)],  # Two top, one bottom
-            'option1': [(0, 0, 1, 0.4), (0, 0.4, 0.5, 0.6), (0.5, 0.4, 0.5, 0.6)],  # One top, two bottom
-            'option2': [(0, 0, 0.33, 1), (0.33, 0, 0.34, 1), (0.67, 0, 0.33, 1)]  # Three vertical strips
-        },
-        4: {
-            'default': [(0, 0, 0.5, 0.5), (0.5, 0, 0.5, 0.5), (0, 0.5, 0.5, 0.5), (0.5, 0.5, 0.5, 0.5)],  # Grid
-            'option1': [(0, 0, 1, 0.4), (0, 0.4, 0.33, 0.6), (0.33, 0.4, 0.34, 0.6), (0.67, 0.4, 0.33, 0.6)],  # One top, three bottom
-            'option2': [(0, 0, 0.25, 1), (0.25, 0, 0.25, 1), (0.5, 0, 0.25, 1), (0.75, 0, 0.25, 1)]  # Four vertical strips
-        },
-        5: {
-            'default': [(0, 0, 0.33, 0.5), (0.33, 0, 0.33, 0.5), (0.66, 0, 0.34, 0.5),
-                        (0, 0.5, 0.5, 0.5), (0.5, 0.5, 0.5, 0.5)],  # Three top, two bottom
-            'option1': [(0, 0, 1, 0.4), (0, 0.4, 0.25, 0.6), (0.25, 0.4, 0.25, 0.6),
-                        (0.5, 0.4, 0.25, 0.6), (0.75, 0.4, 0.25, 0.6)],  # One top, four bottom
-            'option2': [(0, 0, 0.2, 1), (0.2, 0, 0.2, 1), (0.4, 0, 0.2, 1),
-                        (0.6, 0, 0.2, 1), (0.8, 0, 0.2, 1)]  # Five vertical strips
-        },
-        6: {
-            'default': [(0, 0, 0.33, 0.5), (0.33, 0, 0.33, 0.5), (0.66, 0, 0.34, 0.5),
-                        (0, 0.5, 0.33, 0.5), (0.33, 0.5, 0.33, 0.5), (0.66, 0.5, 0.34, 0.5)],  # 3x2 grid
-            'option1': [(0, 0, 1, 0.33), (0, 0.33, 0.5, 0.34), (0.5, 0.33, 0.5, 0.34),
-                        (0, 0.67, 0.33, 0.33), (0.33, 0.67, 0.33, 0.33), (0.66, 0.67, 0.34, 0.33)],  # One top, two middle, three bottom
-            'option2': [(0, 0, 0.167, 1), (0.167, 0, 0.167, 1), (0.334, 0, 0.167, 1),
-                        (0.501, 0, 0.167, 1), (0.668, 0, 0.167, 1), (0.835, 0, 0.165, 1)]  # Six vertical strips
-        }
-    }
-
-    if custom_layout:
-        try:
-            return json.loads(custom_layout)
-        except json.JSONDecodeError:
-            print("Invalid custom layout. Using default.")
-
-    return default_layouts.get(num_images, default_layouts[4])[layout_style]
-
-
-def create_pdf(images, story_content, title, font_size, custom_layout, border_thickness, dialogue_position, frame_color,
-               full_fill=False, layout_style='default'):
-    # Đăng ký font Unicode
-    try:
-        pdfmetrics.registerFont(TTFont('DejaVuSans', 'Fonts/DejaVuSans.ttf'))
-        pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', 'Fonts/DejaVuSans-Bold.ttf'))
-        main_font = 'DejaVuSans'
-    except:
-        try:
-            pdfmetrics.registerFont(TTFont('ArialUnicode', 'Fonts/ArialUnicode.ttf'))
-            main_font = 'ArialUnicode'
-        except:
-            main_font = 'ComicSansMS'
-            print("Warning: No Unicode font available. Vietnamese characters may not display correctly.")
-
-    pdf_path = "story_output.pdf"
-    page_width, page_height = A4
-    margin = 0.5 * inch
-    content_width = page_width - 2 * margin
-    content_height = page_height - 2 * margin
-
-    c = canvas.Canvas(pdf_path, pagesize=A4)
-
-    # First page - Images
-    # Set title
-    title_height = 1 * inch
-    c.setFont(main_font, font_size + 8)
-    c.setFillColor(Color(0.1, 0.1, 0.1))
-    c.drawCentredString(page_width / 2, page_height - 0.5 * inch, title)
-
-    # Adjust content area for images
-    image_area_height = content_height * 0.8
-    image_start_y = page_height - margin - title_height - image_area_height
-
-    # Create flexible layout with specified style
-    layout = create_flexible_layout(len(images), custom_layout, layout_style)
-
-    # Parse frame color
-    frame_color = Color(*[int(frame_color.lstrip('#')[i:i + 2], 16) / 255 for i in (0, 2, 4)])
-
-    # Map dialogue positions
-    dialogue_position_map = {
-        "Inside Top": "inside_top",
-        "Inside Bottom": "inside_bottom",
-        "Outside Bottom": "outside_bottom"
-    }
-    position = dialogue_position_map.get(dialogue_position, "inside_bottom")
-
-    # Draw images
-    for i, (img_path, (x, y, w, h)) in enumerate(zip(images, layout)):
-        img_x = margin + x * content_width
-        img_y = image_start_y + (1 - y - h) * image_area_height
-        img_w = w * content_width
-        img_h = h * image_area_height
-
-        c.setStrokeColor(frame_color)
-        c.setLineWidth(border_thickness)
-        c.rect(img_x, img_y, img_w, img_h)
-
-        image_margin = border_thickness / 2
-        if full_fill:
-            c.drawImage(img_path,
-                        img_x + image_margin,
-                        img_y + image_margin,
-                        width=img_w - 2 * image_margin,
-                        height=img_h - 2 * image_margin,
-                        mask='auto')
-        else:
-            c.drawImage(img_path,
-                        img_x + image_margin,
-                        img_y + image_margin,
-                        width=img_w - 2 * image_margin,
-                        height=img_h - 2 * image_margin,
-                        preserveAspectRatio=True,
-                        mask='auto')
-
-        if dialogue_position != "None":
-            c.setFont(main_font, font_size)
-            dialogue_text = f"{i + 1}"
-
-            bubble_margin = 10
-            text_width = c.stringWidth(dialogue_text, main_font, font_size)
-            bubble_width = min(text_width + 2 * bubble_margin, img_w - 2 * bubble_margin)
-            bubble_height = font_size + 2 * bubble_margin
-
-            if position == "inside_bottom":
-                bubble_x = img_x + img_w / 2 - bubble_width / 2
-                bubble_y = img_y + bubble_height + border_thickness
-            elif position == "outside_bottom":
-                bubble_x = img_x + img_w / 2 - bubble_width / 2
-                bubble_y = img_y - bubble_height
-            else:  # inside_top
-                bubble_x = img_x + img_w / 2 - bubble_width / 2
-                bubble_y = img_y + img_h - bubble_height - border_thickness
-
-            c.setFillColor(Color(1, 1, 1))
-            c.setStrokeColor(frame_color)
-            c.roundRect(bubble_x, bubble_y, bubble_width, bubble_height, 5, fill=1, stroke=1)
-
-            c.setFillColor(Color(0.1, 0.1, 0.1))
-            c.drawCentredString(bubble_x + bubble_width / 2, bubble_y + bubble_margin, dialogue_text)
-
-    # New page for story
-    c.showPage()
-
-    # Story page settings
-    c.setFont(main_font, font_size + 8)
-    c.setFillColor(Color(0.1, 0.1, 0.1))
-    c.drawCentredString(page_width / 2, page_height - 0.5 * inch, f"{title} - Story")
-
-    # Draw story content
-    text_object = c.beginText()
-    text_object.setFont(main_font, font_size)
-    text_object.setFillColor(Color(0.1, 0.1, 0.1))
-    text_object.setTextOrigin(margin, page_height - margin - title_height)
-
-    # Calculate maximum width for text wrapping
-    max_width = page_width - 2 * margin
-
-    # Process and draw text line by line
-    y_position = page_height - margin - title_height
-    current_page_height = margin
-    line_height = font_size * 1.2
-
-    lines = story_content.split('\n')
-
-    for line in lines:
-        # If empty line, add extra spacing
-        if not line.strip():
-            y_position -= line_height
-            if y_position < margin:
-                c.showPage()
-                y_position = page_height - margin - title_height
-            continue
-
-        # Handle regular lines
-        if len(line.strip()) > 0:
-            # Wrap text if too long
-            words = line.split()
-            current_line = []
-
-            for word in words:
-                current_line.append(word)
-                test_line = ' '.join(current_line)
-
-                # Check if current line is too wide
-                if c.stringWidth(test_line, main_font, font_size) > max_width:
-                    if len(current_line) > 1:
-                        current_line.pop()  # Remove last word
-                        final_line = ' '.join(current_line)
-                        c.setFont(main_font, font_size)
-                        c.drawString(margin, y_position, final_line)
-                        current_line = [word]  # Start new line with remaining word
-                    else:
-                        # Handle case where single word is too long
-                        c.setFont(main_font, font_size)
-                        c.drawString(margin, y_position, test_line)
-                        current_line = []
-
-                    y_position -= line_height
-                    if y_position < margin:
-                        c.showPage()
-                        y_position = page_height - margin - title_height
-
-            # Draw remaining words in current line
-            if current_line:
-                final_line = ' '.join(current_line)
-                c.setFont(main_font, font_size)
-                c.drawString(margin, y_position, final_line)
-                y_position -= line_height
-                if y_position < margin:
-                    c.showPage()
-                    y_position = page_height - margin - title_height
-
-    c.save()
-    return pdf_path
-
 def create_layout_preview(n, style='default'):
-    layout = create_flexible_layout(n, layout_style=style)
-    svg_content = f"""
-    <svg viewBox="0 0 100 100" style="width: 100%; max-width: 200px; border: 1px solid #ddd; border-radius: 8px; padding: 8px;">
+    # One small page per panel page; frame numbers run across pages
+    pages = page_layouts(int(n), layout_style=style)
+    page_svgs = []
+    first = 0
+    for layout in pages:
+        page_svgs.append(f"""
+    <svg viewBox="0 0 100 100" style="width: {100 if len(pages) == 1 else 30}%; max-width: 200px; border: 1px solid #ddd; border-radius: 8px; padding: 8px;">
         <style>
             .frame {{ fill: white; stroke: #666; stroke-width: 1; }}
             .frame-number {{ font-size: 4px; fill: #666; text-anchor: middle; dominant-baseline: middle; }}
@@ -254,13 +25,36 @@ def create_layout_preview(n, style='default'):
         {''.join([
             f'<rect x="{x*100}" y="{y*100}" width="{w*100}" height="{h*100}" class="frame"/>'
             f'<text x="{(x*100 + w*50)}" y="{(y*100 + h*50)}" class="frame-number">{i+1}</text>'
-            for i, (x,y,w,h) in enumerate(layout)
+            for i, (x,y,w,h) in enumerate(layout, first)
         ])}
-    </svg>
-    """
-    return svg_content
-
-def interface(
+    </svg>""")
+        first += len(layout)
+    return f'<div style="display: flex; flex-wrap: wrap; gap: 8px;">{"".join(page_svgs)}</div>'
+
+FRAME_STATUS_ICONS = {
+    "queued": "⏳ queued",
+    "generating": "🎨 generating",
+    "done": "✅ done",
+    "cached": "⚡ cached",
+    "failed": "❌ failed"
+}
+
+
+def format_frame_status(frames):
+    rows = ["| Frame | Status | Prompt |", "|---|---|---|"]
+    for i in sorted(frames):
+        frame = frames[i]
+        prompt = frame["prompt"] if len(frame["prompt"]) <= 80 else frame["prompt"][:77] + "..."
+        status = FRAME_STATUS_ICONS.get(frame["status"], frame["status"])
+        if frame.get("tier") == "draft" and frame["status"] in SUCCESS_FRAME_STATUSES:
+            status += f" (draft, final failed: {frame['final_error']})" if frame.get("final_error") else " (draft)"
+        if frame["status"] == "failed":
+            status += f" ({frame['error']})"
+        rows.append(f"| {i + 1} | {status} | {prompt.replace('|', '/')} |")
+    return "\n".join(rows)
+
+
+async def stream_interface(
         story_content,
         story_file,
         title,
@@ -272,26 +66,40 @@ def interface(
         frame_color,
         full_fill,
         custom_layout,
-        layout_style  # Thêm tham số này
+        layout_style,
+        draft_mode=False
 ):
+    # Yields (gallery, frame status, pdf, job) as each frame lands.
+    # Runs on the event loop, so one process serves many generations without a thread each.
+    # Draft mode renders cheap low-resolution frames that Finalize later replaces.
     if story_file is not None:
         story_content = read_story_from_file(story_file)
 
     if not story_content:
-        return [("Error", "Please enter story content or upload a txt file")], None
+        yield [], "Please enter story content or upload a txt file", None, None
+        return
 
     num_frames = int(num_frames) if num_frames else 2
 
-    result_images = process_story(story_content, num_frames, art_style)
-    valid_images = [img_path for _, img_path in result_images if
-                    not img_path.startswith("Error") and os.path.exists(img_path)]
-
+    job = new_job(story_content, num_frames, art_style)
+    frames = job["frames"]
+    gallery_items = []
+    async for frame in iter_story_frames_async(story_content, num_frames, art_style, output_dir=job["workspace"],
+                                               job_id=job["id"], tier="draft" if draft_mode else "final"):
+        update_job_frame(job, frame)
+        if frame["status"] in SUCCESS_FRAME_STATUSES:
+            # The pipeline keeps going while the preview is made on the thumbnail pool
+            frame["thumbnail"] = await frame_thumbnail_async(frame, job["workspace"])
+            gallery_items.append((frame["index"], frame_gallery_item(frame)))
+            gallery_items.sort(key=lambda item: item[0])
+        yield [item for _, item in gallery_items], format_frame_status(frames), None, None
+
+    valid_images = job_images(job)
     if not valid_images:
-        return [("Error", "No valid images generated")], None
+        yield [], format_frame_status(frames) + "\n\nNo valid images generated", None, None
+        return
 
-    print(f"Story content: {story_content}")
-
-    pdf_path = create_pdf(
+    pdf_path = await render_pdf_async(
         valid_images,
         story_content,
         title,
@@ -301,10 +109,118 @@ def interface(
         dialogue_position,
         frame_color,
         full_fill,
-        layout_style  # Thêm parameter này
+        layout_style,
+        pdf_path=job_pdf_path(job),
+        job_id=job["id"]
     )
 
-    return valid_images, pdf_path
+    yield [item for _, item in gallery_items], format_frame_status(frames), pdf_path, job
+
+
+async def relayout(
+        job,
+        title,
+        font_size,
+        border_thickness,
+        dialogue_position,
+        frame_color,
+        full_fill,
+        custom_layout,
+        layout_style
+):
+    # Rebuild only the PDF from the images of the last generation, no API calls
+    if not job or not job_images(job):
+        raise gr.Error("Generate a comic first, then re-layout it")
+    # The frames are in the session, only the workspace for the PDF may have been cleaned up
+    os.makedirs(job["workspace"], exist_ok=True)
+    touch_workspace(job["workspace"])
+
+    return await render_pdf_async(
+        job_images(job),
+        job["story_content"],
+        title,
+        font_size,
+        custom_layout,
+        border_thickness,
+        dialogue_position,
+        frame_color,
+        full_fill,
+        layout_style,
+        pdf_path=job_pdf_path(job),
+        job_id=job["id"]
+    )
+
+async def finalize(
+        job,
+        selection,
+        title,
+        font_size,
+        border_thickness,
+        dialogue_position,
+        frame_color,
+        full_fill,
+        custom_layout,
+        layout_style
+):
+    # Re-render the approved draft frames at full quality from the same prompts, then rebuild the PDF.
+    # Frames that are already final are kept, so finalizing twice costs nothing.
+    if not job or not job_images(job):
+        raise gr.Error("Generate a comic first, then finalize it")
+    try:
+        frames = job_frames_to_finalize(job, selection)
+    except ValueError as e:
+        raise gr.Error(str(e))
+    os.makedirs(job["workspace"], exist_ok=True)
+    touch_workspace(job["workspace"])
+
+    yield job_gallery(job), format_frame_status(job["frames"]), None, job
+    async for frame in iter_finalized_frames_async(frames, output_dir=job["workspace"], job_id=job["id"]):
+        update_job_final_frame(job, frame)
+        if frame["status"] in SUCCESS_FRAME_STATUSES:
+            frame["thumbnail"] = await frame_thumbnail_async(frame, job["workspace"])
+        yield job_gallery(job), format_frame_status(job["frames"]), None, job
+
+    pdf_path = await render_pdf_async(
+        job_images(job),
+        job["story_content"],
+        title,
+        font_size,
+        custom_layout,
+        border_thickness,
+        dialogue_position,
+        frame_color,
+        full_fill,
+        layout_style,
+        pdf_path=job_pdf_path(job),
+        job_id=job["id"]
+    )
+    yield job_gallery(job), format_frame_status(job["frames"]), pdf_path, job
+
+def update_page_preview(job, num_frames, title, font_size, border_thickness, dialogue_position, frame_color,
+                        full_fill, custom_layout, layout_style):
+    # The composed panel pages as the PDF will lay them out: the frames of the last generation, or empty
+    # panels before there is one. Cheap enough to redraw on every settings change.
+    images = job_images(job) if job else []
+    if not images:
+        images = [None] * int(num_frames or 1)
+    if custom_layout:
+        try:
+            parse_custom_layout(custom_layout)
+        except ValueError as e:
+            # The PDF ignores it too, so show the layout it falls back to
+            gr.Warning(f"{e}. Using the {layout_style} layout.")
+            custom_layout = None
+    try:
+        return render_pages(images, title, font_size, custom_layout, border_thickness, dialogue_position,
+                            frame_color, full_fill, layout_style)
+    except (TypeError, ValueError):
+        # A setting the user is still editing; keep the last preview
+        return gr.update()
+
+def show_full_frame(job, evt: gr.SelectData):
+    # Full resolution only for the frame the user selects in the thumbnail gallery
+    frame = job_frame_at(job, evt.index) if job else None
+    return frame_full_image(frame) if frame else None
 
 # Create the main interface
 with gr.Blocks(title="Story to Comic Generator", theme=gr.themes.Soft()) as iface:
@@ -354,11 +270,11 @@ with gr.Blocks(title="Story to Comic Generator", theme=gr.themes.Soft()) as ifac
                         with gr.Column():
                             num_frames = gr.Slider(
                                 minimum=1,
-                                maximum=6,
+                                maximum=100,
                                 step=1,
                                 label="Number of Frames",
                                 value=2,
-                                info="How many panels should your comic have?",
+                                info="How many panels should your comic have? Long comics continue over several pages",
                                 elem_classes="slider-frames"
                             )
 
@@ -378,6 +294,12 @@ with gr.Blocks(title="Story to Comic Generator", theme=gr.themes.Soft()) as ifac
                                 info="Choose the visual style for your comic",
                                 elem_classes="dropdown-style"
                             )
+                            draft_mode = gr.Checkbox(
+                                label="Draft Mode",
+                                value=RENDER_TIER == "draft",
+                                info="Fast, low-resolution frames for trying styles and layouts; "
+                                     "finalize the ones you like"
+                            )
                             frame_color = gr.ColorPicker(
                                 label="Frame Color",
                                 value="#4A4A4A",
@@ -465,6 +387,9 @@ with gr.Blocks(title="Story to Comic Generator", theme=gr.themes.Soft()) as ifac
                                     """)
 
     # Output Section
+    # Prompts and images of the last generation, reused by Re-layout
+    job_state = gr.State()
+
     with gr.Row():
         generate_btn = gr.Button(
             "🎨 Generate Comic",
@@ -472,6 +397,23 @@ with gr.Blocks(title="Story to Comic Generator", theme=gr.themes.Soft()) as ifac
             scale=2,
             size="lg"
         )
+        relayout_btn = gr.Button(
+            "🔄 Re-layout PDF",
+            variant="secondary",
+            scale=1,
+            size="lg"
+        )
+        finalize_btn = gr.Button(
+            "✨ Finalize",
+            variant="secondary",
+            scale=1,
+            size="lg"
+        )
+        finalize_selection = gr.Textbox(
+            label="Frames to Finalize",
+            placeholder="All frames, or e.g. 1, 3-4",
+            scale=1
+        )
 
     with gr.Row():
         with gr.Column():
@@ -479,15 +421,25 @@ with gr.Blocks(title="Story to Comic Generator", theme=gr.themes.Soft()) as ifac
                 label="Generated Comic Frames",
                 elem_classes="gallery-output"
             )
+            frame_status = gr.Markdown()
         with gr.Column():
             pdf_output = gr.File(
                 label="📥 Download Comic PDF",
                 elem_classes="pdf-output"
             )
+            full_frame = gr.Image(
+                label="Full Resolution (select a frame)",
+                interactive=False
+            )
+            page_preview = gr.Gallery(
+                label="🖼️ Page Preview",
+                columns=2,
+                elem_classes="page-preview"
+            )
 
 # Connect the interface
-    generate_btn.click(
-        interface,
+    generate_event = generate_btn.click(
+        stream_interface,
         inputs=[
             story_content,
             story_file,
@@ -500,10 +452,69 @@ with gr.Blocks(title="Story to Comic Generator", theme=gr.themes.Soft()) as ifac
             frame_color,
             full_fill,
             custom_layout,
-            layout_style  # Thêm input này
+            layout_style,  # Thêm input này
+            draft_mode
+        ],
+        outputs=[gallery, frame_status, pdf_output, job_state]
+    )
+
+    # Full-quality renders of the approved drafts only, from the prompts of the last generation
+    finalize_event = finalize_btn.click(
+        finalize,
+        inputs=[
+            job_state,
+            finalize_selection,
+            title,
+            font_size,
+            border_thickness,
+            dialogue_position,
+            frame_color,
+            full_fill,
+            custom_layout,
+            layout_style
+        ],
+        outputs=[gallery, frame_status, pdf_output, job_state]
+    )
+
+    gallery.select(show_full_frame, inputs=[job_state], outputs=[full_frame])
+
+    # The page preview follows every layout and text setting, and the frames once they are in
+    preview_inputs = [job_state, num_frames, title, font_size, border_thickness, dialogue_position, frame_color,
+                      full_fill, custom_layout, layout_style]
+    for setting in [num_frames, title, font_size, border_thickness, dialogue_position, frame_color, full_fill,
+                    layout_style]:
+        setting.change(update_page_preview, inputs=preview_inputs, outputs=[page_preview],
+                       show_progress="hidden", trigger_mode="always_last")
+    # Checked once the user is done typing, so half-written JSON does not raise a warning per keystroke
+    custom_layout.blur(update_page_preview, inputs=preview_inputs, outputs=[page_preview], show_progress="hidden",
+                       trigger_mode="always_last")
+    for event in (generate_event, finalize_event):
+        event.then(update_page_preview, inputs=preview_inputs, outputs=[page_preview], show_progress="hidden")
+    iface.load(update_page_preview, inputs=preview_inputs, outputs=[page_preview], show_progress="hidden")
+
+    # Layout and text settings only affect create_pdf, so no need to regenerate the images
+    relayout_btn.click(
+        relayout,
+        inputs=[
+            job_state,
+            title,
+            font_size,
+            border_thickness,
+            dialogue_position,
+            frame_color,
+            full_fill,
+            custom_layout,
+            layout_style
         ],
-        outputs=[gallery, pdf_output]
+        outputs=[pdf_output]
     )
 
 if __name__ == "__main__":
-    iface.launch()
\ No newline at end of file
+    configure_logging()
+    # Prometheus scrapes /metrics on its own port, next to the Gradio app
+    start_metrics_server()
+    # Jobs write to their own workspaces, so requests can run side by side
+    start_janitor()
+    # Generator callbacks stream their updates through the queue; they are async, so the limit is
+    # concurrent generations on the event loop rather than worker threads
+    iface.queue(default_concurrency_limit=int(os.environ.get("STORYGEN_UI_CONCURRENCY", "32"))).launch()
\ No newline at end of file
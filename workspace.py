@@ -0,0 +1,96 @@
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Every request writes its frames and PDF under JOBS_DIR/<job id>
+JOBS_DIR = os.environ.get("STORYGEN_JOBS_DIR", "jobs")
+# Workspaces untouched for longer than this are removed by the janitor
+JOB_TTL_SECONDS = int(os.environ.get("STORYGEN_JOB_TTL_SECONDS", "3600"))
+# Oldest workspaces are removed first once their total size goes over the quota
+JOBS_MAX_BYTES = int(os.environ.get("STORYGEN_JOBS_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+JANITOR_INTERVAL_SECONDS = int(os.environ.get("STORYGEN_JANITOR_INTERVAL_SECONDS", "300"))
+# The quota never removes a workspace this recent, it probably belongs to a running job
+QUOTA_GRACE_SECONDS = 60
+
+
+def create_job_workspace(job_id):
+    path = os.path.join(JOBS_DIR, job_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def touch_workspace(path):
+    # Re-layout and other reuse of a job keeps its workspace alive
+    if os.path.isdir(path):
+        os.utime(path)
+
+
+def _directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def clean_workspaces(now=None):
+    # Returns (removed workspaces, bytes freed)
+    if not os.path.isdir(JOBS_DIR):
+        return 0, 0
+    now = time.time() if now is None else now
+
+    workspaces = []
+    for entry in os.scandir(JOBS_DIR):
+        if entry.is_dir(follow_symlinks=False):
+            try:
+                workspaces.append((entry.stat().st_mtime, entry.path, _directory_size(entry.path)))
+            except FileNotFoundError:
+                continue
+    workspaces.sort()
+
+    removed, freed = 0, 0
+    total = sum(size for _, _, size in workspaces)
+    for mtime, path, size in workspaces:
+        expired = now - mtime > JOB_TTL_SECONDS
+        over_quota = total > JOBS_MAX_BYTES and now - mtime > QUOTA_GRACE_SECONDS
+        if not (expired or over_quota):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+        freed += size
+        total -= size
+
+    if removed:
+        logger.info("Janitor removed %d job workspaces (%.1f MB)", removed, freed / 1024 / 1024)
+    return removed, freed
+
+
+_janitor = None
+_janitor_lock = threading.Lock()
+
+
+def start_janitor(interval=None):
+    # Background thread that runs clean_workspaces every interval seconds, started once per process
+    global _janitor
+    interval = JANITOR_INTERVAL_SECONDS if interval is None else interval
+
+    def run():
+        while True:
+            try:
+                clean_workspaces()
+            except Exception:
+                logger.exception("Janitor error")
+            time.sleep(interval)
+
+    with _janitor_lock:
+        if _janitor is None:
+            _janitor = threading.Thread(target=run, name="workspace-janitor", daemon=True)
+            _janitor.start()
+    return _janitor